@@ -1,37 +1,87 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
 import os
 from dotenv import load_dotenv
-from models import User
 from models import db
+from config import config_by_name
+from utils.db_pool import engine_options
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
 
-# Configure CORS
-CORS(app)
+def create_app(config_name=None, **overrides):
+    """
+    Build the Flask app.
 
-# Configure database
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'mssql+pyodbc:///?odbc_connect=DRIVER={ODBC Driver 17 for SQL Server};SERVER=localhost;DATABASE=NearBuy;Trusted_Connection=yes')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_key_change_in_production')
+    ``config_name`` picks a class from config.config_by_name and defaults to
+    the NEARBUY_CONFIG environment variable, else 'default'. Keyword
+    arguments override single settings. Nothing here touches the database:
+    connections, indexes and background threads are all created on first use.
+    """
+    app = Flask(__name__)
 
-# db = SQLAlchemy(app)
-db.init_app(app) 
-# Import routes after app initialization to avoid circular imports
-from routes import register_blueprints
+    # Configure CORS
+    CORS(app)
+
+    # Configure database
+    app.config.from_object(config_by_name[config_name or os.getenv('NEARBUY_CONFIG', 'default')])
+    app.config.update(overrides)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+
+    # One JSON encoding for Decimal, datetime and time, through orjson when it is installed
+    from utils import json_encoding
+    json_encoding.init_app(app)
+
+    # Search history is written in batches off the request path
+    from utils.search_history import search_history_writer
+    search_history_writer.init_app(app)
+
+    # Catalog reads are served from the response cache when possible
+    from utils.cache import response_cache
+    response_cache.init_app(app)
+
+    # Authenticated requests reuse recently verified users instead of querying them again
+    from utils.principal_cache import principal_cache
+    principal_cache.init_app(app)
+
+    # Passwords are hashed on a bounded pool of their own so login bursts cannot take every worker
+    from utils.passwords import password_hasher
+    password_hasher.init_app(app)
+
+    # Admin dashboard figures are read from a snapshot refreshed in the background
+    from utils.analytics import analytics_snapshot
+    analytics_snapshot.init_app(app)
+
+    # Optional per-request SQL accounting and N+1 detection
+    from utils.sql_profiler import query_profiler
+    query_profiler.init_app(app)
+
+    # Request counts, latencies, payload sizes and DB time at /metrics
+    from utils.metrics import metrics
+    metrics.init_app(app)
+
+    # Import routes after app initialization to avoid circular imports
+    from routes import register_blueprints
+
+    # Register all blueprints
+    register_blueprints(app)
+    app.add_url_rule('/', 'index', index)
+    return app
 
-# Register all blueprints
-register_blueprints(app)
 
-@app.route('/')
 def index():
-    # with app.app_context():
-    #     users = User.query.all()
-    # print(User.query.all())
     return jsonify({'message': 'Welcome to NearBuyfgg'})
 
+
+def __getattr__(name):
+    # Scripts that do ``from app import app`` get the default app, built on first import
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,323 @@
+"""
+ASGI entry point: ``uvicorn asgi:application`` (or any ASGI server).
+
+The busiest catalog reads (product detail and nearby products) are served
+natively on the event loop through utils.async_db, so thousands of waiting
+clients cost a coroutine each rather than a thread each, and a request's
+independent queries run concurrently. Every other route is passed to the
+Flask app, which runs on a bounded thread pool exactly as it does under WSGI.
+
+Importing this module builds nothing: the Flask app and the async database
+are set up at lifespan startup, or by the first request when the server
+sends no lifespan events, so each server worker builds its own after it
+starts.
+"""
+import asyncio
+import io
+import logging
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.urls import url_decode
+
+from app import create_app
+from routes import async_products
+from utils.async_db import async_database
+from utils.cache import response_cache
+from utils.json_encoding import dumps
+from utils.metrics import metrics
+from utils.sql_profiler import query_profiler
+
+logger = logging.getLogger(__name__)
+
+# (path pattern, endpoint name, handler, cache TTL, cache tags); the names match the Flask endpoints
+NATIVE_ROUTES = [
+    (re.compile(r'/api/products/(?P<product_id>\d+)'), 'products.get_product', async_products.get_product,
+     120, lambda product_id: [f'product:{product_id}', 'product_details']),
+    (re.compile(r'/api/products/nearby'), 'products.get_nearby_products', async_products.get_nearby_products,
+     None, None),
+]
+
+
+class AsgiInput(io.RawIOBase):
+    """
+    ``wsgi.input`` for a request whose body is still arriving.
+
+    Reads run on the app's thread and wait for the next ``http.request``
+    message from the event loop, so the body is pulled as the app consumes it
+    instead of being held in memory first.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._pending = b''
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self._pending = message.get('body', b'')
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class Abandoned(Exception):
+    """Raised on the app's thread when the response it is producing is no longer being sent"""
+
+
+class WsgiBridge:
+    """
+    Serves ASGI HTTP requests with a WSGI app on a thread pool.
+
+    The request body is fed to the app as it arrives, and the response is
+    streamed back chunk by chunk as the app yields it. At most QUEUE_SIZE
+    messages wait between the app's thread and the event loop; past that the
+    app's thread blocks until the client has taken them. If the app fails
+    after the status line went out, the connection is aborted so the client
+    never mistakes a partial body for a whole one.
+    """
+
+    QUEUE_SIZE = 8
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._executor = None
+
+    def _environ(self, scope, stream):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': stream,
+            # The stream ends with the body, so chunked uploads without a Content-Length can be read too
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        return environ
+
+    def _run(self, environ, loop, queue, abandoned):
+        def put(*message):
+            if abandoned.is_set():
+                raise Abandoned()
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put('start', status, headers)
+            return lambda data: put('body', data)
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put('body', chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            put('end')
+        except Abandoned:
+            pass
+        except Exception:
+            logger.exception('Unhandled error in WSGI app')
+            if not abandoned.is_set():
+                put('error')
+
+    async def __call__(self, scope, receive, send):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='wsgi')
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.QUEUE_SIZE)
+        abandoned = threading.Event()
+        stream = io.BufferedReader(AsgiInput(receive, loop))
+        loop.run_in_executor(self._executor, self._run, self._environ(scope, stream), loop, queue, abandoned)
+
+        started = False
+        try:
+            while True:
+                message = await queue.get()
+                if message[0] == 'start' and not started:
+                    started = True
+                    _, status, headers = message
+                    await send({
+                        'type': 'http.response.start',
+                        'status': int(status.split(' ', 1)[0]),
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in headers],
+                    })
+                elif message[0] == 'body' and started:
+                    await send({'type': 'http.response.body', 'body': message[1], 'more_body': True})
+                elif message[0] == 'error':
+                    if started:
+                        # Raising makes the server drop the connection instead of ending the body cleanly
+                        raise RuntimeError(f'WSGI app failed while streaming {scope["path"]}')
+                    await send({'type': 'http.response.start', 'status': 500,
+                                'headers': [(b'content-type', b'text/plain')]})
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                elif message[0] == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+        finally:
+            # Stop the app's thread at its next chunk and release it if it is waiting for room in the queue
+            abandoned.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class AsgiApp:
+    """Dispatches to the native async handlers, falling back to the Flask app built by ``factory`` on first use"""
+
+    def __init__(self, factory, database):
+        self.factory = factory
+        self.database = database
+        self.wsgi = None
+        self._flask_app = None
+        self._lock = threading.Lock()
+
+    def setup(self):
+        """Build the Flask app and set up the async database for it, once"""
+        with self._lock:
+            if self._flask_app is None:
+                flask_app = self.factory()
+                self.database.init_app(flask_app)
+                self.wsgi = WsgiBridge(flask_app.wsgi_app, flask_app.config.get('ASGI_WSGI_THREADS', 32))
+                self._flask_app = flask_app
+        return self._flask_app
+
+    @property
+    def flask_app(self):
+        return self._flask_app or self.setup()
+
+    async def __call__(self, scope, receive, send):
+        if self._flask_app is None:
+            self.setup()
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if scope['method'] == 'GET':
+            for pattern, endpoint, handler, ttl, tags in NATIVE_ROUTES:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await self._native(scope, send, endpoint, handler, ttl, tags, match.groupdict())
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                self.wsgi.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _native(self, scope, send, endpoint, handler, ttl, tags, url_args):
+        start = time.perf_counter()
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        url_args = {name: int(value) for name, value in url_args.items()}
+        by_endpoint = (('endpoint', endpoint),)
+        status, body = 500, b''
+        if metrics.enabled:
+            metrics.inc('nearbuy_http_requests_in_flight', by_endpoint)
+        # Each request runs in a task of its own, so the profile covers only this request's statements
+        profile, token = query_profiler.start()
+        db_usage = metrics.start_db_usage() if metrics.enabled else None
+        try:
+            # Same key as the Flask view's cache entry, so both serving modes share it
+            key = None
+            cache_status = None
+            if tags is not None and response_cache.enabled and response_cache.backend is not None:
+                key = response_cache.entry_key(f'{scope["path"]}?{query_string}', tags(**url_args))
+                hit = response_cache.lookup(key)
+                if hit is not None:
+                    headers, body = hit
+                    status, cache_status = 200, 'HIT'
+                else:
+                    cache_status = 'MISS'
+            if cache_status != 'HIT':
+                try:
+                    status, payload = await handler(self.database, self.flask_app.config, url_decode(query_string),
+                                                    **url_args)
+                except Exception as e:
+                    logger.exception('Error serving %s', scope['path'])
+                    status, payload = 500, {'error': str(e)}
+                headers = [('Content-Type', 'application/json')]
+                body = dumps(payload, app=self.flask_app) + b'\n'
+                if key is not None and status == 200:
+                    response_cache.store(key, headers, body, response_cache.ttls.get(endpoint, ttl))
+            if cache_status:
+                headers = headers + [('X-Cache', cache_status)]
+            headers = headers + list(query_profiler.report(profile, 'GET', scope['path'], endpoint, status).items())
+
+            # Flask-CORS adds this to every Flask response; the native routes are public reads
+            headers = headers + [('Access-Control-Allow-Origin', '*'), ('Content-Length', str(len(body)))]
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+            await send({'type': 'http.response.body', 'body': body})
+        finally:
+            query_profiler.stop(token)
+            if metrics.enabled:
+                self._record(by_endpoint, status, len(body), time.perf_counter() - start, db_usage)
+
+    @staticmethod
+    def _record(by_endpoint, status, size, elapsed, db_usage):
+        # The Flask request hooks record these for every other route
+        metrics.inc('nearbuy_http_requests_in_flight', by_endpoint, -1)
+        by_method = by_endpoint + (('method', 'GET'),)
+        metrics.inc('nearbuy_http_requests_total', by_method + (('status', str(status)),))
+        metrics.observe('nearbuy_http_request_duration_seconds', by_method, elapsed)
+        metrics.observe('nearbuy_http_response_size_bytes', by_endpoint, size)
+        metrics.finish_db_usage(db_usage, by_endpoint)
+
+
+application = AsgiApp(create_app, async_database)
+
+
+def __getattr__(name):
+    # ``from asgi import app`` gets the Flask app behind ``application``, built on first use
+    if name == 'app':
+        return application.flask_app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
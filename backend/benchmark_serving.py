@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, func
+
+from asgi import app, application
+from models import db, Product, ShopAddress
+from utils.async_db import async_database
+from utils.cache import response_cache
+
+
+def request_mix(count, nearby_share, seed):
+    """Product pages and nearby searches over random products and shop locations"""
+    rng = random.Random(seed)
+    with app.app_context():
+        max_product_id = db.session.query(func.max(Product.product_id)).scalar() or 1
+        locations = [(float(lat), float(lon)) for lat, lon in
+                     db.session.query(ShopAddress.latitude, ShopAddress.longitude).limit(5000)]
+    paths = []
+    for _ in range(count):
+        if rng.random() >= nearby_share or not locations:
+            paths.append((f'/api/products/{rng.randint(1, max_product_id)}', ''))
+        else:
+            latitude, longitude = rng.choice(locations)
+            paths.append(('/api/products/nearby', f'latitude={latitude}&longitude={longitude}&radius=3&limit=20'))
+    return paths
+
+
+def add_db_latency(milliseconds):
+    # Local SQLite answers in microseconds; a networked SQL Server does not
+    @event.listens_for(db.get_engine(app), 'before_cursor_execute')
+    def _delay(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(milliseconds / 1000)
+
+
+async def drive(paths, clients, call):
+    """Run ``paths`` with ``clients`` concurrent closed-loop clients; returns (latencies, errors, elapsed)"""
+    pending = iter(paths)
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        for path, query in pending:
+            start = time.perf_counter()
+            status = await call(path, query)
+            latencies.append(time.perf_counter() - start)
+            if status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def wsgi_caller(threads):
+    # A threaded WSGI server: each request holds one of ``threads`` threads until it finishes
+    executor = ThreadPoolExecutor(max_workers=threads)
+    test_client = app.test_client()
+
+    def get(path, query):
+        return test_client.get(path, query_string=query).status_code
+
+    async def call(path, query):
+        return await asyncio.get_running_loop().run_in_executor(executor, get, path, query)
+    return call
+
+
+async def asgi_call(path, query):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode('latin-1'),
+             'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http'}
+    status = 500
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+def report(name, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{name:5} {len(latencies) / elapsed:8.1f} req/s   p50 {quantiles[49] * 1000:7.1f} ms   '
+          f'p95 {quantiles[94] * 1000:7.1f} ms   p99 {quantiles[98] * 1000:7.1f} ms   errors {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the WSGI app and the ASGI entry point on product pages and nearby searches.')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--clients', type=int, default=500, help='concurrent clients')
+    parser.add_argument('--wsgi-threads', type=int, default=32, help='threads of the WSGI server being compared')
+    parser.add_argument('--db-latency-ms', type=float, default=2.0,
+                        help='delay added to every statement to stand in for a network round trip')
+    parser.add_argument('--nearby-share', type=float, default=0.2, help='fraction of requests that are nearby searches')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    response_cache.enabled = args.cache
+    if args.db_latency_ms:
+        add_db_latency(args.db_latency_ms)
+    paths = request_mix(args.requests, args.nearby_share, args.seed)
+    print(f'{args.requests} requests, {args.clients} clients, {args.db_latency_ms} ms per statement, '
+          f'async database mode: {async_database.mode}')
+
+    # Warm both paths (connections, the search of the first shop batch) before timing
+    asyncio.run(drive(paths[:50], 10, wsgi_caller(args.wsgi_threads)))
+    asyncio.run(drive(paths[:50], 10, asgi_call))
+
+    report('wsgi', *asyncio.run(drive(paths, args.clients, wsgi_caller(args.wsgi_threads))))
+    report('asgi', *asyncio.run(drive(paths, args.clients, asgi_call)))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,13 +8,113 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'mssql+pyodbc:///?odbc_connect=DRIVER={ODBC Driver 17 for SQL Server};SERVER=localhost;DATABASE=NearBuy;Trusted_Connection=yes')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool; see utils.db_pool.engine_options
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_FAST_EXECUTEMANY = os.getenv('DB_FAST_EXECUTEMANY', 'true').lower() == 'true'
+
+    # Shop spatial index used by /api/shops/nearby
+    SPATIAL_INDEX_CELL_DEGREES = float(os.getenv('SPATIAL_INDEX_CELL_DEGREES', '0.05'))
+    SPATIAL_INDEX_REFRESH_SECONDS = int(os.getenv('SPATIAL_INDEX_REFRESH_SECONDS', '300'))
+
+    # Number of listings /api/products/nearby returns when no limit is given, and the most it will return
+    NEARBY_PRODUCTS_DEFAULT_LIMIT = int(os.getenv('NEARBY_PRODUCTS_DEFAULT_LIMIT', '50'))
+    NEARBY_PRODUCTS_MAX_LIMIT = int(os.getenv('NEARBY_PRODUCTS_MAX_LIMIT', '500'))
+
+    # Page sizes for cursor-paginated list endpoints
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '20'))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '100'))
+
+    # Product search index used by /api/products/search
+    SEARCH_INDEX_REFRESH_SECONDS = int(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '300'))
+
+    # Buffered search-history writes
+    SEARCH_HISTORY_BATCH_SIZE = int(os.getenv('SEARCH_HISTORY_BATCH_SIZE', '100'))
+    SEARCH_HISTORY_FLUSH_SECONDS = float(os.getenv('SEARCH_HISTORY_FLUSH_SECONDS', '2'))
+    SEARCH_HISTORY_MAX_BUFFER = int(os.getenv('SEARCH_HISTORY_MAX_BUFFER', '10000'))
+
+    # Serve category product counts from the maintained Product_Categories.product_count column
+    CATEGORY_PRODUCT_COUNT_MAINTAINED = os.getenv('CATEGORY_PRODUCT_COUNT_MAINTAINED', 'false').lower() == 'true'
+
+    # Admin dashboard snapshot: incremental refresh interval, and how often it is rebuilt from scratch
+    ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+    ANALYTICS_FULL_REFRESH_SECONDS = int(os.getenv('ANALYTICS_FULL_REFRESH_SECONDS', '3600'))
+
+    # Catalog imports through /api/admin/import (the import_catalog.py CLI takes its own flags)
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+    IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', '1000'))
+    # Largest batch accepted by /api/admin/inventory
+    INVENTORY_BATCH_MAX = int(os.getenv('INVENTORY_BATCH_MAX', '5000'))
+
+    # Verified tokens and the users/admins they resolve to, kept to skip the per-request lookup. Writes only evict
+    # in their own process, so other workers may accept a deleted account's token for up to the TTL in seconds
+    PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', '30'))
+    PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv('PRINCIPAL_CACHE_MAX_ENTRIES', '10000'))
+
+    # Per-request SQL statement counts, N+1 detection and slow-query logging; see utils.sql_profiler
+    SQL_PROFILING_ENABLED = os.getenv('SQL_PROFILING_ENABLED', 'false').lower() == 'true'
+    SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '200'))
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '5'))
+
+    # Password hashing pool; the cost is the last part of the method, and older hashes are upgraded at login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', '64'))
+
+    # Prometheus /metrics; set METRICS_MULTIPROC_DIR when running several worker processes
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '1'))
+    # Per-request statement counts and DB time; two clock reads per statement, set to false to skip them
+    METRICS_DB_TIME = os.getenv('METRICS_DB_TIME', 'true').lower() == 'true'
+
+    # ASGI serving mode (asgi.py): async driver URL, e.g. sqlite+aiosqlite:///nearbuy.db. When unset, a SQLite file
+    # database uses aiosqlite if it is installed; anything else runs its queries on the regular engine in a thread
+    # pool. ASYNC_DB_CONCURRENCY defaults to the pool size plus overflow.
+    ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URI', '')
+    ASYNC_DB_CONCURRENCY = int(os.getenv('ASYNC_DB_CONCURRENCY', '0'))
+    # Threads running the Flask routes that have no async version
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '32'))
+
+    # JSON responses: 'auto' uses orjson when installed, 'orjson' requires it, 'std' never uses it.
+    # Streamed arrays are sent in chunks of about JSON_STREAM_CHUNK_BYTES.
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
+    JSON_STREAM_CHUNK_BYTES = int(os.getenv('JSON_STREAM_CHUNK_BYTES', str(64 * 1024)))
+
+    # Response cache for catalog reads: 'memory', 'redis' or 'local-redis'
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    CACHE_MAX_TAGS = int(os.getenv('CACHE_MAX_TAGS', '100000'))
+    CACHE_TTLS = {
+        'products.get_categories': 300,
+        'products.get_product': 120,
+        'products.get_product_reviews': 120,
+        'shops.get_shops': 60,
+        'shops.get_shop': 300,
+        'shops.get_shop_products': 120
+    }
+
 class DevelopmentConfig(Config):
     DEBUG = True
+    SQL_PROFILING_ENABLED = os.getenv('SQL_PROFILING_ENABLED', 'true').lower() == 'true'
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
 
 class ProductionConfig(Config):
     DEBUG = False
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '30'))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '10'))
 
+# Selected by create_app(config_name) or the NEARBUY_CONFIG environment variable
 config_by_name = {
+    'default': Config,
     'dev': DevelopmentConfig,
     'prod': ProductionConfig
 }
\ No newline at end of file
@@ -0,0 +1,55 @@
+import time
+from app import app, db
+from routes.product_routes import NEARBY_SHOPS_SQL
+from utils.geo import bounding_box
+
+# Centre of Bhopal, matching the sample data
+LATITUDE = 23.2599
+LONGITUDE = 77.4126
+RADIUS_KM = 10
+RUNS = 20
+
+def show_plan(connection, params):
+    # Print the plan the database chooses for the nearby-shops prefilter
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.execute(db.text('EXPLAIN QUERY PLAN ' + NEARBY_SHOPS_SQL.text), params).fetchall()
+        plan = [row[-1] for row in rows]
+    elif dialect == 'mssql':
+        connection.exec_driver_sql('SET SHOWPLAN_TEXT ON')
+        try:
+            result = connection.execute(NEARBY_SHOPS_SQL, params)
+            plan = [row[0] for row in result.fetchall()]
+            while result.cursor.nextset():
+                plan.extend(row[0] for row in result.cursor.fetchall())
+        finally:
+            connection.exec_driver_sql('SET SHOWPLAN_TEXT OFF')
+    else:
+        print(f"No query plan support for dialect: {dialect}")
+        return False
+
+    for line in plan:
+        print(line)
+
+    seek = any('Index Seek' in line or 'USING INDEX' in line or 'USING COVERING INDEX' in line for line in plan)
+    print(f"\nShop_Address is read with {'an index seek' if seek else 'a full scan'}")
+    return seek
+
+def benchmark(connection, params):
+    # Time the prefilter query over several runs
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        rows = connection.execute(NEARBY_SHOPS_SQL, params).fetchall()
+    elapsed = (time.perf_counter() - start) / RUNS
+    print(f"{len(rows)} candidate shops in {elapsed * 1000:.2f} ms per query")
+
+if __name__ == '__main__':
+    min_lat, max_lat, min_lon, max_lon = bounding_box(LATITUDE, LONGITUDE, RADIUS_KM)
+    params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            print("Query plan for the nearby-shops prefilter:\n")
+            show_plan(connection, params)
+            print("\nBenchmarking the nearby-shops prefilter...")
+            benchmark(connection, params)
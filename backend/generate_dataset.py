@@ -0,0 +1,291 @@
+import argparse
+import math
+import random
+import time
+from datetime import datetime, time as clock, timedelta
+from itertools import islice
+
+from sqlalchemy import create_engine, event, func, select
+from werkzeug.security import generate_password_hash
+
+from config import Config
+from models import (db, ProductCategory, Product, ProductImage, ProductReview, SearchHistory, Shop, ShopAddress,
+                    ShopOwner, ShopProduct, ShopTiming, User)
+from utils.catalog import category_count_update, review_aggregate_update
+from utils.db_pool import engine_options
+
+# City centres with a rough relative size, used to spread shops realistically
+CITIES = [
+    ('Mumbai', 19.0760, 72.8777, 20), ('Delhi', 28.6139, 77.2090, 20), ('Bengaluru', 12.9716, 77.5946, 14),
+    ('Hyderabad', 17.3850, 78.4867, 11), ('Ahmedabad', 23.0225, 72.5714, 9), ('Chennai', 13.0827, 80.2707, 10),
+    ('Kolkata', 22.5726, 88.3639, 12), ('Pune', 18.5204, 73.8567, 8), ('Jaipur', 26.9124, 75.7873, 6),
+    ('Lucknow', 26.8467, 80.9462, 6), ('Kanpur', 26.4499, 80.3319, 5), ('Nagpur', 21.1458, 79.0882, 5),
+    ('Indore', 22.7196, 75.8577, 5), ('Bhopal', 23.2599, 77.4126, 4), ('Patna', 25.5941, 85.1376, 4),
+    ('Vadodara', 22.3072, 73.1812, 4), ('Ludhiana', 30.9010, 75.8573, 3), ('Agra', 27.1767, 78.0081, 3),
+    ('Surat', 21.1702, 72.8311, 6), ('Visakhapatnam', 17.6868, 83.2185, 3), ('Coimbatore', 11.0168, 76.9558, 3),
+    ('Kochi', 9.9312, 76.2673, 3), ('Chandigarh', 30.7333, 76.7794, 2), ('Guwahati', 26.1445, 91.7362, 2),
+]
+
+# Product categories, each with the brands and item names used to make up products
+CATEGORIES = {
+    'Electronics': (['Samsung', 'Xiaomi', 'OnePlus', 'Realme', 'boAt', 'Sony'], ['Smartphone', 'Earbuds', 'Power Bank', 'Charger', 'Smartwatch', 'Speaker']),
+    'Groceries': (['Aashirvaad', 'Tata', 'Fortune', 'Amul', 'Britannia', 'Patanjali'], ['Atta', 'Salt', 'Sunflower Oil', 'Butter', 'Biscuits', 'Basmati Rice']),
+    'Clothing': (['Raymond', 'Peter England', 'Allen Solly', 'Levis', 'FabIndia', 'Biba'], ['Shirt', 'Jeans', 'Kurta', 'Saree', 'T-Shirt', 'Jacket']),
+    'Footwear': (['Bata', 'Puma', 'Nike', 'Adidas', 'Campus', 'Woodland'], ['Sneakers', 'Sandals', 'Formal Shoes', 'Slippers', 'Boots']),
+    'Home & Kitchen': (['Prestige', 'Pigeon', 'Milton', 'Cello', 'Borosil', 'Hawkins'], ['Pressure Cooker', 'Water Bottle', 'Tawa', 'Mixer Grinder', 'Lunch Box']),
+    'Personal Care': (['Dove', 'Himalaya', 'Nivea', 'Colgate', 'Dettol', 'Lakme'], ['Face Wash', 'Shampoo', 'Toothpaste', 'Soap', 'Moisturizer']),
+    'Stationery': (['Classmate', 'Camlin', 'Reynolds', 'Faber-Castell', 'Apsara'], ['Notebook', 'Pen Set', 'Pencil Box', 'Colour Pencils', 'Geometry Box']),
+    'Sports': (['Cosco', 'Nivia', 'SG', 'Yonex', 'Decathlon'], ['Cricket Bat', 'Football', 'Badminton Racket', 'Yoga Mat', 'Skipping Rope']),
+    'Toys': (['Funskool', 'Hasbro', 'Lego', 'Mattel', 'Hot Wheels'], ['Board Game', 'Building Blocks', 'Doll', 'Toy Car', 'Puzzle']),
+    'Pharmacy': (['Cipla', 'Dabur', 'Zandu', 'Vicks', 'Himalaya'], ['Cough Syrup', 'Balm', 'Chyawanprash', 'Antiseptic Liquid', 'Pain Relief Spray']),
+}
+ADJECTIVES = ['Classic', 'Premium', 'Lite', 'Pro', 'Max', 'Eco', 'Ultra', 'Smart', 'Fresh', 'Deluxe']
+COLORS = ['Black', 'White', 'Blue', 'Red', 'Green', 'Grey', 'Silver', 'Gold', 'Pink', 'Brown']
+AREAS = ['Market', 'Nagar', 'Colony', 'Chowk', 'Bazaar', 'Square', 'Road', 'Vihar', 'Enclave', 'Sector']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SEARCH_TERMS = ['phone', 'charger', 'atta', 'rice', 'shoes', 'kurta', 'saree', 'bottle', 'cooker', 'soap',
+                'shampoo', 'notebook', 'bat', 'football', 'toy car', 'earbuds', 'jeans', 'biscuits', 'oil', 'balm']
+
+KM_PER_DEGREE = 111.195
+
+
+def city_list(count, rng):
+    # Use the real cities first, then make up smaller towns scattered across India
+    cities = list(CITIES[:count])
+    for number in range(len(cities), count):
+        cities.append((f'Town {number + 1}', rng.uniform(9.0, 30.0), rng.uniform(72.0, 88.0), 1))
+    return cities
+
+
+def neighbourhoods(cities, rng):
+    # Each city gets a handful of market clusters around its centre, bigger cities more of them
+    result = []
+    for name, lat, lon, weight in cities:
+        city_radius_km = 4 + 2 * math.sqrt(weight)
+        for number in range(3 + 2 * weight):
+            distance = abs(rng.gauss(0, city_radius_km / 2))
+            bearing = rng.uniform(0, 2 * math.pi)
+            result.append({
+                'city': name,
+                'lat': lat + distance * math.cos(bearing) / KM_PER_DEGREE,
+                'lon': lon + distance * math.sin(bearing) / (KM_PER_DEGREE * math.cos(math.radians(lat))),
+                'area': f'{rng.choice(["Old", "New", "Central", "East", "West", "North", "South"])} {rng.choice(AREAS)} {number + 1}',
+                'spread_km': rng.uniform(0.3, 1.5),
+                'weight': weight
+            })
+    return result
+
+
+def next_id(connection, column):
+    return (connection.execute(select(func.max(column))).scalar() or 0) + 1
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load(engine, table, rows, batch_size, label):
+    """Insert generated rows with one executemany per batch, reporting progress as it goes"""
+    start = time.perf_counter()
+    total = 0
+    for batch in batches(rows, batch_size):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), batch)
+        total += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'\r  {label}: {total:,} rows ({total / elapsed if elapsed else 0:,.0f} rows/s)', end='', flush=True)
+    print(f'\r  {label}: {total:,} rows in {time.perf_counter() - start:.1f}s' + ' ' * 20)
+    return total
+
+
+def generate(engine, args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+
+    with engine.connect() as connection:
+        first = {
+            'category': next_id(connection, ProductCategory.category_id),
+            'owner': next_id(connection, ShopOwner.owner_id),
+            'shop': next_id(connection, Shop.shop_id),
+            'address': next_id(connection, ShopAddress.address_id),
+            'timing': next_id(connection, ShopTiming.timing_id),
+            'product': next_id(connection, Product.product_id),
+            'image': next_id(connection, ProductImage.image_id),
+            'shop_product': next_id(connection, ShopProduct.shop_product_id),
+            'user': next_id(connection, User.user_id),
+            'review': next_id(connection, ProductReview.review_id),
+            'history': next_id(connection, SearchHistory.history_id),
+        }
+
+    # Categories, reusing any that already exist by name
+    with engine.connect() as connection:
+        category_ids = dict((name, category_id) for category_id, name in connection.execute(
+            select(ProductCategory.category_id, ProductCategory.category_name)))
+    category_rows = []
+    for name in CATEGORIES:
+        if name not in category_ids:
+            category_ids[name] = first['category'] + len(category_rows)
+            category_rows.append({'category_id': category_ids[name], 'category_name': name,
+                                  'category_description': f'{name} available in local shops', 'product_count': 0,
+                                  'created_at': now})
+    load(engine, ProductCategory.__table__, category_rows, args.batch_size, 'Product_Categories')
+    category_names = list(CATEGORIES)
+
+    # Owners, shops, addresses and timings
+    cities = city_list(args.cities, rng)
+    clusters = neighbourhoods(cities, rng)
+    cluster_weights = [cluster['weight'] for cluster in clusters]
+    owners = max(1, args.shops * 2 // 3)
+    password = generate_password_hash('password123')
+
+    load(engine, ShopOwner.__table__, (
+        {'owner_id': first['owner'] + i, 'owner_name': f'Owner {first["owner"] + i}',
+         'phone': f'9{first["owner"] + i:09d}', 'email': f'owner{first["owner"] + i}@nearbuy.test'}
+        for i in range(owners)
+    ), args.batch_size, 'Shop_Owners')
+
+    shop_clusters = rng.choices(clusters, weights=cluster_weights, k=args.shops)
+    load(engine, Shop.__table__, (
+        {'shop_id': first['shop'] + i, 'shop_name': f'{cluster["area"].split()[-2]} {rng.choice(category_names)} Store {first["shop"] + i}',
+         'owner_id': first['owner'] + rng.randrange(owners), 'shop_image': f'https://picsum.photos/seed/shop{first["shop"] + i}/400/300',
+         'created_at': now - timedelta(days=rng.randrange(730))}
+        for i, cluster in enumerate(shop_clusters)
+    ), args.batch_size, 'Shops')
+
+    def addresses():
+        for i, cluster in enumerate(shop_clusters):
+            distance = abs(rng.gauss(0, cluster['spread_km']))
+            bearing = rng.uniform(0, 2 * math.pi)
+            yield {
+                'address_id': first['address'] + i, 'shop_id': first['shop'] + i, 'city': cluster['city'],
+                'country': 'India', 'pincode': f'{rng.randrange(110000, 860000)}', 'landmark': f'Near {cluster["area"]}',
+                'area': cluster['area'],
+                'latitude': round(cluster['lat'] + distance * math.cos(bearing) / KM_PER_DEGREE, 6),
+                'longitude': round(cluster['lon'] + distance * math.sin(bearing) / (KM_PER_DEGREE * math.cos(math.radians(cluster['lat']))), 6)
+            }
+    load(engine, ShopAddress.__table__, addresses(), args.batch_size, 'Shop_Address')
+
+    def timings():
+        timing_id = first['timing']
+        for i in range(args.shops):
+            opens, closes = rng.choice([(9, 21), (10, 22), (8, 20), (11, 23)])
+            for day in DAYS:
+                if day == 'Sunday' and rng.random() < 0.3:
+                    continue
+                yield {'timing_id': timing_id, 'shop_id': first['shop'] + i, 'day': day,
+                       'open_time': clock(opens), 'close_time': clock(closes)}
+                timing_id += 1
+    load(engine, ShopTiming.__table__, timings(), args.batch_size, 'Shop_Timings')
+
+    # Products and images
+    product_categories = [rng.choice(category_names) for _ in range(args.products)]
+    base_prices = [round(math.exp(rng.uniform(math.log(20), math.log(20000))), 2) for _ in range(args.products)]
+
+    def products():
+        for i, category in enumerate(product_categories):
+            brands, items = CATEGORIES[category]
+            brand, item, adjective = rng.choice(brands), rng.choice(items), rng.choice(ADJECTIVES)
+            color = rng.choice(COLORS)
+            yield {
+                'product_id': first['product'] + i, 'product_name': f'{brand} {adjective} {item} {rng.randrange(100, 999)}',
+                'category_id': category_ids[category], 'brand': brand,
+                'description': f'{adjective} {item.lower()} by {brand} in {color.lower()}, sold by shops near you.',
+                'color': color, 'avg_rating': 0, 'review_count': 0, 'created_at': now - timedelta(days=rng.randrange(365))
+            }
+    load(engine, Product.__table__, products(), args.batch_size, 'Products')
+
+    def images():
+        image_id = first['image']
+        for i in range(args.products):
+            for n in range(rng.randint(1, 3)):
+                yield {'image_id': image_id, 'product_id': first['product'] + i,
+                       'image_url': f'https://picsum.photos/seed/p{first["product"] + i}-{n}/600/600'}
+                image_id += 1
+    load(engine, ProductImage.__table__, images(), args.batch_size, 'Product_Images')
+
+    # Inventory: popular products are stocked by many shops, the long tail by few
+    def shop_products():
+        shop_product_id = first['shop_product']
+        per_shop = max(1, args.shop_products // max(args.shops, 1))
+        for i in range(args.shops):
+            count = min(args.products, max(1, int(rng.expovariate(1 / per_shop))))
+            stocked = set()
+            while len(stocked) < count:
+                stocked.add(min(int(rng.paretovariate(1.2)) - 1, args.products - 1) if rng.random() < 0.5
+                            else rng.randrange(args.products))
+            for index in stocked:
+                yield {'shop_product_id': shop_product_id, 'shop_id': first['shop'] + i,
+                       'product_id': first['product'] + index,
+                       'price': round(base_prices[index] * rng.uniform(0.9, 1.15), 2), 'stock': rng.randrange(0, 200)}
+                shop_product_id += 1
+    load(engine, ShopProduct.__table__, shop_products(), args.batch_size, 'Shop_Product')
+
+    # Users, reviews and search history
+    load(engine, User.__table__, (
+        {'user_id': first['user'] + i, 'name': f'User {first["user"] + i}', 'email': f'user{first["user"] + i}@nearbuy.test',
+         'password': password, 'phone': f'8{first["user"] + i:09d}', 'created_at': now - timedelta(days=rng.randrange(730))}
+        for i in range(args.users)
+    ), args.batch_size, 'Users')
+
+    if args.users:
+        load(engine, ProductReview.__table__, (
+            {'review_id': first['review'] + i, 'user_id': first['user'] + rng.randrange(args.users),
+             'product_id': first['product'] + min(int(rng.paretovariate(1.1)) - 1, args.products - 1),
+             'rating': float(rng.choices([1, 2, 3, 4, 5], weights=[5, 7, 15, 35, 38])[0]),
+             'review_text': rng.choice(['Good value', 'Works as expected', 'Not worth it', 'Great quality', 'Okay']),
+             'created_at': now - timedelta(minutes=rng.randrange(525600))}
+            for i in range(args.reviews)
+        ), args.batch_size, 'Product_Reviews')
+
+        load(engine, SearchHistory.__table__, (
+            {'history_id': first['history'] + i, 'user_id': first['user'] + rng.randrange(args.users),
+             'search_item': rng.choice(SEARCH_TERMS), 'timestamp': now - timedelta(minutes=rng.randrange(129600))}
+            for i in range(args.searches)
+        ), args.batch_size, 'Search_History')
+
+    # Rows went in through Core, so the maintained counters need a recount
+    with engine.begin() as connection:
+        connection.execute(category_count_update())
+        connection.execute(review_aggregate_update())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic NearBuy dataset and bulk-load it.')
+    parser.add_argument('--database', default='sqlite:///nearbuy_dataset.db',
+                        help='target database URI (default: a local SQLite file)')
+    parser.add_argument('--cities', type=int, default=24)
+    parser.add_argument('--shops', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--shop-products', type=int, default=100000, help='approximate number of Shop_Product rows')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--searches', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    config['SQLALCHEMY_DATABASE_URI'] = args.database
+    engine = create_engine(args.database, **engine_options(config))
+
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def _fast_sqlite(dbapi_connection, connection_record):
+            # Bulk loading is repeatable, so trade durability for speed
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+            dbapi_connection.execute('PRAGMA synchronous=OFF')
+
+    db.Model.metadata.create_all(engine)
+    print(f'Loading into {engine.url!r}')
+    start = time.perf_counter()
+    generate(engine, args)
+    print(f'Done in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
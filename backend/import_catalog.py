@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+
+from app import app
+from utils.catalog_import import COLUMNS, CatalogImporter, read_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Import products, images and shop inventory from a CSV or NDJSON file.',
+        epilog='Recognised columns: ' + ', '.join(COLUMNS)
+    )
+    parser.add_argument('path', help="file to import, or '-' for standard input")
+    parser.add_argument('--format', choices=['csv', 'ndjson'],
+                        help='file format (default: from the file extension)')
+    parser.add_argument('--shop-id', type=int, help='shop for rows that do not give a shop_id')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--max-errors', type=int, default=100, help='row errors to list at the end')
+    args = parser.parse_args()
+
+    fmt = args.format or ('ndjson' if os.path.splitext(args.path)[1].lower() in ('.ndjson', '.jsonl') else 'csv')
+
+    def progress(report):
+        print(f"\r  {report['rows']:,} rows, {report['failed']:,} failed ({report['rows_per_second']:,} rows/s)",
+              end='', file=sys.stderr, flush=True)
+
+    with app.app_context():
+        importer = CatalogImporter(batch_size=args.batch_size, max_errors=args.max_errors,
+                                   default_shop_id=args.shop_id, progress=progress)
+        if args.path == '-':
+            report = importer.run(read_rows(sys.stdin.buffer, fmt))
+        else:
+            with open(args.path, 'rb') as source:
+                report = importer.run(read_rows(source, fmt))
+    print(file=sys.stderr)
+
+    print(f"Imported {report['rows'] - report['failed']:,} of {report['rows']:,} rows in {report['elapsed_seconds']}s")
+    print(f"  products: {report['products_created']:,} created, {report['products_updated']:,} updated")
+    print(f"  listings: {report['listings_created']:,} created, {report['listings_updated']:,} updated")
+    print(f"  images:   {report['images_added']:,} added")
+    for error in report['errors']:
+        print(f"  line {error['line']}: {error['error']}")
+    if report['failed'] > len(report['errors']):
+        print(f"  ... and {report['failed'] - len(report['errors']):,} more errors")
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
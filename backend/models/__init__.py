@@ -8,4 +8,5 @@ from .shop_owner import ShopOwner
 from .shop import Shop, ShopAddress, ShopTiming
 from .product import ProductCategory, Product, ProductImage, ProductReview, ShopProduct
 from .search_history import SearchHistory
-from .admin import Admin #change1
\ No newline at end of file
+from .admin import Admin #change1
+from .analytics import AnalyticsSnapshot
@@ -1,6 +1,6 @@
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from utils.passwords import password_hasher
 
 class Admin(db.Model):
     __tablename__ = 'admin'
@@ -14,10 +14,14 @@ class Admin(db.Model):
         self.set_password(password)
     
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = password_hasher.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        # A valid password stored with an older hash method is rehashed; the caller commits it
+        valid, new_hash = password_hasher.verify_and_update(self.password, password)
+        if new_hash:
+            self.password = new_hash
+        return valid
     
     def to_dict(self):
         return {
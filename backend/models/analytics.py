@@ -0,0 +1,14 @@
+from . import db
+from datetime import datetime
+
+class AnalyticsSnapshot(db.Model):
+    __tablename__ = 'Analytics_Snapshot'
+    
+    snapshot_id = db.Column(db.Integer, primary_key=True)
+    # JSON document built by utils.analytics.AnalyticsSnapshotter
+    data = db.Column(db.Text, nullable=False)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    full_refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AnalyticsSnapshot {self.snapshot_id} at {self.refreshed_at}>'
@@ -1,5 +1,6 @@
 from . import db
 from datetime import datetime
+from sqlalchemy import case, event, inspect
 
 class ProductCategory(db.Model):
     __tablename__ = 'Product_Categories'
@@ -7,6 +8,8 @@ class ProductCategory(db.Model):
     category_id = db.Column(db.Integer, primary_key=True)
     category_name = db.Column(db.String(100), unique=True)
     category_description = db.Column(db.String(500))
+    # Maintained by the Product listeners below; see utils.catalog.refresh_category_counts
+    product_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -18,13 +21,23 @@ class ProductCategory(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'Products'
+    __table_args__ = (
+        # Keyset pages for the rating and review-count sorts of /api/products/
+        db.Index('IX_Products_avg_rating_review_count', 'avg_rating', 'review_count', 'product_id'),
+        db.Index('IX_Products_review_count_avg_rating', 'review_count', 'avg_rating', 'product_id'),
+        # Matches imported rows to existing products by name and brand
+        db.Index('IX_Products_product_name_brand', 'product_name', 'brand'),
+    )
     
     product_id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(200))
-    category_id = db.Column(db.Integer, db.ForeignKey('Product_Categories.category_id', ondelete='CASCADE'))
+    category_id = db.Column(db.Integer, db.ForeignKey('Product_Categories.category_id', ondelete='CASCADE'), index=True)
     brand = db.Column(db.String(100))
     description = db.Column(db.String(1000))
     color = db.Column(db.String(50))
+    # Maintained by the ProductReview listeners below; see utils.catalog.refresh_review_aggregates
+    avg_rating = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -38,6 +51,9 @@ class Product(db.Model):
 
 class ProductImage(db.Model):
     __tablename__ = 'Product_Images'
+    __table_args__ = (
+        db.Index('IX_Product_Images_product_id', 'product_id'),
+    )
     
     image_id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('Products.product_id', ondelete='CASCADE'))
@@ -49,6 +65,10 @@ class ProductImage(db.Model):
 
 class ProductReview(db.Model):
     __tablename__ = 'Product_Reviews'
+    __table_args__ = (
+        # Newest-first review pages for one product
+        db.Index('IX_Product_Reviews_product_id_review_id', 'product_id', 'review_id'),
+    )
     
     review_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.user_id', ondelete='CASCADE'))
@@ -63,6 +83,11 @@ class ProductReview(db.Model):
 
 class ShopProduct(db.Model):
     __tablename__ = 'Shop_Product'
+    __table_args__ = (
+        # Listing lookups by shop and product (imports, shop pages) and by product (price ranges)
+        db.Index('IX_Shop_Product_shop_id_product_id', 'shop_id', 'product_id'),
+        db.Index('IX_Shop_Product_product_id', 'product_id'),
+    )
     
     shop_product_id = db.Column(db.Integer, primary_key=True)
     shop_id = db.Column(db.Integer, db.ForeignKey('Shops.shop_id', ondelete='CASCADE'))
@@ -71,4 +96,83 @@ class ShopProduct(db.Model):
     stock = db.Column(db.Integer)
     
     def __repr__(self):
-        return f'<ShopProduct {self.shop_product_id}>'
\ No newline at end of file
+        return f'<ShopProduct {self.shop_product_id}>'
+
+
+# --- Keep ProductCategory.product_count in step with product writes ---
+def _adjust_product_count(connection, category_id, delta):
+    if category_id is None:
+        return
+    categories = ProductCategory.__table__
+    connection.execute(
+        categories.update()
+        .where(categories.c.category_id == category_id)
+        .values(product_count=categories.c.product_count + delta)
+    )
+
+
+@event.listens_for(Product, 'after_insert')
+def _count_inserted_product(mapper, connection, target):
+    _adjust_product_count(connection, target.category_id, 1)
+
+
+@event.listens_for(Product, 'after_delete')
+def _count_deleted_product(mapper, connection, target):
+    _adjust_product_count(connection, target.category_id, -1)
+
+
+@event.listens_for(Product, 'after_update')
+def _count_recategorized_product(mapper, connection, target):
+    history = inspect(target).attrs.category_id.history
+    if not history.has_changes():
+        return
+    for old_category_id in history.deleted:
+        _adjust_product_count(connection, old_category_id, -1)
+    _adjust_product_count(connection, target.category_id, 1)
+
+
+# --- Keep Product.avg_rating and review_count in step with review writes ---
+def _adjust_review_aggregates(connection, product_id, added=None, removed=None):
+    # One UPDATE in the flush's transaction; the right-hand side sees the pre-update values
+    if product_id is None or (added is None and removed is None):
+        return
+    products = Product.__table__
+    count = products.c.review_count
+    total = products.c.avg_rating * count
+    delta = 0
+    if added is not None:
+        total, delta = total + added, delta + 1
+    if removed is not None:
+        total, delta = total - removed, delta - 1
+    new_count = count + delta
+    connection.execute(
+        products.update()
+        .where(products.c.product_id == product_id)
+        .values(review_count=new_count, avg_rating=case((new_count > 0, total / new_count), else_=0))
+    )
+
+
+@event.listens_for(ProductReview, 'after_insert')
+def _count_inserted_review(mapper, connection, target):
+    _adjust_review_aggregates(connection, target.product_id, added=target.rating)
+
+
+@event.listens_for(ProductReview, 'after_delete')
+def _count_deleted_review(mapper, connection, target):
+    _adjust_review_aggregates(connection, target.product_id, removed=target.rating)
+
+
+@event.listens_for(ProductReview, 'after_update')
+def _count_changed_review(mapper, connection, target):
+    state = inspect(target)
+    product_history = state.attrs.product_id.history
+    rating_history = state.attrs.rating.history
+    if not product_history.has_changes() and not rating_history.has_changes():
+        return
+    old_product_id = product_history.deleted[0] if product_history.deleted else target.product_id
+    old_rating = rating_history.deleted[0] if rating_history.deleted else target.rating
+    if old_product_id == target.product_id:
+        _adjust_review_aggregates(connection, target.product_id, added=target.rating, removed=old_rating)
+    else:
+        _adjust_review_aggregates(connection, old_product_id, removed=old_rating)
+        _adjust_review_aggregates(connection, target.product_id, added=target.rating)
@@ -21,6 +21,10 @@ class Shop(db.Model):
 
 class ShopAddress(db.Model):
     __tablename__ = 'Shop_Address'
+    __table_args__ = (
+        # Serves the bounding-box prefilter in /api/products/nearby as an index seek
+        db.Index('IX_Shop_Address_Latitude_Longitude', 'latitude', 'longitude', 'shop_id'),
+    )
     
     address_id = db.Column(db.Integer, primary_key=True)
     shop_id = db.Column(db.Integer, db.ForeignKey('Shops.shop_id', ondelete='CASCADE'))
@@ -1,8 +1,16 @@
-from flask import Blueprint, request, jsonify
-from models import db, Admin, User, Shop, Product, ProductCategory
-import jwt, datetime, os
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from models import db, Admin, User, Shop
+import jwt, datetime, json, os
 from functools import wraps
 from dotenv import load_dotenv
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from utils.pagination import InvalidCursor, page_args, page_response, paginate
+from utils.analytics import analytics_snapshot
+from utils.catalog_import import CatalogImporter, read_rows, update_inventory
+from utils.db_pool import pool_stats
+from utils.passwords import PasswordHashingBusy
+from utils.principal_cache import principal_cache
 
 load_dotenv()
 bp = Blueprint("admin", __name__)
@@ -21,12 +29,7 @@ def admin_token_required(f):
             return jsonify({"message": "Token is missing"}), 401
 
         try:
-            data = jwt.decode(
-                token,
-                os.getenv("SECRET_KEY", "dev_key_change_in_production"),
-                algorithms=["HS256"],
-            )
-            current_admin = Admin.query.filter_by(userId=data["userId"]).first()
+            data, current_admin = principal_cache.load_admin(token)
             if not current_admin:
                 return jsonify({"message": "Invalid token"}), 401
         except jwt.ExpiredSignatureError:
@@ -62,8 +65,15 @@ def admin_login():
         return jsonify({"message": "Missing userId or password"}), 400
 
     admin = Admin.query.filter_by(userId=data["userId"]).first()
-    if not admin or not admin.check_password(data["password"]):
-        return jsonify({"message": "Invalid credentials"}), 401
+    try:
+        if not admin or not admin.check_password(data["password"]):
+            return jsonify({"message": "Invalid credentials"}), 401
+    except PasswordHashingBusy as e:
+        return jsonify({"message": str(e)}), 503, {"Retry-After": "1"}
+
+    # check_password rehashes a password stored with an older hash method
+    if db.session.is_modified(admin):
+        db.session.commit()
 
     token = jwt.encode(
         {
@@ -88,61 +98,98 @@ def validate_admin_token(current_admin):
 @bp.route("/analytics", methods=["GET"])
 @admin_token_required
 def get_analytics(current_admin):
-    from sqlalchemy import func
-    
-    # Get counts
-    user_count = User.query.count()
-    shop_count = Shop.query.count()
-    category_count = ProductCategory.query.count()
-    product_count = Product.query.count()
-    
-    # Get recent data (last 7 days)
-    from datetime import datetime, timedelta
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
-    recent_users = User.query.filter(User.created_at >= seven_days_ago).count()
-    recent_shops = Shop.query.filter(Shop.created_at >= seven_days_ago).count()
-    
-    # Get shop categories distribution
-    shop_categories = db.session.query(
-        ProductCategory.name,
-        func.count(Shop.shop_id).label('count')
-    ).join(Shop, ProductCategory.category_id == Shop.category_id, isouter=True).group_by(ProductCategory.name).all()
-    
-    # Get top cities by shop count
-    top_cities = db.session.query(
-        Shop.city,
-        func.count(Shop.shop_id).label('count')
-    ).group_by(Shop.city).order_by(func.count(Shop.shop_id).desc()).limit(5).all()
-    
-    return jsonify({
-        "user_count": user_count,
-        "shop_count": shop_count,
-        "category_count": category_count,
-        "product_count": product_count,
-        "recent_users": recent_users,
-        "recent_shops": recent_shops,
-        "shop_categories": [{"name": name or "Uncategorized", "count": count} for name, count in shop_categories],
-        "top_cities": [{"city": city or "Unknown", "count": count} for city, count in top_cities]
-    }), 200
+    # One precomputed row, kept current by the background snapshot refresh
+    return jsonify(analytics_snapshot.current()), 200
+
+
+# --- Catalog import ---
+@bp.route("/import", methods=["POST"])
+@admin_token_required
+def import_catalog(current_admin):
+    """
+    Stream a CSV or NDJSON upload into the catalog. Send it as the ``file`` form
+    field or as the raw body; the response is NDJSON with one progress line per
+    batch and a final report listing per-row errors.
+    """
+    upload = request.files.get("file")
+    fmt = request.args.get("format")
+    if not fmt:
+        name = upload.filename if upload else ""
+        content_type = upload.mimetype if upload else request.mimetype
+        fmt = "ndjson" if name.lower().endswith((".ndjson", ".jsonl")) or "ndjson" in content_type else "csv"
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"message": "format must be csv or ndjson"}), 400
+    shop_id = request.args.get("shop_id", type=int)
+    source = upload.stream if upload else request.stream
+
+    config = current_app.config
+    importer = CatalogImporter(
+        batch_size=config.get("IMPORT_BATCH_SIZE", 1000),
+        max_errors=config.get("IMPORT_MAX_ERRORS", 1000),
+        default_shop_id=shop_id,
+    )
+
+    def generate():
+        # Batches run while the body is sent, so each progress line goes out as soon as it is ready
+        for report in importer.steps(read_rows(source, fmt)):
+            yield json.dumps(dict(report, event="progress")) + "\n"
+        yield json.dumps(dict(importer.report(), event="done")) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# --- Inventory ---
+@bp.route("/inventory", methods=["POST"])
+@admin_token_required
+def update_shop_inventory(current_admin):
+    """
+    Update price and stock for many listings in one transaction. The body is a
+    list of ``{shop_id, product_id, price, stock}`` objects, or an object with
+    that list under ``items``; the response has a result for each item.
+    """
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"message": "Send a non-empty list of items"}), 400
+    limit = current_app.config.get("INVENTORY_BATCH_MAX", 5000)
+    if len(items) > limit:
+        return jsonify({"message": f"At most {limit} items per request"}), 400
+    try:
+        summary, results = update_inventory(items)
+    except SQLAlchemyError as e:
+        return jsonify({"message": "Inventory update failed", "error": str(getattr(e, "orig", e))}), 500
+    return jsonify(dict(summary, results=results)), 200
+
+
+# --- Connection pool ---
+@bp.route("/pool", methods=["GET"])
+@admin_token_required
+def get_pool_stats(current_admin):
+    return jsonify(pool_stats.snapshot(db.engine.pool)), 200
 
 
 # --- Users ---
 @bp.route("/users", methods=["GET"])
 @admin_token_required
 def get_all_users(current_admin):
-    users = User.query.all()
-    return jsonify(
-        [
+    try:
+        cursor, limit = page_args()
+    except InvalidCursor as e:
+        return jsonify({"message": str(e)}), 400
+    users, next_cursor = paginate(User.query, [User.user_id], cursor, limit, key=lambda u: [u.user_id])
+    return page_response(
+        (
             {
                 "user_id": u.user_id,
                 "name": u.name,
                 "email": u.email,
                 "phone": u.phone,
-                "created_at": u.created_at.isoformat() if u.created_at else None,
+                "created_at": u.created_at,
             }
             for u in users
-        ]
+        ),
+        next_cursor,
+        stream=True,
     ), 200
 
 
@@ -159,18 +206,25 @@ def delete_user(current_admin, user_id):
 @bp.route("/shops", methods=["GET"])
 @admin_token_required
 def get_all_shops(current_admin):
-    shops = Shop.query.all()
-    return jsonify(
+    try:
+        cursor, limit = page_args()
+    except InvalidCursor as e:
+        return jsonify({"message": str(e)}), 400
+    shops, next_cursor = paginate(
+        Shop.query.options(joinedload(Shop.owner)), [Shop.shop_id], cursor, limit, key=lambda s: [s.shop_id]
+    )
+    return page_response(
         [
             {
                 "shop_id": s.shop_id,
-                "name": s.name,
-                "owner_name": s.owner.name if hasattr(s, "owner") and s.owner else None,
+                "name": s.shop_name,
+                "owner_name": s.owner.owner_name if s.owner else None,
                 "category_name": s.category.name if hasattr(s, "category") and s.category else None,
                 "created_at": s.created_at.isoformat() if s.created_at else None,
             }
             for s in shops
-        ]
+        ],
+        next_cursor,
     ), 200
 
 
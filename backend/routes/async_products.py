@@ -0,0 +1,157 @@
+"""
+Async versions of the busiest catalog reads, served natively by asgi.py.
+
+Each handler takes the AsyncDatabase, the app config, the query-string
+arguments and the URL arguments, and returns ``(status, payload)``. The
+payloads match the Flask views in product_routes.
+"""
+from sqlalchemy import select
+
+from models import Product, ProductCategory, ProductImage, ProductReview, Shop, ShopAddress, ShopProduct, User
+from routes.product_routes import NEARBY_PRODUCT_FIELDS, NEARBY_SHOPS_SQL, PRODUCT_DETAIL_FIELDS
+from utils.catalog import chunked
+from utils.fields import InvalidFields, field_columns, project, requested_fields
+from utils.geo import bounding_box, nearest_within, round_distance
+from utils.nearby import NearestListings
+from utils.pagination import encode_cursor
+
+
+async def get_product(database, config, args, product_id):
+    try:
+        fields = requested_fields(PRODUCT_DETAIL_FIELDS, args)
+    except InvalidFields as e:
+        return 400, {'error': str(e)}
+
+    # The product, its listings, images and first review page are independent, so the requested ones run at once
+    page_size = config.get('PAGE_SIZE_DEFAULT', 20)
+    product_query = select(*field_columns(PRODUCT_DETAIL_FIELDS, fields, Product.product_id))
+    if 'category' in fields:
+        product_query = product_query.outerjoin(ProductCategory, ProductCategory.category_id == Product.category_id)
+    queries = {'product': product_query.where(Product.product_id == product_id)}
+    if 'shops' in fields:
+        queries['shops'] = select(
+            Shop.shop_id, Shop.shop_name, ShopProduct.price, ShopProduct.stock, ShopAddress.area, ShopAddress.city
+        ).join(
+            Shop, Shop.shop_id == ShopProduct.shop_id
+        ).outerjoin(
+            ShopAddress, ShopAddress.shop_id == Shop.shop_id
+        ).where(ShopProduct.product_id == product_id).order_by(ShopProduct.shop_product_id)
+    if 'images' in fields:
+        queries['images'] = select(ProductImage.image_url).where(
+            ProductImage.product_id == product_id
+        ).order_by(ProductImage.image_id)
+    if 'reviews' in fields or 'reviews_next_cursor' in fields:
+        queries['reviews'] = select(
+            ProductReview.review_id, User.name, ProductReview.rating, ProductReview.review_text,
+            ProductReview.created_at
+        ).outerjoin(
+            User, User.user_id == ProductReview.user_id
+        ).where(ProductReview.product_id == product_id).order_by(
+            ProductReview.review_id.desc()
+        ).limit(page_size + 1)
+    rows = dict(zip(queries, await database.gather(*queries.values())))
+    if not rows['product']:
+        return 404, {'error': 'Product not found'}
+
+    result = project(rows['product'][0], PRODUCT_DETAIL_FIELDS, fields)
+    if 'images' in fields:
+        result['images'] = [row.image_url for row in rows['images']]
+    if 'shops' in fields:
+        result['shops'] = [{
+            'shop_id': row.shop_id,
+            'shop_name': row.shop_name,
+            'price': float(row.price) if row.price is not None else None,
+            'stock': row.stock,
+            'area': row.area,
+            'city': row.city
+        } for row in rows['shops']]
+    if 'reviews' in fields:
+        result['reviews'] = [{
+            'review_id': row.review_id,
+            'user_name': row.name,
+            'rating': row.rating,
+            'review_text': row.review_text,
+            'created_at': row.created_at
+        } for row in rows['reviews'][:page_size]]
+    if 'reviews_next_cursor' in fields:
+        reviews = rows['reviews']
+        result['reviews_next_cursor'] = (encode_cursor([reviews[page_size - 1].review_id])
+                                         if len(reviews) > page_size else None)
+    return 200, result
+
+
+async def get_nearby_products(database, config, args):
+    latitude = args.get('latitude', type=float)
+    longitude = args.get('longitude', type=float)
+    radius = args.get('radius', default=10, type=float)
+    category_id = args.get('category_id', type=int)
+    max_price = args.get('max_price', type=float)
+    in_stock = args.get('in_stock', 'false').lower() in ('true', '1', 'yes')
+    limit = args.get('limit', config.get('NEARBY_PRODUCTS_DEFAULT_LIMIT', 50), type=int)
+    limit = max(1, min(limit, config.get('NEARBY_PRODUCTS_MAX_LIMIT', 500)))
+    try:
+        fields = requested_fields(NEARBY_PRODUCT_FIELDS, args)
+    except InvalidFields as e:
+        return 400, {'error': str(e)}
+
+    if not latitude or not longitude:
+        return 400, {'error': 'Latitude and longitude are required'}
+
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+    shop_rows = await database.execute(NEARBY_SHOPS_SQL, {
+        'min_lat': min_lat,
+        'max_lat': max_lat,
+        'min_lon': min_lon,
+        'max_lon': max_lon
+    })
+    order, distances = nearest_within(
+        latitude, longitude,
+        [float(row.latitude) for row in shop_rows],
+        [float(row.longitude) for row in shop_rows],
+        radius=radius
+    )
+    nearby_shops = {}
+    for index, distance in zip(order.tolist(), distances.tolist()):
+        shop_row = shop_rows[index]
+        nearby_shops[shop_row.shop_id] = (shop_row.shop_name, round_distance(distance))
+    if not nearby_shops:
+        return 200, []
+
+    # Each shop batch depends on the one before (the scan stops early), so these stay sequential
+    scan = NearestListings(
+        [(distance, shop_id) for shop_id, (_, distance) in nearby_shops.items()],
+        limit,
+        category_id=category_id,
+        max_price=max_price,
+        in_stock=in_stock,
+        columns=field_columns(NEARBY_PRODUCT_FIELDS, fields, ShopProduct.product_id)
+    )
+    query = scan.next_query()
+    while query is not None:
+        scan.add(await database.execute(query))
+        query = scan.next_query()
+    listings = scan.result()
+
+    images = {}
+    product_ids = sorted({row.product_id for _, row in listings}) if 'images' in fields else []
+    batches = await database.gather(*(
+        select(ProductImage.product_id, ProductImage.image_url).where(
+            ProductImage.product_id.in_(batch)
+        ).order_by(ProductImage.product_id, ProductImage.image_id)
+        for batch in chunked(product_ids)
+    ))
+    for rows in batches:
+        for product_id, image_url in rows:
+            images.setdefault(product_id, []).append(image_url)
+
+    products = []
+    for distance, row in listings:
+        product = project(row, NEARBY_PRODUCT_FIELDS, fields)
+        if 'images' in fields:
+            product['images'] = images.get(row.product_id, [])
+        if 'shop_name' in fields:
+            product['shop_name'] = nearby_shops[row.shop_id][0]
+        if 'distance' in fields:
+            product['distance'] = distance
+        products.append(product)
+    return 200, products
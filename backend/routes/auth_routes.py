@@ -1,9 +1,10 @@
 from flask import Blueprint, jsonify, request
 from models import db, User
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import datetime
 import os
+from utils.passwords import PasswordHashingBusy, password_hasher
+from utils.principal_cache import principal_cache
 
 bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
@@ -29,7 +30,7 @@ def register():
         new_user = User(
             name=data['name'],
             email=data['email'],
-            password=generate_password_hash(data['password']),
+            password=password_hasher.hash(data['password']),
             phone=data['phone']
         )
         
@@ -40,6 +41,9 @@ def register():
             'message': 'User registered successfully',
             'user_id': new_user.user_id
         }), 201
+    except PasswordHashingBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -56,9 +60,18 @@ def login():
         # Find user by email
         user = User.query.filter_by(email=data['email']).first()
         
-        if not user or not check_password_hash(user.password, data['password']):
+        if not user:
+            return jsonify({'error': 'Invalid email or password'}), 401
+        
+        valid, new_hash = password_hasher.verify_and_update(user.password, data['password'])
+        if not valid:
             return jsonify({'error': 'Invalid email or password'}), 401
         
+        # Upgrade a hash made with an older PASSWORD_HASH_METHOD now that the password is known
+        if new_hash:
+            user.password = new_hash
+            db.session.commit()
+        
         # Generate JWT token
         token = jwt.encode({
             'user_id': user.user_id,
@@ -76,6 +89,8 @@ def login():
                 'email': user.email
             }
         })
+    except PasswordHashingBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -94,9 +109,8 @@ def validate_token():
         return jsonify({'valid': False, 'error': 'Token is missing'}), 401
     
     try:
-        # Decode token
-        data = jwt.decode(token, os.getenv('SECRET_KEY', 'dev_key_change_in_production'), algorithms=['HS256'])
-        current_user = User.query.get(data['user_id'])
+        # Decode token, or reuse the user it resolved to recently
+        data, current_user = principal_cache.load_user(token)
         
         if not current_user:
             return jsonify({'valid': False, 'error': 'User not found'}), 401
@@ -128,9 +142,8 @@ def token_required(f):
             return jsonify({'error': 'Token is missing'}), 401
         
         try:
-            # Decode token
-            data = jwt.decode(token, os.getenv('SECRET_KEY', 'dev_key_change_in_production'), algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            # Decode token, or reuse the user it resolved to recently
+            data, current_user = principal_cache.load_user(token)
         except:
             return jsonify({'error': 'Token is invalid or expired'}), 401
         
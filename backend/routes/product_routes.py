@@ -1,20 +1,115 @@
-from flask import Blueprint, jsonify, request
-from models import db, Product, ProductCategory, ProductImage, ProductReview, ShopProduct, User, SearchHistory
+from flask import Blueprint, current_app, jsonify, request
+from models import db, Product, ProductCategory, ProductReview, Shop, ShopAddress, ShopProduct, User
 from routes.auth_routes import token_required
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+from utils.cache import response_cache
+from utils.catalog import (PRICE_RANGE_FIELDS, add_price_range, category_product_counts, first_images, price_ranges,
+                           product_images)
+from utils.fields import InvalidFields, column_field, field_columns, project, requested_fields
+from utils.geo import bounding_box, nearest_within, round_distance
+from utils.json_encoding import stream_json_array
+from utils.nearby import nearest_shop_products
+from utils.pagination import InvalidCursor, encode_cursor, page_args, page_response, paginate
+from utils.search_history import search_history_writer
+from utils.search_index import SORTS as SEARCH_SORTS, product_search_index
 
 bp = Blueprint('products', __name__, url_prefix='/api/products')
 
+# Orders for /api/products/ as (keyset columns, cursor values of a product); ratings are the stored aggregates
+PRODUCT_SORTS = {
+    'id': ([Product.product_id], lambda product: [product.product_id]),
+    'rating': ([(Product.avg_rating, True), (Product.review_count, True), Product.product_id],
+               lambda product: [product.avg_rating, product.review_count, product.product_id]),
+    'reviews': ([(Product.review_count, True), (Product.avg_rating, True), Product.product_id],
+                lambda product: [product.review_count, product.avg_rating, product.product_id]),
+}
+
+# Fields of /api/products/ as (columns, value of a row); images and price ranges come from queries of their own
+PRODUCT_FIELDS = {
+    'product_id': column_field(Product.product_id),
+    'product_name': column_field(Product.product_name),
+    'brand': column_field(Product.brand),
+    'description': column_field(Product.description),
+    'color': column_field(Product.color),
+    'category': column_field(ProductCategory.category_name),
+    'images': ([], None),
+    'avg_rating': column_field(Product.avg_rating, lambda avg_rating: round(avg_rating or 0, 1)),
+    'review_count': column_field(Product.review_count, lambda review_count: review_count or 0),
+    **{name: ([], None) for name in PRICE_RANGE_FIELDS},
+}
+
+# Fields of /api/products/<product_id>; shops and reviews are only queried when asked for
+PRODUCT_DETAIL_FIELDS = {
+    **{name: PRODUCT_FIELDS[name] for name in
+       ('product_id', 'product_name', 'brand', 'description', 'color', 'category', 'images')},
+    'shops': ([], None),
+    'reviews': ([], None),
+    'reviews_next_cursor': ([], None),
+    'avg_rating': PRODUCT_FIELDS['avg_rating'],
+    'review_count': PRODUCT_FIELDS['review_count'],
+}
+
+# Fields of /api/products/search; matches are ranked by the search index and the page's rows read by id
+SEARCH_FIELDS = {
+    **{name: PRODUCT_FIELDS[name] for name in ('product_id', 'product_name', 'brand')},
+    'description': column_field(
+        Product.description,
+        lambda description: description[:100] + '...' if description and len(description) > 100 else description
+    ),
+    'category': PRODUCT_FIELDS['category'],
+    'image': ([], None),
+    'avg_rating': PRODUCT_FIELDS['avg_rating'],
+    'review_count': PRODUCT_FIELDS['review_count'],
+    **{name: ([], None) for name in PRICE_RANGE_FIELDS},
+}
+
+# Fields of /api/products/nearby; Products is only joined when one of its columns is asked for
+NEARBY_PRODUCT_FIELDS = {
+    'product_id': column_field(ShopProduct.product_id),
+    'product_name': column_field(Product.product_name),
+    'description': column_field(Product.description),
+    'brand': column_field(Product.brand),
+    'color': column_field(Product.color),
+    'category_id': column_field(Product.category_id),
+    'images': ([], None),
+    'price': column_field(ShopProduct.price, lambda price: float(price) if price else 0.0),
+    'stock': column_field(ShopProduct.stock),
+    'shop_name': ([], None),
+    'distance': ([], None),
+}
+
+# Candidate shops for /nearby; both range predicates are sargable against IX_Shop_Address_Latitude_Longitude
+NEARBY_SHOPS_SQL = text("""
+SELECT s.shop_id, s.shop_name, sa.latitude, sa.longitude
+FROM Shop_Address sa
+JOIN Shops s ON s.shop_id = sa.shop_id
+WHERE sa.latitude BETWEEN :min_lat AND :max_lat
+  AND sa.longitude BETWEEN :min_lon AND :max_lon
+""")
+
 @bp.route('/', methods=['GET'])
 def get_products():
     try:
         # Get query parameters for filtering
         category_id = request.args.get('category_id', type=int)
         brand = request.args.get('brand')
-        limit = request.args.get('limit', 20, type=int)
+        sort = request.args.get('sort', 'id')
+        min_rating = request.args.get('min_rating', type=float)
+        min_reviews = request.args.get('min_reviews', type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor, limit = page_args()
+        fields = requested_fields(PRODUCT_FIELDS)
+        
+        if sort not in PRODUCT_SORTS:
+            return jsonify({'error': f'sort must be one of: {", ".join(PRODUCT_SORTS)}'}), 400
         
-        # Build query
-        query = Product.query
+        # Select only the requested columns plus the sort key, as plain rows
+        columns, key = PRODUCT_SORTS[sort]
+        sort_columns = [column[0] if isinstance(column, tuple) else column for column in columns]
+        query = db.session.query(*field_columns(PRODUCT_FIELDS, fields, *sort_columns))
+        if 'category' in fields:
+            query = query.outerjoin(ProductCategory, ProductCategory.category_id == Product.category_id)
         
         if category_id:
             query = query.filter(Product.category_id == category_id)
@@ -22,85 +117,105 @@ def get_products():
         if brand:
             query = query.filter(Product.brand.ilike(f'%{brand}%'))
         
-        # Execute query with pagination
-        products = query.order_by(Product.product_id).limit(limit).offset(offset).all()
+        # Rating filters read the stored aggregates, never Product_Reviews
+        if min_rating is not None:
+            query = query.filter(Product.avg_rating >= min_rating)
+        
+        if min_reviews is not None:
+            query = query.filter(Product.review_count >= min_reviews)
+        
+        # Execute query with keyset pagination
+        products, next_cursor = paginate(query, columns, cursor, limit, key=key, offset=offset)
+        
+        # Get images and price ranges across shops for the whole page in one query each, if asked for
+        product_ids = [product.product_id for product in products]
+        images = product_images(product_ids) if 'images' in fields else {}
+        ranges = price_ranges(product_ids) if set(PRICE_RANGE_FIELDS) & set(fields) else {}
         
         result = []
         for product in products:
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'brand': product.brand,
-                'description': product.description,
-                'color': product.color,
-                'category': product.category.category_name if product.category else None,
-                'images': [img.image_url for img in product.images]
-            }
-            
-            # Get price range across shops
-            shop_products = ShopProduct.query.filter_by(product_id=product.product_id).all()
-            if shop_products:
-                prices = [sp.price for sp in shop_products]
-                product_data['min_price'] = min(prices)
-                product_data['max_price'] = max(prices)
-                product_data['available_in_shops'] = len(shop_products)
-            
-            result.append(product_data)
-        
-        return jsonify(result)
+            product_data = project(product, PRODUCT_FIELDS, fields)
+            if 'images' in fields:
+                product_data['images'] = images.get(product.product_id, [])
+            result.append(add_price_range(product_data, ranges, product.product_id, fields))
+        
+        return page_response(result, next_cursor)
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         # print(e)
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/<int:product_id>', methods=['GET'])
+@response_cache.cached(ttl=120, tags=lambda product_id: [f'product:{product_id}', 'product_details'])
 def get_product(product_id):
     try:
-        product = Product.query.get_or_404(product_id)
-        
-        # Get all shops that have this product
-        shops_with_product = []
-        for shop_product in product.shop_products:
-            shop = shop_product.shop
-            shops_with_product.append({
-                'shop_id': shop.shop_id,
-                'shop_name': shop.shop_name,
-                'price': shop_product.price,
-                'stock': shop_product.stock,
-                'area': shop.address.area if shop.address else None,
-                'city': shop.address.city if shop.address else None
-            })
-        
-        # Get product reviews
-        reviews = []
-        for review in product.reviews:
-            reviews.append({
-                'review_id': review.review_id,
-                'user_name': review.user.name,
-                'rating': review.rating,
-                'review_text': review.review_text,
-                'created_at': review.created_at
-            })
-        
-        # Calculate average rating
-        avg_rating = 0
-        if reviews:
-            avg_rating = sum(review['rating'] for review in reviews) / len(reviews)
-        
-        result = {
-            'product_id': product.product_id,
-            'product_name': product.product_name,
-            'brand': product.brand,
-            'description': product.description,
-            'color': product.color,
-            'category': product.category.category_name if product.category else None,
-            'images': [img.image_url for img in product.images],
-            'shops': shops_with_product,
-            'reviews': reviews,
-            'avg_rating': round(avg_rating, 1),
-            'review_count': len(reviews)
-        }
+        fields = requested_fields(PRODUCT_DETAIL_FIELDS)
+        query = db.session.query(*field_columns(PRODUCT_DETAIL_FIELDS, fields, Product.product_id))
+        if 'category' in fields:
+            query = query.outerjoin(ProductCategory, ProductCategory.category_id == Product.category_id)
+        product = query.filter(Product.product_id == product_id).first_or_404()
+        result = project(product, PRODUCT_DETAIL_FIELDS, fields)
+        
+        if 'images' in fields:
+            result['images'] = product_images([product_id]).get(product_id, [])
+        
+        # Get all shops that have this product, with their addresses, in one query
+        if 'shops' in fields:
+            result['shops'] = [{
+                'shop_id': row.shop_id,
+                'shop_name': row.shop_name,
+                'price': row.price,
+                'stock': row.stock,
+                'area': row.area,
+                'city': row.city
+            } for row in db.session.query(
+                Shop.shop_id, Shop.shop_name, ShopProduct.price, ShopProduct.stock, ShopAddress.area, ShopAddress.city
+            ).join(
+                Shop, Shop.shop_id == ShopProduct.shop_id
+            ).outerjoin(
+                ShopAddress, ShopAddress.shop_id == Shop.shop_id
+            ).filter(ShopProduct.product_id == product_id).order_by(ShopProduct.shop_product_id)]
+        
+        # Only the newest reviews; the rest are paged through /<product_id>/reviews
+        if 'reviews' in fields or 'reviews_next_cursor' in fields:
+            reviews, reviews_next_cursor = _review_page(product_id, None,
+                                                        current_app.config.get('PAGE_SIZE_DEFAULT', 20))
+            if 'reviews' in fields:
+                result['reviews'] = reviews
+            if 'reviews_next_cursor' in fields:
+                result['reviews_next_cursor'] = reviews_next_cursor
         
         return jsonify(result)
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _review_page(product_id, cursor, limit):
+    """One newest-first page of a product's reviews with reviewer names, as ``(items, next_cursor)``"""
+    query = ProductReview.query.options(
+        joinedload(ProductReview.user).load_only(User.name)
+    ).filter(ProductReview.product_id == product_id)
+    reviews, next_cursor = paginate(query, [(ProductReview.review_id, True)], cursor, limit,
+                                    key=lambda review: [review.review_id])
+    return [{
+        'review_id': review.review_id,
+        'user_name': review.user.name if review.user else None,
+        'rating': review.rating,
+        'review_text': review.review_text,
+        'created_at': review.created_at
+    } for review in reviews], next_cursor
+
+@bp.route('/<int:product_id>/reviews', methods=['GET'])
+@response_cache.cached(ttl=120, tags=lambda product_id: [f'product:{product_id}', 'product_details'])
+def get_product_reviews(product_id):
+    try:
+        cursor, limit = page_args()
+        reviews, next_cursor = _review_page(product_id, cursor, limit)
+        return page_response(reviews, next_cursor)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -109,68 +224,89 @@ def search_products():
     try:
         query = request.args.get('q', '')
         user_id = request.args.get('user_id', type=int)
+        sort = request.args.get('sort', 'relevance')
+        min_rating = request.args.get('min_rating', type=float)
+        min_reviews = request.args.get('min_reviews', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        cursor, limit = page_args()
+        fields = requested_fields(SEARCH_FIELDS)
         
         if not query:
             return jsonify({'error': 'Search query is required'}), 400
         
-        # Save search history if user_id is provided
+        if sort not in SEARCH_SORTS:
+            return jsonify({'error': f'sort must be one of: {", ".join(SEARCH_SORTS)}'}), 400
+        
+        # Queue search history if user_id is provided; it is written in batches in the background
         if user_id:
+            search_history_writer.record(user_id, query)
+        
+        # Rank matches on product name, brand, description and category through the search index
+        after = None
+        if cursor is not None:
             try:
-                search_history = SearchHistory(
-                    user_id=user_id,
-                    search_item=query
-                )
-                db.session.add(search_history)
-                db.session.commit()
-            except:
-                db.session.rollback()
-        
-        # Search in product name, description, and brand
-        products = Product.query.filter(
-            db.or_(
-                Product.product_name.ilike(f'%{query}%'),
-                Product.description.ilike(f'%{query}%'),
-                Product.brand.ilike(f'%{query}%')
-            )
-        ).all()
+                after = tuple(float(value) for value in cursor[:-1]) + (int(cursor[-1]),)
+            except (IndexError, TypeError, ValueError):
+                raise InvalidCursor('Invalid cursor')
+            if len(after) != len(product_search_index.cursor_values(0, 0.0, sort)):
+                raise InvalidCursor('Invalid cursor')
+        total, hits = product_search_index.search(
+            query, limit=limit + 1, offset=0 if after else offset, after=after,
+            sort=sort, min_rating=min_rating, min_reviews=min_reviews
+        )
+        next_cursor = None
+        if len(hits) > limit:
+            next_cursor = encode_cursor(product_search_index.cursor_values(hits[limit - 1][0], hits[limit - 1][1], sort))
+        ranked_ids = [product_id for product_id, _ in hits[:limit]]
+        products = []
+        if ranked_ids:
+            # Read only the requested columns of the page's matches, as plain rows
+            rank = {product_id: position for position, product_id in enumerate(ranked_ids)}
+            rows = db.session.query(*field_columns(SEARCH_FIELDS, fields, Product.product_id))
+            if 'category' in fields:
+                rows = rows.outerjoin(ProductCategory, ProductCategory.category_id == Product.category_id)
+            products = rows.filter(Product.product_id.in_(ranked_ids)).all()
+            products.sort(key=lambda product: rank[product.product_id])
+        
+        # Get price ranges and first images for all matches in one query each, if asked for
+        product_ids = [product.product_id for product in products]
+        ranges = price_ranges(product_ids) if set(PRICE_RANGE_FIELDS) & set(fields) else {}
+        images = first_images(product_ids) if 'image' in fields else {}
         
         result = []
         for product in products:
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'brand': product.brand,
-                'description': product.description[:100] + '...' if len(product.description) > 100 else product.description,
-                'category': product.category.category_name if product.category else None,
-                'image': product.images[0].image_url if product.images else None
-            }
-            
-            # Get price range across shops
-            shop_products = ShopProduct.query.filter_by(product_id=product.product_id).all()
-            if shop_products:
-                prices = [sp.price for sp in shop_products]
-                product_data['min_price'] = min(prices)
-                product_data['max_price'] = max(prices)
-                product_data['available_in_shops'] = len(shop_products)
-            
-            result.append(product_data)
-        
-        return jsonify(result)
+            product_data = project(product, SEARCH_FIELDS, fields)
+            if 'image' in fields:
+                product_data['image'] = images.get(product.product_id)
+            result.append(add_price_range(product_data, ranges, product.product_id, fields))
+        
+        response = page_response(result, next_cursor)
+        response.headers['X-Total-Count'] = str(total)
+        return response
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/categories', methods=['GET'])
+@response_cache.cached(ttl=300, tags=['categories'])
 def get_categories():
     try:
         categories = ProductCategory.query.all()
-        result = []
         
+        # Read the maintained counters when enabled, otherwise count every category in one query
+        if current_app.config.get('CATEGORY_PRODUCT_COUNT_MAINTAINED'):
+            counts = {category.category_id: category.product_count for category in categories}
+        else:
+            counts = category_product_counts()
+        
+        result = []
         for category in categories:
             result.append({
                 'category_id': category.category_id,
                 'category_name': category.category_name,
                 'category_description': category.category_description,
-                'product_count': Product.query.filter_by(category_id=category.category_id).count()
+                'product_count': counts.get(category.category_id, 0)
             })
         
         return jsonify(result)
@@ -201,12 +337,15 @@ def add_review(current_user, product_id):
             review_text=data['review_text']
         )
         
+        # The product's avg_rating and review_count are updated in the same transaction
         db.session.add(new_review)
         db.session.commit()
         
         return jsonify({
             'message': 'Review added successfully',
-            'review_id': new_review.review_id
+            'review_id': new_review.review_id,
+            'avg_rating': round(product.avg_rating, 1),
+            'review_count': product.review_count
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -221,79 +360,67 @@ def get_nearby_products():
         latitude = request.args.get('latitude', type=float)
         longitude = request.args.get('longitude', type=float)
         radius = request.args.get('radius', default=10, type=float)  # Default 10km radius
+        category_id = request.args.get('category_id', type=int)
+        max_price = request.args.get('max_price', type=float)
+        in_stock = request.args.get('in_stock', 'false').lower() in ('true', '1', 'yes')
+        limit = request.args.get('limit', current_app.config.get('NEARBY_PRODUCTS_DEFAULT_LIMIT', 50), type=int)
+        limit = max(1, min(limit, current_app.config.get('NEARBY_PRODUCTS_MAX_LIMIT', 500)))
+        fields = requested_fields(NEARBY_PRODUCT_FIELDS)
         
         if not latitude or not longitude:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
         
-        # Use SQLAlchemy ORM approach instead of raw SQL
-        from sqlalchemy import text
-        
-        # First, get nearby shops
-        shops_query = text("""
-        SELECT s.shop_id, s.shop_name, sa.latitude, sa.longitude,
-               (6371 * ACOS(COS(RADIANS(:latitude)) * COS(RADIANS(sa.latitude)) * 
-                COS(RADIANS(sa.longitude) - RADIANS(:longitude)) + 
-                SIN(RADIANS(:latitude)) * SIN(RADIANS(sa.latitude)))) AS distance
-        FROM Shops s
-        JOIN Shop_Address sa ON s.shop_id = sa.shop_id
-        WHERE (6371 * ACOS(COS(RADIANS(:latitude)) * COS(RADIANS(sa.latitude)) * 
-              COS(RADIANS(sa.longitude) - RADIANS(:longitude)) + 
-              SIN(RADIANS(:latitude)) * SIN(RADIANS(sa.latitude)))) <= :radius
-        ORDER BY distance
-        """)
-        
-        shops_result = db.session.execute(shops_query, {
-            'latitude': latitude,
-            'longitude': longitude,
-            'radius': radius
-        })
-        
-        nearby_shops = []
-        for shop_row in shops_result:
-            nearby_shops.append({
-                'shop_id': shop_row.shop_id,
-                'shop_name': shop_row.shop_name,
-                'distance': float(shop_row.distance)
-            })
+        # Prefilter with an index-friendly bounding box; the exact distance check runs on the survivors
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+        shop_rows = db.session.execute(NEARBY_SHOPS_SQL, {
+            'min_lat': min_lat,
+            'max_lat': max_lat,
+            'min_lon': min_lon,
+            'max_lon': max_lon
+        }).fetchall()
+        
+        order, distances = nearest_within(
+            latitude, longitude,
+            [float(row.latitude) for row in shop_rows],
+            [float(row.longitude) for row in shop_rows],
+            radius=radius
+        )
+        
+        # Shop name and distance by shop_id, nearest first
+        nearby_shops = {}
+        for index, distance in zip(order.tolist(), distances.tolist()):
+            shop_row = shop_rows[index]
+            nearby_shops[shop_row.shop_id] = (shop_row.shop_name, round_distance(distance))
         
         if not nearby_shops:
             return jsonify([])
         
-        # Get products from nearby shops
-        shop_ids = [shop['shop_id'] for shop in nearby_shops]
-        shop_products = ShopProduct.query.filter(ShopProduct.shop_id.in_(shop_ids)).all()
-        
-        products = []
-        for sp in shop_products:
-            product = sp.product
-            shop = sp.shop
-            
-            # Find the distance for this shop
-            shop_distance = next((s['distance'] for s in nearby_shops if s['shop_id'] == shop.shop_id), 0)
-            
-            # Get product images
-            product_images = ProductImage.query.filter_by(product_id=product.product_id).all()
-            images = [img.image_url for img in product_images] if product_images else []
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'description': product.description,
-                'brand': product.brand,
-                'color': product.color,
-                'category_id': product.category_id,
-                'images': images,
-                'price': float(sp.price) if sp.price else 0.0,
-                'stock': sp.stock,
-                'shop_name': shop.shop_name,
-                'distance': shop_distance
-            }
-            products.append(product_data)
-        
-        # Sort by distance
-        products.sort(key=lambda x: x['distance'])
-        
-        return jsonify(products)
+        # Closest matching listings only, reading just the requested columns, then their images in one batch
+        listings = nearest_shop_products(
+            [(distance, shop_id) for shop_id, (_, distance) in nearby_shops.items()],
+            limit,
+            category_id=category_id,
+            max_price=max_price,
+            in_stock=in_stock,
+            columns=field_columns(NEARBY_PRODUCT_FIELDS, fields, ShopProduct.product_id)
+        )
+        images = product_images({row.product_id for _, row in listings}) if 'images' in fields else {}
+        
+        # Listings and images are fetched above; while the response streams each listing is only formatted
+        def products():
+            for distance, row in listings:
+                product = project(row, NEARBY_PRODUCT_FIELDS, fields)
+                if 'images' in fields:
+                    product['images'] = images.get(row.product_id, [])
+                if 'shop_name' in fields:
+                    product['shop_name'] = nearby_shops[row.shop_id][0]
+                if 'distance' in fields:
+                    product['distance'] = distance
+                yield product
+        
+        return stream_json_array(products())
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1,32 +1,101 @@
 from flask import Blueprint, jsonify, request
-from models import db, Shop, ShopAddress, ShopTiming, ShopProduct, Product
-import math
+from models import db, Shop, ShopAddress, ShopTiming, ShopProduct, Product, ProductCategory
+from utils.cache import response_cache
+from utils.catalog import chunked
+from utils.fields import InvalidFields, column_field, field_columns, project, requested_fields
+from utils.geo import round_distance
+from utils.json_encoding import stream_json_array
+from utils.pagination import InvalidCursor, page_args, page_response, paginate
+from utils.spatial_index import shop_index
 
 bp = Blueprint('shops', __name__, url_prefix='/api/shops')
 
+# Fields of /api/shops/ as (columns, value of a row); the address is read by a query of its own
+SHOP_FIELDS = {
+    'shop_id': column_field(Shop.shop_id),
+    'shop_name': column_field(Shop.shop_name),
+    'shop_image': column_field(Shop.shop_image),
+    'created_at': column_field(Shop.created_at, lambda created_at: created_at.isoformat() if created_at else None),
+    'address': ([], None),
+}
+
+# Fields of /api/shops/<shop_id>; address and timings are only queried when asked for
+SHOP_DETAIL_FIELDS = {
+    **SHOP_FIELDS,
+    'created_at': column_field(Shop.created_at),
+    'timings': ([], None),
+}
+
+# Fields of /api/shops/<shop_id>/products; Products and its category are only joined when asked for
+SHOP_PRODUCT_FIELDS = {
+    'product_id': column_field(ShopProduct.product_id),
+    'product_name': column_field(Product.product_name),
+    'brand': column_field(Product.brand),
+    'price': column_field(ShopProduct.price),
+    'stock': column_field(ShopProduct.stock),
+    'category': column_field(ProductCategory.category_name),
+}
+
+# Fields of /nearby; read as plain rows, so matching thousands of shops hydrates no ORM objects
+NEARBY_SHOP_FIELDS = {
+    'shop_id': column_field(Shop.shop_id),
+    'shop_name': column_field(Shop.shop_name),
+    'address': ([ShopAddress.city, ShopAddress.area, ShopAddress.pincode, ShopAddress.latitude, ShopAddress.longitude],
+                lambda row: {
+                    'city': row.city,
+                    'area': row.area,
+                    'pincode': row.pincode,
+                    'latitude': float(row.latitude),
+                    'longitude': float(row.longitude)
+                }),
+    'latitude': column_field(ShopAddress.latitude, float),
+    'longitude': column_field(ShopAddress.longitude, float),
+    'image': column_field(Shop.shop_image),
+    'distance': ([], None),
+}
+
+
+def _addresses(shop_ids, *columns):
+    """The address of each of ``shop_ids`` as a row of ``columns``, in one query per IN batch"""
+    addresses = {}
+    for batch in chunked(list(shop_ids)):
+        for row in db.session.query(ShopAddress.shop_id, *columns).filter(
+            ShopAddress.shop_id.in_(batch)
+        ).order_by(ShopAddress.address_id):
+            addresses.setdefault(row.shop_id, row)
+    return addresses
+
 @bp.route('/', methods=['GET'])
+@response_cache.cached(ttl=60, tags=['shops'])
 def get_shops():
-    # Get all shops with optional filtering
+    # Get all shops with optional filtering, one page at a time
     try:
-        shops = Shop.query.all()
+        cursor, limit = page_args()
+        fields = requested_fields(SHOP_FIELDS)
+        shops, next_cursor = paginate(
+            db.session.query(*field_columns(SHOP_FIELDS, fields, Shop.shop_id)), [Shop.shop_id], cursor, limit,
+            key=lambda shop: [shop.shop_id]
+        )
+        addresses = {}
+        if 'address' in fields:
+            addresses = _addresses([shop.shop_id for shop in shops], ShopAddress.city, ShopAddress.area,
+                                   ShopAddress.pincode, ShopAddress.latitude, ShopAddress.longitude)
         result = []
         for shop in shops:
-            shop_data = {
-                'shop_id': shop.shop_id,
-                'shop_name': shop.shop_name,
-                'shop_image': shop.shop_image,
-                'created_at': shop.created_at.isoformat() if shop.created_at else None
-            }
-            if shop.address:
+            shop_data = project(shop, SHOP_FIELDS, fields)
+            address = addresses.get(shop.shop_id)
+            if address:
                 shop_data['address'] = {
-                    'city': shop.address.city,
-                    'area': shop.address.area,
-                    'pincode': shop.address.pincode,
-                    'latitude': float(shop.address.latitude),
-                    'longitude': float(shop.address.longitude)
+                    'city': address.city,
+                    'area': address.area,
+                    'pincode': address.pincode,
+                    'latitude': float(address.latitude),
+                    'longitude': float(address.longitude)
                 }
             result.append(shop_data)
-        return jsonify(result)
+        return page_response(result, next_cursor)
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -37,136 +106,120 @@ def get_nearby_shops():
         latitude = request.args.get('latitude', type=float)
         longitude = request.args.get('longitude', type=float)
         radius = request.args.get('radius', default=10, type=float)  # Default 10km radius
+        limit = request.args.get('limit', type=int)
+        fields = requested_fields(NEARBY_SHOP_FIELDS)
         
         if not latitude or not longitude:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
         
-        # Get all shops with addresses and calculate distance
-        shops = Shop.query.join(ShopAddress).filter(
-            ShopAddress.latitude.isnot(None),
-            ShopAddress.longitude.isnot(None)
-        ).all()
+        # Look up candidate shops in the spatial index instead of scanning every address
+        if limit:
+            hits = shop_index.nearest(latitude, longitude, limit, max_distance=radius)
+        else:
+            hits = shop_index.query_radius(latitude, longitude, radius)
         
-        nearby_shops = []
+        if not hits:
+            return jsonify([])
         
-        for shop in shops:
-            if shop.address and shop.address.latitude and shop.address.longitude:
-                # Calculate distance using Haversine formula
-                distance = calculate_distance(
-                    latitude, longitude,
-                    float(shop.address.latitude), float(shop.address.longitude)
-                )
-                
-                if distance <= radius:
-                    shop_data = {
-                        'shop_id': shop.shop_id,
-                        'shop_name': shop.shop_name,
-                        'description': shop.description,
-                        'address': {
-                            'city': shop.address.city,
-                            'area': shop.address.area,
-                            'pincode': shop.address.pincode,
-                            'latitude': float(shop.address.latitude),
-                            'longitude': float(shop.address.longitude)
-                        } if shop.address else None,
-                        'phone': shop.phone,
-                        'email': shop.email,
-                        'website': shop.website,
-                        'latitude': float(shop.address.latitude),
-                        'longitude': float(shop.address.longitude),
-                        'image': shop.shop_image,
-                        'distance': round(distance, 2)
-                    }
-                    nearby_shops.append(shop_data)
+        # Shop_Address is only joined when one of its columns is asked for
+        columns = field_columns(NEARBY_SHOP_FIELDS, fields, Shop.shop_id)
+        query = db.session.query(*columns)
+        if any(column.class_ is ShopAddress for column in columns):
+            query = query.join(ShopAddress, ShopAddress.shop_id == Shop.shop_id)
+        
+        # Every query runs before the response starts, so it is counted in the request's SQL profile and metrics
+        shops = {}
+        for batch in chunked(hits):
+            for row in query.filter(Shop.shop_id.in_([shop_id for _, shop_id in batch])):
+                shops.setdefault(row.shop_id, row)
         
-        # Sort by distance
-        nearby_shops.sort(key=lambda x: x['distance'])
+        def nearby_shops():
+            # Only formatting and encoding happen while the response streams
+            for distance, shop_id in hits:
+                shop = shops.get(shop_id)
+                if not shop:
+                    continue
+                shop_data = project(shop, NEARBY_SHOP_FIELDS, fields)
+                if 'distance' in fields:
+                    shop_data['distance'] = round_distance(distance)
+                yield shop_data
         
-        return jsonify(nearby_shops)
+        return stream_json_array(nearby_shops())
         
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    # Radius of the Earth in kilometers
-    R = 6371.0
-    
-    # Convert latitude and longitude from degrees to radians
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    
-    # Calculate the differences
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    
-    # Apply Haversine formula
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    # Distance in kilometers
-    distance = R * c
-    
-    return distance
-
 @bp.route('/<int:shop_id>', methods=['GET'])
+@response_cache.cached(ttl=300, tags=lambda shop_id: [f'shop:{shop_id}'])
 def get_shop(shop_id):
     # Get details of a specific shop
     try:
-        shop = Shop.query.get_or_404(shop_id)
-        shop_data = {
-            'shop_id': shop.shop_id,
-            'shop_name': shop.shop_name,
-            'shop_image': shop.shop_image,
-            'created_at': shop.created_at
-        }
+        fields = requested_fields(SHOP_DETAIL_FIELDS)
+        shop = db.session.query(*field_columns(SHOP_DETAIL_FIELDS, fields, Shop.shop_id)).filter(
+            Shop.shop_id == shop_id
+        ).first_or_404()
+        shop_data = project(shop, SHOP_DETAIL_FIELDS, fields)
         
         # Add address information
-        if shop.address:
+        address = None
+        if 'address' in fields:
+            address = _addresses([shop_id], ShopAddress.city, ShopAddress.area, ShopAddress.landmark,
+                                 ShopAddress.pincode, ShopAddress.country, ShopAddress.latitude,
+                                 ShopAddress.longitude).get(shop_id)
+        if address:
             shop_data['address'] = {
-                'city': shop.address.city,
-                'area': shop.address.area,
-                'landmark': shop.address.landmark,
-                'pincode': shop.address.pincode,
-                'country': shop.address.country,
-                'latitude': float(shop.address.latitude),
-                'longitude': float(shop.address.longitude)
+                'city': address.city,
+                'area': address.area,
+                'landmark': address.landmark,
+                'pincode': address.pincode,
+                'country': address.country,
+                'latitude': float(address.latitude),
+                'longitude': float(address.longitude)
             }
         
         # Add timing information
-        timings = []
-        for timing in shop.timings:
-            timings.append({
-                'day': timing.day,
-                'open_time': timing.open_time.strftime('%H:%M'),
-                'close_time': timing.close_time.strftime('%H:%M')
-            })
-        shop_data['timings'] = timings
+        if 'timings' in fields:
+            timings = []
+            for timing in db.session.query(ShopTiming.day, ShopTiming.open_time, ShopTiming.close_time).filter(
+                ShopTiming.shop_id == shop_id
+            ).order_by(ShopTiming.timing_id):
+                timings.append({
+                    'day': timing.day,
+                    'open_time': timing.open_time.strftime('%H:%M'),
+                    'close_time': timing.close_time.strftime('%H:%M')
+                })
+            shop_data['timings'] = timings
         
         return jsonify(shop_data)
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/<int:shop_id>/products', methods=['GET'])
+@response_cache.cached(ttl=120, tags=lambda shop_id: [f'shop:{shop_id}', f'shop_products:{shop_id}', 'shop_products'])
 def get_shop_products(shop_id):
-    # Get all products available in a specific shop
+    # Get the products available in a specific shop, one page at a time
     try:
-        shop = Shop.query.get_or_404(shop_id)
-        products = []
-        
-        for shop_product in shop.products:
-            product = shop_product.product
-            products.append({
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'brand': product.brand,
-                'price': shop_product.price,
-                'stock': shop_product.stock,
-                'category': product.category.category_name if product.category else None
-            })
+        shop = db.session.query(Shop.shop_id).filter(Shop.shop_id == shop_id).first_or_404()
+        cursor, limit = page_args()
+        fields = requested_fields(SHOP_PRODUCT_FIELDS)
+        query = db.session.query(*field_columns(SHOP_PRODUCT_FIELDS, fields, ShopProduct.shop_product_id))
+        if {'product_name', 'brand', 'category'} & set(fields):
+            query = query.join(Product, Product.product_id == ShopProduct.product_id)
+        if 'category' in fields:
+            query = query.outerjoin(ProductCategory, ProductCategory.category_id == Product.category_id)
+        shop_products, next_cursor = paginate(
+            query.filter(ShopProduct.shop_id == shop.shop_id),
+            [ShopProduct.shop_product_id], cursor, limit,
+            key=lambda shop_product: [shop_product.shop_product_id]
+        )
+        products = [project(shop_product, SHOP_PRODUCT_FIELDS, fields) for shop_product in shop_products]
         
-        return jsonify(products)
+        return page_response(products, next_cursor)
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
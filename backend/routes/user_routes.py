@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify, request
 from models import db, User, SearchHistory, ProductReview
-from werkzeug.security import generate_password_hash
 from utils.auth import token_required
+from utils.pagination import InvalidCursor, page_args, page_response, paginate
+from utils.passwords import PasswordHashingBusy, password_hasher
 
 bp = Blueprint('users', __name__, url_prefix='/api/users')
 
@@ -9,7 +10,8 @@ bp = Blueprint('users', __name__, url_prefix='/api/users')
 def get_users():
     # Admin only endpoint - would require authentication in production
     try:
-        users = User.query.all()
+        cursor, limit = page_args()
+        users, next_cursor = paginate(User.query, [User.user_id], cursor, limit, key=lambda user: [user.user_id])
         result = []
         for user in users:
             result.append({
@@ -19,7 +21,9 @@ def get_users():
                 'phone': user.phone,
                 'created_at': user.created_at
             })
-        return jsonify(result)
+        return page_response(result, next_cursor)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -91,7 +95,7 @@ def update_user(user_id):
         if 'email' in data:
             user.email = data['email']
         if 'password' in data:
-            user.password = generate_password_hash(data['password'])
+            user.password = password_hasher.hash(data['password'])
         
         db.session.commit()
         
@@ -99,6 +103,9 @@ def update_user(user_id):
             'message': 'User updated successfully',
             'user_id': user.user_id
         })
+    except PasswordHashingBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
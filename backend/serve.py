@@ -0,0 +1,200 @@
+"""
+Pre-fork production server: ``python serve.py --workers 4 --bind 0.0.0.0:8000``.
+
+The parent builds the app, warms the shop and product search indexes once,
+closes its database connections, then forks the workers, which share the
+warmed pages copy-on-write and accept from one listening socket. Workers
+start with an empty connection pool and start their background threads on
+first use, so booting one costs little more than a fork. The parent
+replaces workers that die and stops them all on SIGTERM or SIGINT. With
+more than one worker the response cache must be shared (CACHE_BACKEND=redis)
+or disabled.
+
+Each worker serves with waitress rather than Werkzeug's development server:
+it buffers slow clients' requests and responses on its own event loop, so
+the ``--threads`` app threads only ever run the app, and it bounds the open
+connections per worker.
+"""
+import argparse
+import gc
+import glob
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from waitress import create_server
+
+from app import create_app
+from models import db
+
+logger = logging.getLogger('serve')
+
+
+def warm(app):
+    from utils.search_index import product_search_index
+    from utils.spatial_index import shop_index
+
+    with app.app_context():
+        shop_index.ensure_loaded()
+        product_search_index.ensure_loaded()
+        db.session.remove()
+        # No pooled connection may be inherited by a worker
+        db.engine.dispose()
+
+
+def listen(bind, backlog):
+    host, _, port = bind.rpartition(':')
+    host = host.strip('[]') or '0.0.0.0'
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return host, int(port), sock
+
+
+def run_worker(app, sock, threads):
+    """Serve requests in a forked child until SIGTERM; never returns"""
+    from utils.metrics import metrics
+    from utils.search_history import search_history_writer
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    status = 0
+    try:
+        with app.app_context():
+            # Forget any connections copied from the parent without closing the parent's sockets
+            db.engine.dispose(close=False)
+        create_server(app, sockets=[sock], threads=threads).run()
+    except SystemExit:
+        pass
+    except Exception:
+        logger.exception('Worker %d crashed', os.getpid())
+        status = 1
+    finally:
+        # The parent's atexit handlers are skipped by os._exit, so flush what this worker buffered
+        search_history_writer.shutdown()
+        metrics.flush()
+        os._exit(status)
+
+
+class Arbiter:
+    """
+    Keeps ``workers`` children serving. A worker that dies within FAST_EXIT
+    seconds of starting counts as a fast failure; each one in a row doubles
+    the wait before the next replacement, up to MAX_BACKOFF, and after
+    MAX_FAST_FAILURES the arbiter stops everything and exits with status 1
+    rather than fork a broken worker forever.
+    """
+
+    FAST_EXIT = 10.0
+    MAX_FAST_FAILURES = 5
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, app, sock, workers, threads):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.children = {}
+        self.stopping = False
+        self.fast_failures = 0
+        self.failed = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.sock, self.threads)
+        self.children[pid] = time.monotonic()
+        logger.info('Started worker %d', pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Keep the warmed heap out of the collector so workers do not dirty the shared pages
+        gc.freeze()
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            status = os.waitstatus_to_exitcode(status)
+            started = self.children.pop(pid, None)
+            if self.stopping or started is None:
+                continue
+            if time.monotonic() - started < self.FAST_EXIT:
+                self.fast_failures += 1
+            else:
+                self.fast_failures = 0
+            if self.fast_failures >= self.MAX_FAST_FAILURES:
+                logger.error('Worker %d exited with status %d; %d workers in a row died on startup, giving up',
+                             pid, status, self.fast_failures)
+                self.failed = True
+                self.stop(None, None)
+                continue
+            delay = min(self.MAX_BACKOFF, 2 ** (self.fast_failures - 1)) if self.fast_failures else 0
+            logger.warning('Worker %d exited with status %d; starting a replacement in %.0fs', pid, status, delay)
+            time.sleep(delay)
+            if not self.stopping:
+                self.spawn()
+        if self.failed:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the NearBuy API with pre-forked worker processes.')
+    parser.add_argument('--bind', default=os.getenv('BIND', '0.0.0.0:8000'), help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', '8')), help='threads per worker')
+    parser.add_argument('--config', default=os.getenv('NEARBUY_CONFIG', 'prod'), help='name in config.config_by_name')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--no-warm', action='store_true', help='let each worker load its indexes on first use')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(message)s')
+    logging.getLogger('sqlalchemy').setLevel(logging.WARNING)
+
+    # Workers merge their /metrics through snapshot files; give them a private directory unless one is configured
+    metrics_dir = os.getenv('METRICS_MULTIPROC_DIR')
+    own_metrics_dir = not metrics_dir
+    if own_metrics_dir:
+        metrics_dir = tempfile.mkdtemp(prefix='nearbuy-metrics-')
+    else:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+
+    try:
+        app = create_app(args.config, METRICS_MULTIPROC_DIR=metrics_dir)
+        if args.workers > 1 and app.config.get('CACHE_ENABLED') and app.config.get('CACHE_BACKEND') != 'redis':
+            # A per-process cache only sees its own worker's writes; the others would serve stale pages
+            parser.error(f"CACHE_BACKEND={app.config.get('CACHE_BACKEND')!r} is per-process; "
+                         'set CACHE_BACKEND=redis or CACHE_ENABLED=false to run more than one worker')
+        if not args.no_warm:
+            warm(app)
+        host, port, sock = listen(args.bind, args.backlog)
+        logger.info('Listening on %s:%d with %d workers of %d threads (%s config)', host, port, args.workers,
+                    args.threads, args.config)
+        Arbiter(app, sock, args.workers, args.threads).run()
+    finally:
+        if own_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models import (db, Admin, Product, ProductCategory, ProductImage, ProductReview, Shop,  # noqa: E402
+                    ShopAddress, ShopProduct, User)
+from utils.search_index import product_search_index  # noqa: E402
+from utils.spatial_index import shop_index  # noqa: E402
+
+# Shops in a line east of the origin, roughly 1.1 km apart, in Bhopal
+ORIGIN = (23.2599, 77.4126)
+SHOP_COUNT = 12
+PRODUCT_COUNT = 30
+ADMIN = ('admin', 'admin123')
+
+
+def seed():
+    phones = ProductCategory(category_name='Phones', category_description='Mobile phones')
+    books = ProductCategory(category_name='Books', category_description='Notebooks and paper')
+    db.session.add_all([phones, books])
+    db.session.flush()
+
+    shops = []
+    for index in range(SHOP_COUNT):
+        shop = Shop(shop_name=f'Shop {index}')
+        db.session.add(shop)
+        db.session.flush()
+        db.session.add(ShopAddress(shop_id=shop.shop_id, city='Bhopal' if index % 2 else 'Indore', area=f'Area {index}',
+                                   latitude=Decimal(str(ORIGIN[0])),
+                                   longitude=Decimal(str(round(ORIGIN[1] + index * 0.01, 6)))))
+        shops.append(shop)
+
+    for index in range(PRODUCT_COUNT):
+        phone = index % 3 == 0
+        product = Product(
+            product_name=f'Galaxy Phone {index}' if phone else f'Classmate Notebook {index}',
+            brand='Samsung' if phone else 'Classmate',
+            description=('A phone with a large screen ' if phone else 'Ruled notebook ') * (1 + index % 4),
+            color='black',
+            category_id=(phones if phone else books).category_id,
+        )
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(ProductImage(product_id=product.product_id, image_url=f'https://img.test/{index}.jpg'))
+        for shop in shops[index % 4::4]:
+            db.session.add(ShopProduct(shop_id=shop.shop_id, product_id=product.product_id,
+                                       price=Decimal(100 + index), stock=5))
+
+    reviewer = User(name='Reviewer', email='reviewer@test', password='x', phone='9000000000')
+    db.session.add(reviewer)
+    db.session.flush()
+    for product_id, rating in ((1, 5.0), (1, 4.0), (4, 3.0)):
+        db.session.add(ProductReview(user_id=reviewer.user_id, product_id=product_id, rating=rating,
+                                     review_text='Good'))
+    db.session.add(Admin(*ADMIN))
+    db.session.commit()
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on a seeded SQLite file of its own, with the process-wide indexes emptied"""
+    app = create_app(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "nearbuy.db"}', ANALYTICS_REFRESH_SECONDS=0,
+                     PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    with app.app_context():
+        db.create_all()
+        seed()
+        db.session.remove()
+    product_search_index.invalidate()
+    shop_index.invalidate()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+    product_search_index.invalidate()
+    shop_index.invalidate()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_headers(client):
+    response = client.post('/api/admin/login', json={'userId': ADMIN[0], 'password': ADMIN[1]})
+    return {'Authorization': f'Bearer {response.get_json()["token"]}'}
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from asgi import WsgiBridge
+
+
+def serve(wsgi_app, chunks):
+    """Runs one POST through the bridge, delivering the body in ``chunks``; returns the messages sent back"""
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1}
+                for n, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/echo', 'headers': [(b'content-type', b'text/plain')]}
+    bridge = WsgiBridge(wsgi_app, threads=2)
+    try:
+        asyncio.run(bridge(scope, receive, send))
+    finally:
+        bridge.close()
+    return sent
+
+
+def test_the_body_is_read_as_the_app_asks_for_it():
+    def echo(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        stream = environ['wsgi.input']
+        # Each read waits only for the next message, not for the whole body
+        return [stream.read1(), stream.read1(), stream.read()]
+
+    sent = serve(echo, [b'one ', b'two ', b'three'])
+    assert sent[0]['status'] == 200
+    assert [message['body'] for message in sent[1:]] == [b'one ', b'two ', b'three', b'']
+    assert sent[-1] == {'type': 'http.response.body', 'body': b''}
+
+
+def test_errors_before_the_response_starts_become_a_500():
+    def broken(environ, start_response):
+        raise ValueError('boom')
+
+    sent = serve(broken, [b''])
+    assert sent[0]['status'] == 500
+
+
+def test_errors_after_the_response_starts_abort_the_connection():
+    def broken(environ, start_response):
+        start_response('200 OK', [])
+        yield b'partial'
+        raise ValueError('boom')
+
+    with pytest.raises(RuntimeError):
+        serve(broken, [b''])
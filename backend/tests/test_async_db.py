@@ -0,0 +1,91 @@
+import asyncio
+import sys
+
+import pytest
+from sqlalchemy import select
+
+from models import Product
+from utils.async_db import AsyncDatabase
+from utils.sql_profiler import query_profiler
+
+
+def products_by_id(app):
+    with app.app_context():
+        return {product.product_id: product.product_name for product in Product.query.all()}
+
+
+@pytest.mark.parametrize('mode', ['async', 'threads'])
+def test_gather_matches_the_regular_engine(app, mode, monkeypatch):
+    if mode == 'async':
+        pytest.importorskip('aiosqlite')
+    else:
+        # Without an async driver the regular engine runs the statements on threads
+        monkeypatch.setitem(sys.modules, 'aiosqlite', None)
+    database = AsyncDatabase()
+    database.init_app(app)
+    assert database.mode == mode
+
+    async def run():
+        try:
+            return await database.gather(
+                select(Product.product_id, Product.product_name).order_by(Product.product_id),
+                select(Product.product_id).where(Product.product_id < 0),
+            )
+        finally:
+            await database.close()
+
+    rows, empty = asyncio.run(run())
+    assert dict(rows) == products_by_id(app)
+    assert empty == []
+
+
+@pytest.mark.parametrize('mode', ['async', 'threads'])
+def test_statements_are_profiled_in_the_calling_task(app, mode, monkeypatch):
+    if mode == 'async':
+        pytest.importorskip('aiosqlite')
+    else:
+        monkeypatch.setitem(sys.modules, 'aiosqlite', None)
+    query_profiler.track(app)
+    database = AsyncDatabase()
+    database.init_app(app)
+
+    async def request(count):
+        profile, token = query_profiler.start()
+        try:
+            await database.gather(*(select(Product.product_id).where(Product.product_id == n) for n in range(count)))
+            return profile.count
+        finally:
+            query_profiler.stop(token)
+
+    async def run():
+        try:
+            # Concurrent requests each see only their own statements
+            return await asyncio.gather(request(2), request(3))
+        finally:
+            await database.close()
+
+    assert asyncio.run(run()) == [2, 3]
+    assert query_profiler.current is None
+
+
+def test_asgi_app_is_built_on_first_use(app, monkeypatch):
+    import asgi
+
+    built = []
+    application = asgi.AsgiApp(lambda: built.append(app) or app, AsyncDatabase())
+    assert built == []
+
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/products/1', 'query_string': b'fields=product_name',
+             'headers': [], 'http_version': '1.1', 'scheme': 'http'}
+    asyncio.run(application(scope, receive, send))
+    assert built == [app]
+    assert sent[0]['status'] == 200
+    assert sent[1]['body'].strip() == b'{"product_name":"Galaxy Phone 0"}'
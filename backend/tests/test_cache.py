@@ -0,0 +1,52 @@
+from models import db, Product, User
+from utils.cache import MemoryBackend
+
+
+def get_product(client):
+    response = client.get('/api/products/2', query_string={'fields': 'product_name'})
+    return response.headers['X-Cache'], response.get_json()['product_name']
+
+
+def test_commit_invalidates_cached_pages(app, client):
+    assert get_product(client) == ('MISS', 'Classmate Notebook 1')
+    assert get_product(client) == ('HIT', 'Classmate Notebook 1')
+
+    with app.app_context():
+        db.session.get(Product, 2).product_name = 'Renamed Notebook'
+        db.session.commit()
+    assert get_product(client) == ('MISS', 'Renamed Notebook')
+
+
+def test_rollback_keeps_cached_pages(app, client):
+    get_product(client)
+    with app.app_context():
+        db.session.get(Product, 2).product_name = 'Never Saved'
+        db.session.flush()
+        db.session.rollback()
+    assert get_product(client) == ('HIT', 'Classmate Notebook 1')
+
+
+def test_password_change_leaves_product_pages_cached(app, client):
+    get_product(client)
+    with app.app_context():
+        db.session.get(User, 1).password = 'rehashed'
+        db.session.commit()
+    assert get_product(client)[0] == 'HIT'
+
+    with app.app_context():
+        db.session.get(User, 1).name = 'Renamed Reviewer'
+        db.session.commit()
+    assert get_product(client)[0] == 'MISS'
+
+
+def test_dropped_tag_counters_never_go_back():
+    backend = MemoryBackend(max_counters=2)
+    for _ in range(3):
+        backend.incr('tag:a')
+    backend.incr('tag:b')
+    backend.incr('tag:c')
+    assert len(backend._counters) == 2
+    assert backend.counter('tag:a') == 3
+    assert backend.incr('tag:a') == 4
+    backend.clear()
+    assert backend.counter('tag:a') == 4
@@ -0,0 +1,40 @@
+from app import create_app
+from utils.metrics import metrics
+
+
+def sample(client, name, endpoint):
+    # The registry lives for the whole test run, so tests compare values before and after
+    prefix = f'{name}{{endpoint="{endpoint}"}} '
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def test_db_time_can_be_turned_off(app):
+    app = create_app(SQLALCHEMY_DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'], METRICS_DB_TIME=False)
+    client = app.test_client()
+    before = sample(client, 'nearbuy_db_queries_total', 'products.get_product')
+    client.get('/api/products/1')
+    assert not metrics.db_time
+    assert sample(client, 'nearbuy_db_queries_total', 'products.get_product') == before
+
+
+def test_db_time_counts_each_requests_statements(client):
+    endpoint = 'products.get_product'
+    requests = sample(client, 'nearbuy_db_time_seconds_count', endpoint)
+    statements = sample(client, 'nearbuy_db_queries_total', endpoint)
+    client.get('/api/products/1', query_string={'fields': 'product_name'})
+    client.get('/api/products/1', query_string={'fields': 'product_name,images'})
+    assert sample(client, 'nearbuy_db_time_seconds_count', endpoint) == requests + 2
+    assert sample(client, 'nearbuy_db_queries_total', endpoint) == statements + 3
+
+
+def test_streamed_responses_are_sized_when_closed(client, admin_headers):
+    endpoint = 'admin.import_catalog'
+    before = sample(client, 'nearbuy_http_response_size_bytes_sum', endpoint)
+    response = client.post('/api/admin/import', query_string={'format': 'ndjson'}, data='{"brand": "Nameless"}',
+                           content_type='application/x-ndjson', headers=admin_headers)
+    size = len(response.get_data())
+    response.close()
+    assert sample(client, 'nearbuy_http_response_size_bytes_sum', endpoint) == before + size
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import PRODUCT_COUNT, SHOP_COUNT
+
+
+def walk(client, path, **params):
+    """Every item of a cursor-paginated endpoint, following next_cursor until it runs out"""
+    items, cursor, pages = [], '', 0
+    while True:
+        response = client.get(path, query_string=dict(params, cursor=cursor))
+        assert response.status_code == 200, response.get_data(as_text=True)
+        body = response.get_json()
+        items.extend(body['items'])
+        pages += 1
+        cursor = body['next_cursor']
+        if not cursor:
+            return items, pages
+
+
+@pytest.mark.parametrize('sort', ['id', 'rating', 'reviews'])
+def test_product_cursors_cover_every_product_once(client, sort):
+    items, pages = walk(client, '/api/products/', sort=sort, limit=7)
+    ids = [item['product_id'] for item in items]
+    assert sorted(ids) == list(range(1, PRODUCT_COUNT + 1))
+    assert pages == -(-PRODUCT_COUNT // 7)
+
+
+def test_product_cursor_follows_the_sort_order(client):
+    items, _ = walk(client, '/api/products/', sort='rating', limit=4, fields='product_id,avg_rating,review_count')
+    keys = [(-item['avg_rating'], -item['review_count'], item['product_id']) for item in items]
+    assert keys == sorted(keys)
+    assert items[0]['product_id'] == 1
+
+
+def test_shop_cursors_cover_every_shop_once(client):
+    items, _ = walk(client, '/api/shops/', limit=5)
+    assert [item['shop_id'] for item in items] == list(range(1, SHOP_COUNT + 1))
+
+
+def test_search_cursors_match_one_ranked_page(client):
+    everything = client.get('/api/products/search', query_string={'q': 'notebook', 'limit': 100}).get_json()
+    items, _ = walk(client, '/api/products/search', q='notebook', limit=3)
+    assert [item['product_id'] for item in items] == [item['product_id'] for item in everything]
+    assert len({item['product_id'] for item in items}) == len(items) == PRODUCT_COUNT - PRODUCT_COUNT // 3
+
+
+def test_bare_array_clients_get_the_cursor_in_a_header(client):
+    response = client.get('/api/products/', query_string={'limit': 5})
+    assert len(response.get_json()) == 5
+    follow = client.get('/api/products/', query_string={'limit': 5, 'cursor': response.headers['X-Next-Cursor']})
+    assert [item['product_id'] for item in follow.get_json()['items']] == [6, 7, 8, 9, 10]
+
+
+def test_tampered_cursor_is_rejected(client):
+    assert client.get('/api/products/', query_string={'cursor': 'not-a-cursor'}).status_code == 400
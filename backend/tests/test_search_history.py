@@ -0,0 +1,23 @@
+from models import db, SearchHistory
+from utils.search_history import SearchHistoryWriter
+
+
+def test_unreachable_database_keeps_entries_for_the_next_flush(app):
+    writer = SearchHistoryWriter(flush_seconds=60, max_buffer=2)
+    writer.app = app
+    with app.app_context():
+        SearchHistory.__table__.drop(db.engine)
+    writer.record(1, 'kettle')
+    writer.record(1, 'bottle')
+    assert writer.flush() == 0
+    assert writer.stats() == {'buffered': 2, 'dropped': 0}
+
+    # A newer search of the same term wins and the oldest entry gives way to the cap
+    writer.record(1, 'bottle')
+    writer.record(1, 'notebook')
+    assert writer.stats() == {'buffered': 2, 'dropped': 1}
+
+    with app.app_context():
+        SearchHistory.__table__.create(db.engine)
+        assert writer.flush() == 2
+        assert sorted(entry.search_item for entry in SearchHistory.query.all()) == ['bottle', 'notebook']
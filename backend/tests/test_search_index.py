@@ -0,0 +1,99 @@
+import math
+
+import pytest
+
+from models import db, Product
+from utils.search_index import B, K1, ProductSearchIndex, product_search_index
+
+
+def index_of(rows, boosts=None):
+    index = ProductSearchIndex(boosts)
+    index.load(rows)
+    return index
+
+
+def ranked(index, text, **kwargs):
+    return [product_id for product_id, _ in index.search(text, limit=100, **kwargs)[1]]
+
+
+ROWS = [
+    # product_id, category_id, name, brand, description, category, avg_rating, review_count
+    (1, 1, 'Steel bottle', 'Milton', 'Keeps water cold', 'Kitchen', 4.0, 10),
+    (2, 1, 'Water bottle', 'Cello', 'A bottle for water', 'Kitchen', 3.0, 50),
+    (3, 1, 'Lunch box', 'Milton', 'Fits a water bottle on the side', 'Kitchen', 5.0, 2),
+    (4, 2, 'Notebook', 'Classmate', 'Ruled pages', 'Stationery', 4.5, 10),
+    (5, 1, 'Bottle', 'Cello', 'Bottle bottle bottle bottle bottle bottle', 'Kitchen', 0.0, 0),
+]
+
+
+def test_name_matches_outrank_description_matches():
+    # Product names carry three times the weight of descriptions
+    assert ranked(index_of(ROWS), 'water') == [2, 1, 3]
+
+
+def test_repeated_terms_saturate():
+    # Descriptions of equal length with the term once, twice and eight times
+    rows = [(n, None, 'flask', '', ' '.join(['bottle'] * count + ['steel'] * (8 - count)), '', 0, 0)
+            for n, count in ((1, 1), (2, 2), (3, 8))]
+    scores = dict(index_of(rows).search('bottle', limit=10)[1])
+    assert scores[1] < scores[2] < scores[3] < 2 * scores[1]
+
+
+def test_scores_follow_the_bm25_formula():
+    rows = [(1, None, 'apple', '', '', '', 0, 0), (2, None, 'apple apple pie', '', '', '', 0, 0),
+            (3, None, 'pie', '', '', '', 0, 0)]
+    index = index_of(rows, {'product_name': 1.0})
+    scores = dict(index.search('apple', limit=10)[1])
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    average = 5 / 3
+
+    def bm25(frequency, length):
+        # Without BM25's constant (K1 + 1) factor, which changes no order
+        weighted = frequency / (1 - B + B * length / average)
+        return idf * weighted / (weighted + K1)
+
+    assert scores[1] == pytest.approx(bm25(1, 1))
+    assert scores[2] == pytest.approx(bm25(2, 3))
+
+
+def test_every_term_must_match_and_the_last_is_a_prefix():
+    index = index_of(ROWS)
+    assert ranked(index, 'milton bot') == [1, 3]
+    assert ranked(index, 'milton notebook') == []
+
+
+def test_rating_sort_and_filters():
+    index = index_of(ROWS)
+    assert ranked(index, 'bottle', sort='rating') == [3, 1, 2, 5]
+    assert ranked(index, 'bottle', sort='reviews') == [2, 1, 3, 5]
+    assert ranked(index, 'bottle', min_rating=3.5) == ranked(index, 'bottle', min_rating=3.5, sort='relevance')
+    assert set(ranked(index, 'bottle', min_reviews=10)) == {1, 2}
+
+
+def test_committed_products_are_searchable(app, client):
+    assert client.get('/api/products/search', query_string={'q': 'kettle'}).get_json() == []
+    with app.app_context():
+        db.session.add(Product(product_name='Electric Kettle', brand='Prestige', description='Boils water',
+                               category_id=1))
+        db.session.commit()
+    hits = client.get('/api/products/search', query_string={'q': 'kettle'}).get_json()
+    assert [hit['product_name'] for hit in hits] == ['Electric Kettle']
+    assert len(product_search_index) == 31
+
+
+def test_failed_rereads_stay_queued(app, client, monkeypatch):
+    client.get('/api/products/search', query_string={'q': 'kettle'})
+    with app.app_context():
+        db.session.get(Product, 1).product_name = 'Electric Kettle'
+        db.session.commit()
+
+    def unreachable(product_ids=None):
+        raise ConnectionError('database went away')
+
+    with app.app_context(), monkeypatch.context() as patch:
+        patch.setattr(product_search_index, '_rows', unreachable)
+        with pytest.raises(ConnectionError):
+            product_search_index.ensure_loaded()
+    assert product_search_index._stale == {1}
+    hits = client.get('/api/products/search', query_string={'q': 'kettle'}).get_json()
+    assert [hit['product_id'] for hit in hits] == [1]
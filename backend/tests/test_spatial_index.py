@@ -0,0 +1,74 @@
+import math
+import random
+
+import pytest
+
+from conftest import ORIGIN
+from models import db, Shop, ShopAddress
+from utils.spatial_index import ShopSpatialIndex, shop_index
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def brute_force(points, lat, lon, k, max_distance=None):
+    ranked = sorted((haversine(lat, lon, plat, plon), shop_id) for shop_id, plat, plon in points)
+    if max_distance is not None:
+        ranked = [hit for hit in ranked if hit[0] <= max_distance]
+    return ranked[:k]
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = random.Random(7)
+    # A dense city, a few outlying towns and one shop far away, so rings of every size are walked
+    points = [(n, ORIGIN[0] + rng.uniform(-0.3, 0.3), ORIGIN[1] + rng.uniform(-0.3, 0.3)) for n in range(1, 401)]
+    points += [(n, ORIGIN[0] + rng.uniform(-3, 3), ORIGIN[1] + rng.uniform(-3, 3)) for n in range(401, 431)]
+    return points + [(431, 28.6139, 77.2090)]
+
+
+@pytest.mark.parametrize('cell_degrees', [0.01, 0.05, 1.0])
+@pytest.mark.parametrize('k', [1, 5, 50, 431, 1000])
+def test_nearest_matches_brute_force(points, cell_degrees, k):
+    index = ShopSpatialIndex(cell_degrees)
+    index.load(points)
+    rng = random.Random(k)
+    queries = [ORIGIN, (ORIGIN[0] + 2.5, ORIGIN[1] - 2.5), (10.0, 10.0)]
+    queries += [(ORIGIN[0] + rng.uniform(-1, 1), ORIGIN[1] + rng.uniform(-1, 1)) for _ in range(5)]
+    for lat, lon in queries:
+        found = index.nearest(lat, lon, k)
+        expected = brute_force(points, lat, lon, k)
+        assert [shop_id for _, shop_id in found] == [shop_id for _, shop_id in expected]
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected])
+
+
+def test_nearest_respects_max_distance(points):
+    index = ShopSpatialIndex()
+    index.load(points)
+    found = index.nearest(*ORIGIN, 100, max_distance=5.0)
+    expected = brute_force(points, *ORIGIN, 100, max_distance=5.0)
+    assert [shop_id for _, shop_id in found] == [shop_id for _, shop_id in expected]
+
+
+def test_query_radius_matches_brute_force(points):
+    index = ShopSpatialIndex()
+    index.load(points)
+    found = index.query_radius(*ORIGIN, 10.0)
+    expected = brute_force(points, *ORIGIN, len(points), max_distance=10.0)
+    assert [shop_id for _, shop_id in found] == [shop_id for _, shop_id in expected]
+
+
+def test_committed_shops_are_indexed(app):
+    with app.app_context():
+        assert [shop_id for _, shop_id in shop_index.nearest(*ORIGIN, 1)] == [1]
+        shop = Shop(shop_name='Closest')
+        db.session.add(shop)
+        db.session.flush()
+        db.session.add(ShopAddress(shop_id=shop.shop_id, city='Bhopal', latitude=ORIGIN[0] + 0.0001,
+                                   longitude=ORIGIN[1]))
+        db.session.commit()
+        assert [shop_id for _, shop_id in shop_index.nearest(ORIGIN[0] + 0.0001, ORIGIN[1], 1)] == [shop.shop_id]
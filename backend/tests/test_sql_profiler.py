@@ -0,0 +1,13 @@
+import logging
+
+from app import create_app
+
+
+def test_slow_queries_are_logged_without_parameter_values(app, caplog):
+    app = create_app(SQLALCHEMY_DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'], SQL_PROFILING_ENABLED=True,
+                     SQL_SLOW_QUERY_MS=0)
+    with caplog.at_level(logging.WARNING, logger='utils.sql_profiler'):
+        app.test_client().post('/api/admin/login', json={'userId': 'secret-user', 'password': 'wrong'})
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow query')]
+    assert slow
+    assert not any('secret-user' in message for message in slow)
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models import db, AnalyticsSnapshot, Product, ProductCategory, Shop, ShopAddress, User
+
+logger = logging.getLogger(__name__)
+
+# The dashboard reads this single row
+SNAPSHOT_ID = 1
+
+# "New this week" covers today and the six days before it
+RECENT_DAYS = 7
+
+TOP_CITIES = 5
+
+# Key used to note, between flush and commit, that a write needs a full rebuild
+_PENDING_KEY = 'analytics_rebuild_needed'
+
+
+class AnalyticsSnapshotter:
+    """
+    Keeps the admin dashboard's figures in one precomputed Analytics_Snapshot row.
+
+    A background thread refreshes the row every ANALYTICS_REFRESH_SECONDS.
+    Most refreshes are incremental: rows whose primary key is above the
+    watermark stored in the snapshot are folded into the totals, the per-day
+    sign-up buckets, shops per city and products per category, so each pass
+    reads only what was inserted since the last one. Deletes and moves cannot
+    be seen that way, so committed ORM deletes (and address or product edits)
+    trigger a full rebuild, as does ANALYTICS_FULL_REFRESH_SECONDS elapsing.
+    The row is locked while it is refreshed, so several worker processes can
+    share it without double counting.
+    """
+
+    def __init__(self, refresh_seconds=60, full_refresh_seconds=3600):
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.app = None
+        self._rebuild = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.refresh_seconds = app.config.get('ANALYTICS_REFRESH_SECONDS', self.refresh_seconds)
+        self.full_refresh_seconds = app.config.get('ANALYTICS_FULL_REFRESH_SECONDS', self.full_refresh_seconds)
+        if self.refresh_seconds:
+            app.before_request(self._ensure_thread)
+
+    def request_full_refresh(self):
+        self._rebuild.set()
+
+    # --- Background thread ---
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-snapshot', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_seconds):
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except SQLAlchemyError:
+                logger.exception('Analytics snapshot refresh failed')
+
+    # --- Reading ---
+    def current(self):
+        """The dashboard payload, building the snapshot first if there is none yet"""
+        snapshot = db.session.get(AnalyticsSnapshot, SNAPSHOT_ID)
+        if snapshot is None:
+            self.refresh(full=True)
+            snapshot = db.session.get(AnalyticsSnapshot, SNAPSHOT_ID)
+        return _render(json.loads(snapshot.data), snapshot.refreshed_at)
+
+    # --- Refreshing ---
+    def refresh(self, full=False):
+        """Bring the snapshot up to date; incremental unless ``full`` or a rebuild is due"""
+        try:
+            snapshot = db.session.query(AnalyticsSnapshot).filter_by(
+                snapshot_id=SNAPSHOT_ID
+            ).with_for_update().one_or_none()
+            now = datetime.utcnow()
+            if snapshot is not None and not full and not self._rebuild.is_set():
+                # Another worker may have refreshed while this one waited for the lock
+                if (now - snapshot.refreshed_at).total_seconds() < self.refresh_seconds / 2:
+                    db.session.rollback()
+                    return
+            rebuild = (
+                full or snapshot is None or self._rebuild.is_set()
+                or (now - snapshot.full_refreshed_at).total_seconds() >= self.full_refresh_seconds
+            )
+            if rebuild:
+                self._rebuild.clear()
+                data = _build()
+            else:
+                data = _advance(json.loads(snapshot.data))
+            _prune(data['new_users_by_day'])
+            _prune(data['new_shops_by_day'])
+
+            if snapshot is None:
+                snapshot = AnalyticsSnapshot(snapshot_id=SNAPSHOT_ID)
+                db.session.add(snapshot)
+            snapshot.data = json.dumps(data)
+            snapshot.refreshed_at = now
+            if rebuild:
+                snapshot.full_refreshed_at = now
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise
+
+    def stop(self):
+        self._stopping.set()
+
+
+def _day(value):
+    return (value.date() if isinstance(value, datetime) else value).isoformat()
+
+
+def _window_start():
+    # created_at is stored in UTC, so the window is counted in UTC days too
+    return datetime.utcnow().date() - timedelta(days=RECENT_DAYS - 1)
+
+
+def _prune(buckets):
+    cutoff = _window_start().isoformat()
+    for day in [day for day in buckets if day < cutoff]:
+        del buckets[day]
+
+
+def _max_id(column):
+    return db.session.query(func.max(column)).scalar() or 0
+
+
+def _count_by_day(column, id_column, above, up_to):
+    buckets = {}
+    query = db.session.query(column).filter(id_column > above, id_column <= up_to,
+                                            column >= datetime.combine(_window_start(), datetime.min.time()))
+    for (created_at,) in query:
+        day = _day(created_at)
+        buckets[day] = buckets.get(day, 0) + 1
+    return buckets
+
+
+def _grouped(key_column, id_column, above, up_to, *criteria):
+    rows = db.session.query(key_column, func.count(id_column)).filter(
+        id_column > above, id_column <= up_to, *criteria
+    ).group_by(key_column).all()
+    return {str(key) if key is not None else '': count for key, count in rows}
+
+
+def _merge(target, counts):
+    for key, count in counts.items():
+        target[key] = target.get(key, 0) + count
+
+
+def _categories():
+    return {str(category_id): name for category_id, name in
+            db.session.query(ProductCategory.category_id, ProductCategory.category_name)}
+
+
+def _build():
+    # Fix the watermarks first and count up to them, so rows inserted meanwhile are left for the next pass
+    marks = {
+        'user_id': _max_id(User.user_id),
+        'shop_id': _max_id(Shop.shop_id),
+        'address_id': _max_id(ShopAddress.address_id),
+        'product_id': _max_id(Product.product_id),
+    }
+    categories = _categories()
+    return {
+        'watermarks': marks,
+        'user_count': db.session.query(func.count(User.user_id)).filter(User.user_id <= marks['user_id']).scalar(),
+        'shop_count': db.session.query(func.count(Shop.shop_id)).filter(Shop.shop_id <= marks['shop_id']).scalar(),
+        'product_count': db.session.query(func.count(Product.product_id)).filter(
+            Product.product_id <= marks['product_id']).scalar(),
+        'category_count': len(categories),
+        'categories': categories,
+        'new_users_by_day': _count_by_day(User.created_at, User.user_id, 0, marks['user_id']),
+        'new_shops_by_day': _count_by_day(Shop.created_at, Shop.shop_id, 0, marks['shop_id']),
+        'shops_per_city': _grouped(ShopAddress.city, ShopAddress.address_id, 0, marks['address_id'],
+                                   ShopAddress.shop_id.isnot(None)),
+        'products_per_category': _grouped(Product.category_id, Product.product_id, 0, marks['product_id']),
+    }
+
+
+def _advance(data):
+    marks = data['watermarks']
+    new_marks = {
+        'user_id': _max_id(User.user_id),
+        'shop_id': _max_id(Shop.shop_id),
+        'address_id': _max_id(ShopAddress.address_id),
+        'product_id': _max_id(Product.product_id),
+    }
+    if new_marks['user_id'] > marks['user_id']:
+        new_users = _count_by_day(User.created_at, User.user_id, marks['user_id'], new_marks['user_id'])
+        data['user_count'] += db.session.query(func.count(User.user_id)).filter(
+            User.user_id > marks['user_id'], User.user_id <= new_marks['user_id']).scalar()
+        _merge(data['new_users_by_day'], new_users)
+    if new_marks['shop_id'] > marks['shop_id']:
+        new_shops = _count_by_day(Shop.created_at, Shop.shop_id, marks['shop_id'], new_marks['shop_id'])
+        data['shop_count'] += db.session.query(func.count(Shop.shop_id)).filter(
+            Shop.shop_id > marks['shop_id'], Shop.shop_id <= new_marks['shop_id']).scalar()
+        _merge(data['new_shops_by_day'], new_shops)
+    if new_marks['address_id'] > marks['address_id']:
+        _merge(data['shops_per_city'],
+               _grouped(ShopAddress.city, ShopAddress.address_id, marks['address_id'], new_marks['address_id'],
+                        ShopAddress.shop_id.isnot(None)))
+    if new_marks['product_id'] > marks['product_id']:
+        new_products = _grouped(Product.category_id, Product.product_id, marks['product_id'], new_marks['product_id'])
+        data['product_count'] += sum(new_products.values())
+        _merge(data['products_per_category'], new_products)
+    # Categories are a handful of rows; re-reading them keeps renames current
+    data['categories'] = _categories()
+    data['category_count'] = len(data['categories'])
+    data['watermarks'] = new_marks
+    return data
+
+
+def _render(data, refreshed_at):
+    cutoff = _window_start().isoformat()
+    categories = data['categories']
+    per_category = sorted(
+        ({'name': categories.get(category_id) or 'Uncategorized', 'count': count}
+         for category_id, count in data['products_per_category'].items() if count),
+        key=lambda entry: -entry['count']
+    )
+    cities = sorted(
+        ({'city': city or 'Unknown', 'count': count} for city, count in data['shops_per_city'].items() if count),
+        key=lambda entry: -entry['count']
+    )
+    return {
+        'user_count': data['user_count'],
+        'shop_count': data['shop_count'],
+        'category_count': data['category_count'],
+        'product_count': data['product_count'],
+        'recent_users': sum(count for day, count in data['new_users_by_day'].items() if day >= cutoff),
+        'recent_shops': sum(count for day, count in data['new_shops_by_day'].items() if day >= cutoff),
+        'products_per_category': per_category,
+        # The dashboard's category chart reads this key
+        'shop_categories': per_category,
+        'shops_per_city': cities,
+        'top_cities': cities[:TOP_CITIES],
+        'refreshed_at': refreshed_at.isoformat() if refreshed_at else None,
+    }
+
+
+analytics_snapshot = AnalyticsSnapshotter()
+
+
+# --- Rebuild after writes the incremental pass cannot see ---
+@event.listens_for(Session, 'after_flush')
+def _collect_analytics_changes(session, flush_context):
+    if any(isinstance(obj, (User, Shop, ShopAddress, Product, ProductCategory)) for obj in session.deleted) or any(
+            isinstance(obj, (ShopAddress, Product)) for obj in session.dirty):
+        session.info[_PENDING_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _schedule_analytics_rebuild(session):
+    if session.info.pop(_PENDING_KEY, False):
+        analytics_snapshot.request_full_refresh()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_analytics_changes(session):
+    session.info.pop(_PENDING_KEY, None)
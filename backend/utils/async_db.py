@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import functools
+import importlib.util
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.engine.url import make_url
+
+from models import db
+from utils.db_pool import engine_options
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """
+    Runs SQLAlchemy Core statements from asyncio code, for the ASGI entry point.
+
+    In 'async' mode statements go through SQLAlchemy's asyncio engine on an
+    async driver, so a waiting statement costs the event loop nothing. That
+    is the mode whenever one is available: ASYNC_DATABASE_URI when set
+    (``sqlite+aiosqlite://...`` or whatever async dialect the installed
+    SQLAlchemy provides), else the regular database URL with aiosqlite when
+    it is SQLite and aiosqlite is installed.
+
+    Otherwise, as for SQL Server, for which SQLAlchemy 1.4 has no async
+    dialect, it falls back to 'threads' mode: statements run on the app's
+    regular engine in a thread pool sized to the connection pool. That is
+    not async I/O; every statement in flight still holds a thread and a
+    connection, and what the event loop gains is only that it never blocks.
+    Either way at most ASYNC_DB_CONCURRENCY statements are in flight, so a
+    burst of clients queues on the event loop instead of exhausting the
+    pool, and ``gather()`` runs a request's independent queries concurrently.
+
+    Nothing connects, and the regular engine is not created, until the first
+    statement runs.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mode = None
+        self.concurrency = 0
+        self._engine = None
+        self._executor = None
+        self._limit = None
+        self._loop = None
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        pool_limit = config.get('DB_POOL_SIZE', 10) + config.get('DB_MAX_OVERFLOW', 20)
+        self.concurrency = config.get('ASYNC_DB_CONCURRENCY') or pool_limit
+        uri = async_uri(config)
+        if uri:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+            options = engine_options(dict(config, SQLALCHEMY_DATABASE_URI=uri))
+            # The instrumented pool is synchronous; swap in the asyncio queue pool, which aiosqlite would
+            # otherwise replace with a NullPool that rejects the pool settings
+            if 'poolclass' in options:
+                options['poolclass'] = AsyncAdaptedQueuePool
+            self._engine = create_async_engine(uri, **options)
+            self.mode = 'async'
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='async-db')
+            self.mode = 'threads'
+            logger.warning('No async driver for %s; native ASGI routes run their queries on %d threads',
+                           make_url(config['SQLALCHEMY_DATABASE_URI']).drivername, self.concurrency)
+
+    async def execute(self, statement, params=None):
+        """All rows of ``statement``"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio primitives belong to one event loop
+            self._loop, self._limit = loop, asyncio.Semaphore(self.concurrency)
+        async with self._limit:
+            if self.mode == 'async':
+                async with self._engine.connect() as connection:
+                    result = await connection.execute(statement, params or {})
+                    return result.fetchall()
+            # Executor threads do not inherit the caller's context; carry it so the SQL profiler sees the request
+            call = functools.partial(contextvars.copy_context().run, self._fetch, statement, params)
+            return await loop.run_in_executor(self._executor, call)
+
+    def _fetch(self, statement, params):
+        if self._engine is None:
+            self._engine = db.get_engine(self.app)
+        with self._engine.connect() as connection:
+            return connection.execute(statement, params or {}).fetchall()
+
+    async def gather(self, *statements):
+        """Rows of each statement, in order, with the statements run concurrently"""
+        return await asyncio.gather(*(self.execute(statement) for statement in statements))
+
+    async def close(self):
+        if self.mode == 'async':
+            await self._engine.dispose()
+        elif self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def async_uri(config):
+    """The async driver URL for ``config``'s database, or '' when there is none"""
+    if config.get('ASYNC_DATABASE_URI'):
+        return config['ASYNC_DATABASE_URI']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    # An in-memory database is private to one connection, so only a file can be shared with the async engine
+    if (url.drivername == 'sqlite' and url.database not in (None, '', ':memory:')
+            and importlib.util.find_spec('aiosqlite') is not None):
+        return str(url.set(drivername='sqlite+aiosqlite'))
+    return ''
+
+
+async_database = AsyncDatabase()
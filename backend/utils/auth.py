@@ -1,8 +1,6 @@
 from flask import request, jsonify
 from functools import wraps
-import jwt
-import os
-from models import User
+from utils.principal_cache import principal_cache
 
 def token_required(f):
     @wraps(f)
@@ -19,9 +17,8 @@ def token_required(f):
             return jsonify({'error': 'Token is missing!'}), 401
         
         try:
-            # Decode the token
-            data = jwt.decode(token, os.getenv('SECRET_KEY', 'dev_key_change_in_production'), algorithms=["HS256"])
-            current_user = User.query.filter_by(user_id=data['user_id']).first()
+            # Decode the token, or reuse the user it resolved to recently
+            data, current_user = principal_cache.load_user(token)
             
             if not current_user:
                 return jsonify({'error': 'Invalid token!'}), 401
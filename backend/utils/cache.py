@@ -0,0 +1,331 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import (Product, ProductCategory, ProductImage, ProductReview, Shop, ShopAddress, ShopProduct,
+                    ShopTiming, User)
+
+# Key used to stash tags touched by a session between flush and commit
+_PENDING_KEY = 'cache_tags_touched'
+
+
+# --- Backends ---
+class MemoryBackend:
+    """
+    In-process LRU store bounded by entry count and total value size.
+
+    Every process has its own store, so a write made in one process only
+    invalidates that process's entries; use the redis backend when several
+    worker processes serve the app.
+
+    At most ``max_counters`` counters are kept, least recently used dropped
+    first. A counter that is not held reads as the highest value dropped so
+    far, so a dropped tag is never read back at a version older entries were
+    stored under.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, max_counters=100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_counters = max_counters
+        self._entries = OrderedDict()
+        self._counters = OrderedDict()
+        self._counter_floor = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _evict(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def counter(self, key):
+        with self._lock:
+            value = self._counters.get(key)
+            if value is None:
+                return self._counter_floor
+            self._counters.move_to_end(key)
+            return value
+
+    def incr(self, key):
+        # Counters live outside the response LRU, and a dropped one resumes above every value it ever had
+        with self._lock:
+            value = self._counters.pop(key, self._counter_floor) + 1
+            self._counters[key] = value
+            while len(self._counters) > self.max_counters:
+                _, dropped = self._counters.popitem(last=False)
+                self._counter_floor = max(self._counter_floor, dropped)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            dropped = self._counters.pop(key, None)
+            if dropped is not None:
+                self._counter_floor = max(self._counter_floor, dropped)
+            if key in self._entries:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # Keep the floor so versions seen before the clear are never reused
+            self._counter_floor = max([self._counter_floor, *self._counters.values()])
+            self._counters.clear()
+            self._bytes = 0
+
+
+class RedisBackend:
+    """Store backed by any client exposing the redis-py get/setex/set/incr/delete calls"""
+
+    def __init__(self, client, prefix='nearbuy:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.client.setex(self.prefix + key, int(ttl), value)
+        else:
+            self.client.set(self.prefix + key, value)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class LocalRedis:
+    """
+    Minimal in-process stand-in for a Redis client.
+
+    Implements just the commands RedisBackend uses, so the Redis code path can
+    run in development and tests without a Redis server.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, None)
+
+    def setex(self, key, seconds, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + seconds)
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + 1 if entry else 1
+            self._data[key] = (str(value).encode('ascii'), entry[1] if entry else None)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+
+
+def create_backend(config):
+    """Build the backend named by CACHE_BACKEND: 'memory', 'redis' or 'local-redis'"""
+    name = config.get('CACHE_BACKEND', 'memory')
+    if name == 'memory':
+        return MemoryBackend(config.get('CACHE_MAX_ENTRIES', 10000), config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                             config.get('CACHE_MAX_TAGS', 100000))
+    if name == 'local-redis':
+        return RedisBackend(LocalRedis())
+    if name == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND='redis' requires the redis package")
+        return RedisBackend(redis.Redis.from_url(config['CACHE_REDIS_URL']))
+    raise ValueError(f'Unknown CACHE_BACKEND: {name}')
+
+
+# --- Response cache ---
+class ResponseCache:
+    """
+    Caches whole GET responses keyed by URL, with per-endpoint TTLs.
+
+    Every entry is tagged (e.g. ``shop:12``). Invalidating a tag bumps its
+    version number in the backend, and since versions are part of the cache
+    key, stale entries simply stop being read and age out through LRU or TTL.
+    Invalidation only reaches other processes through a shared backend
+    (redis): with 'memory' or 'local-redis' each process caches on its own,
+    and one process's writes leave the others serving pages until their TTL.
+    serve.py therefore refuses to start several workers on those backends.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.enabled = False
+        self.ttls = {}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.ttls = app.config.get('CACHE_TTLS', {})
+        self.backend = create_backend(app.config)
+
+    def _versions(self, tags):
+        return ','.join(f'{tag}={self.backend.counter("tag:" + tag)}' for tag in tags)
+
+    def invalidate(self, *tags):
+        if self.backend is None:
+            return
+        for tag in tags:
+            self.backend.incr('tag:' + tag)
+
+    def entry_key(self, full_path, tags):
+        raw_key = f'{full_path}|{self._versions(tags)}'
+        return 'response:' + hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """A stored response as ``(headers, body)``, or None; headers are ``[name, value]`` pairs"""
+        hit = self.backend.get(key)
+        if hit is None:
+            return None
+        header_block, _, body = hit.partition(b'\n\n')
+        return [line.split(': ', 1) for line in header_block.decode('utf-8').split('\n')], body
+
+    def store(self, key, headers, body, ttl):
+        """Store a response body with its Content-Type and X- headers"""
+        value = '\n'.join(f'{name}: {value}' for name, value in headers).encode('utf-8') + b'\n\n' + body
+        self.backend.set(key, value, ttl)
+
+    def cached(self, ttl=60, tags=()):
+        """
+        Cache a GET view's successful responses.
+
+        ``tags`` is a list of tag names or a callable taking the view's URL
+        arguments and returning one. CACHE_TTLS overrides ``ttl`` by endpoint name.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.enabled or self.backend is None or request.method != 'GET':
+                    return f(*args, **kwargs)
+
+                key = self.entry_key(request.full_path, tags(**kwargs) if callable(tags) else tags)
+                hit = self.lookup(key)
+                if hit is not None:
+                    headers, body = hit
+                    response = current_app.response_class(body, status=200, headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    headers = [('Content-Type', response.content_type)]
+                    headers.extend((name, value) for name, value in response.headers if name.startswith('X-'))
+                    self.store(key, headers, response.get_data(), self.ttls.get(request.endpoint, ttl))
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+# --- Invalidate on committed writes ---
+def _tags_for(obj):
+    if isinstance(obj, Product):
+        return ['categories', 'shop_products', f'product:{obj.product_id}']
+    if isinstance(obj, ProductCategory):
+        return ['categories', 'shop_products', 'product_details']
+    if isinstance(obj, (ProductImage, ProductReview)):
+        return [f'product:{obj.product_id}']
+    if isinstance(obj, ShopProduct):
+        return [f'product:{obj.product_id}', f'shop_products:{obj.shop_id}']
+    if isinstance(obj, Shop):
+        return ['shops', 'product_details', f'shop:{obj.shop_id}', f'shop_products:{obj.shop_id}']
+    if isinstance(obj, ShopAddress):
+        return ['shops', 'product_details', f'shop:{obj.shop_id}']
+    if isinstance(obj, ShopTiming):
+        return [f'shop:{obj.shop_id}']
+    if isinstance(obj, User):
+        # Reviewer names appear on product pages
+        return ['product_details']
+    return []
+
+
+def _reviewer_changed(session, user):
+    # A new user has no reviews yet, and nothing about a user but the name is shown (not a login's password rehash)
+    if user in session.deleted:
+        return True
+    return user in session.dirty and inspect(user).attrs.name.history.has_changes()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and not _reviewer_changed(session, obj):
+            continue
+        tags = _tags_for(obj)
+        if tags:
+            session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cache_tags(session):
+    tags = session.info.pop(_PENDING_KEY, None)
+    if tags:
+        response_cache.invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cache_tags(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,118 @@
+from sqlalchemy import func
+
+from models import db, Product, ProductCategory, ProductImage, ProductReview, ShopProduct
+
+# SQL Server allows at most 2100 parameters per statement
+IN_CLAUSE_BATCH_SIZE = 1000
+
+# Keys add_price_range sets, in the order of a price_ranges() value
+PRICE_RANGE_FIELDS = ('min_price', 'max_price', 'available_in_shops')
+
+
+def chunked(ids, size=IN_CLAUSE_BATCH_SIZE):
+    """Split a list of ids into slices small enough for one IN (...) clause"""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def price_ranges(product_ids):
+    """
+    Price range and shop count for each product, in one grouped query.
+
+    Returns ``{product_id: (min_price, max_price, available_in_shops)}``;
+    products that no shop stocks are left out.
+    """
+    ranges = {}
+    for batch in chunked(list(product_ids)):
+        rows = db.session.query(
+            ShopProduct.product_id,
+            func.min(ShopProduct.price),
+            func.max(ShopProduct.price),
+            func.count(ShopProduct.shop_product_id)
+        ).filter(
+            ShopProduct.product_id.in_(batch)
+        ).group_by(ShopProduct.product_id).all()
+        ranges.update((product_id, (min_price, max_price, count)) for product_id, min_price, max_price, count in rows)
+    return ranges
+
+
+def first_images(product_ids):
+    """Image URL with the lowest image_id for each product, in one query"""
+    images = {}
+    for batch in chunked(list(product_ids)):
+        first = db.session.query(
+            func.min(ProductImage.image_id).label('image_id')
+        ).filter(
+            ProductImage.product_id.in_(batch)
+        ).group_by(ProductImage.product_id).subquery()
+        rows = db.session.query(ProductImage.product_id, ProductImage.image_url).join(
+            first, ProductImage.image_id == first.c.image_id
+        ).all()
+        images.update(rows)
+    return images
+
+
+def product_images(product_ids):
+    """All image URLs for each product in image_id order, in one query per IN batch"""
+    images = {}
+    for batch in chunked(list(product_ids)):
+        rows = db.session.query(ProductImage.product_id, ProductImage.image_url).filter(
+            ProductImage.product_id.in_(batch)
+        ).order_by(ProductImage.product_id, ProductImage.image_id).all()
+        for product_id, image_url in rows:
+            images.setdefault(product_id, []).append(image_url)
+    return images
+
+
+def add_price_range(product_data, ranges, product_id=None, fields=PRICE_RANGE_FIELDS):
+    """
+    Copy a product's price range onto its response dict, the way list endpoints report it.
+
+    ``product_id`` defaults to the dict's own; ``fields`` limits which of
+    PRICE_RANGE_FIELDS are set.
+    """
+    price_range = ranges.get(product_data['product_id'] if product_id is None else product_id)
+    if price_range:
+        product_data.update((name, value) for name, value in zip(PRICE_RANGE_FIELDS, price_range) if name in fields)
+    return product_data
+
+
+def category_product_counts():
+    """Number of products in each category, in one grouped query"""
+    rows = db.session.query(Product.category_id, func.count(Product.product_id)).group_by(Product.category_id).all()
+    return dict(rows)
+
+
+def category_count_update(category_ids=None):
+    """UPDATE statement that recomputes ProductCategory.product_count, for every category or just ``category_ids``"""
+    categories = ProductCategory.__table__
+    products = Product.__table__
+    counts = db.select(func.count(products.c.product_id)).where(
+        products.c.category_id == categories.c.category_id
+    ).scalar_subquery()
+    update = categories.update().values(product_count=counts)
+    if category_ids is not None:
+        update = update.where(categories.c.category_id.in_(list(category_ids)))
+    return update
+
+
+def refresh_category_counts():
+    """Recompute every ProductCategory.product_count, e.g. after loading products with raw SQL"""
+    db.session.execute(category_count_update())
+    db.session.commit()
+
+
+def review_aggregate_update():
+    """UPDATE statement that recomputes every Product.avg_rating and review_count"""
+    products = Product.__table__
+    reviews = ProductReview.__table__
+    matching = reviews.c.product_id == products.c.product_id
+    count = db.select(func.count(reviews.c.review_id)).where(matching).scalar_subquery()
+    average = db.select(func.coalesce(func.avg(reviews.c.rating), 0)).where(matching).scalar_subquery()
+    return products.update().values(review_count=count, avg_rating=average)
+
+
+def refresh_review_aggregates():
+    """Recompute every Product.avg_rating and review_count, e.g. after loading reviews with raw SQL"""
+    db.session.execute(review_aggregate_update())
+    db.session.commit()
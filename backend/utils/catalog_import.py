@@ -0,0 +1,506 @@
+import csv
+import io
+import json
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from sqlalchemy import bindparam, func, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Product, ProductCategory, ProductImage, Shop, ShopProduct
+from utils.analytics import analytics_snapshot
+from utils.cache import response_cache
+from utils.catalog import IN_CLAUSE_BATCH_SIZE, category_count_update, chunked
+from utils.search_index import product_search_index
+
+logger = logging.getLogger(__name__)
+
+# Columns an import row may carry; image_urls is '|'-separated in CSV and a list or string in NDJSON
+COLUMNS = ('product_id', 'product_name', 'brand', 'description', 'color', 'category', 'category_id',
+           'image_urls', 'shop_id', 'price', 'stock')
+
+PRODUCT_FIELDS = ('product_name', 'brand', 'description', 'color', 'category_id')
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """
+    Yield ``(line_number, dict)`` from a binary or text stream of CSV or NDJSON.
+
+    Rows are read one at a time, so memory does not grow with the file. Lines
+    that cannot be parsed are yielded as ``(line_number, RowError)``.
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('expected a JSON object')
+            except ValueError as e:
+                yield line_number, RowError(f'invalid JSON: {e}')
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f'Unknown import format: {fmt}')
+
+
+def _text(row, name, limit):
+    value = row.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if len(value) > limit:
+        raise RowError(f'{name} is longer than {limit} characters')
+    return value or None
+
+
+def _integer(row, name, minimum=None):
+    value = row.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{name} must be an integer')
+    if minimum is not None and value < minimum:
+        raise RowError(f'{name} must be at least {minimum}')
+    return value
+
+
+def _price(row):
+    value = row.get('price')
+    if value is None or value == '':
+        return None
+    try:
+        value = Decimal(str(value)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError('price must be a number')
+    if value < 0 or value >= Decimal('100000000'):
+        raise RowError('price is out of range')
+    return value
+
+
+def _images(row):
+    value = row.get('image_urls')
+    if not value:
+        return []
+    urls = value if isinstance(value, list) else str(value).split('|')
+    urls = [str(url).strip() for url in urls if url and str(url).strip()]
+    for url in urls:
+        if len(url) > 500:
+            raise RowError('image URL is longer than 500 characters')
+    return urls
+
+
+class CatalogImporter:
+    """
+    Streams catalog and inventory rows into Products, Product_Images and Shop_Product.
+
+    Rows are processed in batches of ``batch_size``. Each batch resolves its
+    categories, products and listings with a few IN queries, then writes with
+    one executemany INSERT or UPDATE per table in a single transaction, so
+    throughput depends on batches rather than rows. A product is matched by
+    ``product_id`` or else by name and brand; a listing by shop and product.
+    Existing rows are updated with the values given, and blank values keep
+    what is stored. If a batch fails in the database it is retried row by row,
+    so one bad row is reported without losing the rest.
+    """
+
+    def __init__(self, batch_size=1000, max_errors=1000, default_shop_id=None, progress=None):
+        self.batch_size = min(batch_size, IN_CLAUSE_BATCH_SIZE)
+        self.max_errors = max_errors
+        self.default_shop_id = default_shop_id
+        self.progress = progress
+        self.stats = {'rows': 0, 'products_created': 0, 'products_updated': 0, 'images_added': 0,
+                      'listings_created': 0, 'listings_updated': 0, 'failed': 0}
+        self.errors = []
+        self._categories = None
+        self._touched_categories = set()
+        self._touched_shops = set()
+        self._committed = False
+        self._started = None
+
+    # --- Driving ---
+    def steps(self, rows):
+        """
+        Import ``(line_number, row)`` pairs from ``read_rows``, yielding a progress report after each batch.
+
+        Batches commit as they go, so category counters and caches are brought
+        up to date for whatever was committed even when the caller stops early
+        (a dropped streaming client closes the generator) or a batch raises.
+        """
+        self._started = time.perf_counter()
+        rows = iter(rows)
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self._import_batch(batch)
+                yield self.report(include_errors=False)
+        finally:
+            if self._committed:
+                self._finish()
+
+    def run(self, rows):
+        """Import everything, passing progress reports to ``progress``; returns the final report"""
+        for report in self.steps(rows):
+            if self.progress:
+                self.progress(report)
+        return self.report()
+
+    def _finish(self):
+        if self._touched_categories:
+            # Core writes skip the Product mapper listeners that maintain the category counters
+            try:
+                db.session.execute(category_count_update(self._touched_categories))
+                db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                logger.exception('Could not update category product counts after import')
+        self._invalidate()
+
+    def _invalidate(self):
+        # Core writes also skip the session hooks that keep caches and the search index current
+        response_cache.invalidate('categories', 'shop_products', 'product_details',
+                                  *(f'shop:{shop_id}' for shop_id in self._touched_shops))
+        product_search_index.invalidate()
+        if self._touched_categories:
+            analytics_snapshot.request_full_refresh()
+
+    def report(self, include_errors=True):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        report = dict(self.stats, elapsed_seconds=round(elapsed, 2),
+                      rows_per_second=round(self.stats['rows'] / elapsed) if elapsed else 0)
+        if include_errors:
+            report['errors'] = sorted(self.errors, key=lambda error: error['line'])
+        return report
+
+    def _error(self, line_number, message):
+        self.stats['failed'] += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def _import_batch(self, batch):
+        self.stats['rows'] += len(batch)
+        parsed = []
+        for line_number, row in batch:
+            if isinstance(row, RowError):
+                self._error(line_number, str(row))
+                continue
+            try:
+                parsed.append((line_number, self._parse(row)))
+            except RowError as e:
+                self._error(line_number, str(e))
+        parsed = self._check_references(parsed)
+        if not parsed:
+            return
+        try:
+            counts = self._write(parsed)
+            db.session.commit()
+            self._committed = True
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.warning('Import batch failed; retrying its %d rows one at a time', len(parsed))
+            counts = {}
+            for item in parsed:
+                try:
+                    for key, value in self._write([item]).items():
+                        counts[key] = counts.get(key, 0) + value
+                    db.session.commit()
+                    self._committed = True
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    self._error(item[0], str(getattr(e, 'orig', e)))
+        for key, value in counts.items():
+            self.stats[key] += value
+
+    # --- Validation ---
+    def _category_ids(self):
+        if self._categories is None:
+            self._categories = {name.lower(): category_id for category_id, name in
+                                db.session.query(ProductCategory.category_id, ProductCategory.category_name)}
+        return self._categories
+
+    def _parse(self, row):
+        item = {
+            'product_id': _integer(row, 'product_id', 1),
+            'product_name': _text(row, 'product_name', 200),
+            'brand': _text(row, 'brand', 100),
+            'description': _text(row, 'description', 1000),
+            'color': _text(row, 'color', 50),
+            'category_id': _integer(row, 'category_id', 1),
+            'images': _images(row),
+            'shop_id': _integer(row, 'shop_id', 1) or self.default_shop_id,
+            'price': _price(row),
+            'stock': _integer(row, 'stock', 0),
+        }
+        if item['product_id'] is None and not item['product_name']:
+            raise RowError('product_id or product_name is required')
+        category = _text(row, 'category', 100)
+        if category and item['category_id'] is None:
+            item['category_id'] = self._category_ids().get(category.lower())
+            if item['category_id'] is None:
+                raise RowError(f'unknown category: {category}')
+        if item['shop_id'] is None and (item['price'] is not None or item['stock'] is not None):
+            raise RowError('shop_id is required for price and stock')
+        return item
+
+    def _check_references(self, parsed):
+        # Unknown ids would otherwise fail the whole batch on a foreign key
+        def existing(column, values):
+            found = set()
+            for batch in chunked(sorted(values)):
+                found.update(value for (value,) in db.session.query(column).filter(column.in_(batch)))
+            return found
+
+        category_ids = {item['category_id'] for _, item in parsed if item['category_id'] is not None}
+        known_categories = set(self._category_ids().values())
+        shops = existing(Shop.shop_id, {item['shop_id'] for _, item in parsed if item['shop_id'] is not None})
+        products = existing(Product.product_id,
+                            {item['product_id'] for _, item in parsed if item['product_id'] is not None})
+        if category_ids - known_categories:
+            self._categories = None
+            known_categories = set(self._category_ids().values())
+
+        valid = []
+        for line_number, item in parsed:
+            if item['category_id'] is not None and item['category_id'] not in known_categories:
+                self._error(line_number, f'unknown category_id: {item["category_id"]}')
+            elif item['shop_id'] is not None and item['shop_id'] not in shops:
+                self._error(line_number, f'unknown shop_id: {item["shop_id"]}')
+            elif item['product_id'] is not None and item['product_id'] not in products:
+                self._error(line_number, f'unknown product_id: {item["product_id"]}')
+            else:
+                valid.append((line_number, item))
+        return valid
+
+    # --- Writing ---
+    def _resolve_products(self, items):
+        """Fill in product_id for rows matched by name and brand, creating the products that are new"""
+        by_name = {}
+        for item in items:
+            if item['product_id'] is None:
+                by_name.setdefault((item['product_name'], item['brand']), []).append(item)
+        if not by_name:
+            return 0
+
+        def lookup(keys):
+            found = {}
+            names = sorted({name for name, _ in keys})
+            for batch in chunked(names):
+                rows = db.session.query(Product.product_id, Product.product_name, Product.brand).filter(
+                    Product.product_name.in_(batch)
+                ).order_by(Product.product_id)
+                for product_id, name, brand in rows:
+                    found.setdefault((name, brand), product_id)
+            return found
+
+        found = lookup(by_name)
+        new = {key for key in by_name if key not in found}
+        if new:
+            db.session.execute(Product.__table__.insert(), [
+                {field: by_name[key][0][field] for field in PRODUCT_FIELDS}
+                for key in new
+            ])
+            found = lookup(by_name)
+            self._touched_categories.update(
+                by_name[key][0]['category_id'] for key in new if by_name[key][0]['category_id'] is not None
+            )
+        for key, group in by_name.items():
+            for item in group:
+                item['product_id'] = found[key]
+                item['created'] = key in new
+        return len(new)
+
+    def _write(self, parsed):
+        # Work on copies so a rolled-back batch leaves the parsed rows intact for the row-by-row retry
+        items = [dict(item) for _, item in parsed]
+        counts = {'products_created': self._resolve_products([item for item in items if item['product_id'] is None])}
+
+        # Update fields given for existing products; COALESCE keeps stored values where a row left them blank
+        updates = {}
+        for item in items:
+            if not item.get('created') and any(item[field] is not None for field in PRODUCT_FIELDS):
+                updates[item['product_id']] = item
+        if updates:
+            previous = {}
+            for batch in chunked(list(updates)):
+                previous.update(db.session.query(Product.product_id, Product.category_id).filter(
+                    Product.product_id.in_(batch)))
+            products = Product.__table__
+            db.session.execute(
+                products.update().where(products.c.product_id == bindparam('b_product_id')).values(
+                    **{field: func.coalesce(bindparam(f'b_{field}', type_=products.c[field].type), products.c[field])
+                       for field in PRODUCT_FIELDS}
+                ),
+                [dict({f'b_{field}': item[field] for field in PRODUCT_FIELDS}, b_product_id=product_id)
+                 for product_id, item in updates.items()]
+            )
+            for product_id, item in updates.items():
+                if item['category_id'] is not None and item['category_id'] != previous.get(product_id):
+                    self._touched_categories.update(
+                        category_id for category_id in (previous.get(product_id), item['category_id'])
+                        if category_id is not None
+                    )
+            counts['products_updated'] = len(updates)
+
+        counts['images_added'] = self._write_images(items)
+        created, updated = self._write_listings(items)
+        counts['listings_created'], counts['listings_updated'] = created, updated
+        return counts
+
+    def _write_images(self, items):
+        wanted = {}
+        for item in items:
+            for url in item['images']:
+                wanted[(item['product_id'], url)] = None
+        if not wanted:
+            return 0
+        product_ids = sorted({product_id for product_id, _ in wanted})
+        for batch in chunked(product_ids):
+            for key in db.session.query(ProductImage.product_id, ProductImage.image_url).filter(
+                    ProductImage.product_id.in_(batch)):
+                wanted.pop(tuple(key), None)
+        if wanted:
+            db.session.execute(ProductImage.__table__.insert(), [
+                {'product_id': product_id, 'image_url': url} for product_id, url in wanted
+            ])
+        return len(wanted)
+
+    def _write_listings(self, items):
+        # Later rows for the same shop and product win
+        listings = {}
+        for item in items:
+            if item['shop_id'] is not None:
+                listings[(item['shop_id'], item['product_id'])] = item
+        if not listings:
+            return 0, 0
+        existing = {key: listing.shop_product_id for key, listing in _existing_listings(listings).items()}
+        new = [{'shop_id': shop_id, 'product_id': product_id, 'price': item['price'], 'stock': item['stock'] or 0}
+               for (shop_id, product_id), item in listings.items() if (shop_id, product_id) not in existing]
+        if new:
+            db.session.execute(ShopProduct.__table__.insert(), new)
+        changed = [{'b_id': existing[key], 'b_price': item['price'], 'b_stock': item['stock']}
+                   for key, item in listings.items() if key in existing
+                   and (item['price'] is not None or item['stock'] is not None)]
+        if changed:
+            db.session.execute(_listing_update(), changed)
+        self._touched_shops.update(shop_id for shop_id, _ in listings)
+        return len(new), len(changed)
+
+
+def _existing_listings(keys):
+    """``{(shop_id, product_id): row}`` for the listings among ``keys`` that exist, with id, price and stock"""
+    found = {}
+    keys = list(keys)
+    # Two parameters per key, so half an IN batch per query
+    for batch in chunked(keys, IN_CLAUSE_BATCH_SIZE // 2):
+        query = db.session.query(ShopProduct.shop_product_id, ShopProduct.shop_id, ShopProduct.product_id,
+                                 ShopProduct.price, ShopProduct.stock)
+        if db.engine.dialect.name == 'mssql':
+            # No row-value IN on SQL Server; match a superset and keep the exact pairs below
+            query = query.filter(ShopProduct.shop_id.in_({shop_id for shop_id, _ in batch}),
+                                 ShopProduct.product_id.in_({product_id for _, product_id in batch}))
+        else:
+            query = query.filter(tuple_(ShopProduct.shop_id, ShopProduct.product_id).in_(batch))
+        wanted = set(batch)
+        for row in query:
+            key = (row.shop_id, row.product_id)
+            if key in wanted:
+                found.setdefault(key, row)
+    return found
+
+
+def _listing_update():
+    # Executed with b_id, b_price and b_stock per listing; a None price or stock keeps the stored value
+    table = ShopProduct.__table__
+    return table.update().where(table.c.shop_product_id == bindparam('b_id')).values(
+        price=func.coalesce(bindparam('b_price', type_=table.c.price.type), table.c.price),
+        stock=func.coalesce(bindparam('b_stock', type_=table.c.stock.type), table.c.stock)
+    )
+
+
+def update_inventory(items):
+    """
+    Apply a batch of ``{shop_id, product_id, price, stock}`` updates to existing listings.
+
+    Items are validated one by one, the listings they name are read with a
+    few IN queries, and every change is written with a single executemany
+    UPDATE in one transaction. A blank price or stock keeps the stored value.
+    Returns ``(summary, results)``, where ``results`` has one entry per item,
+    in order, with a status of ``updated``, ``unchanged``, ``not_found``,
+    ``superseded`` (a later item names the same listing) or ``error``.
+    Database errors roll the whole batch back and are raised to the caller.
+    """
+    results = []
+    wanted = {}
+    for index, row in enumerate(items):
+        result = {'index': index}
+        results.append(result)
+        try:
+            if not isinstance(row, dict):
+                raise RowError('expected an object')
+            shop_id = _integer(row, 'shop_id', 1)
+            product_id = _integer(row, 'product_id', 1)
+            if shop_id is None or product_id is None:
+                raise RowError('shop_id and product_id are required')
+            price, stock = _price(row), _integer(row, 'stock', 0)
+            if price is None and stock is None:
+                raise RowError('price or stock is required')
+        except RowError as e:
+            result.update(status='error', error=str(e))
+            continue
+        result.update(shop_id=shop_id, product_id=product_id)
+        key = (shop_id, product_id)
+        if key in wanted:
+            # Later items for the same listing win, as they would if sent one by one
+            results[wanted[key][0]]['status'] = 'superseded'
+        wanted[key] = (index, price, stock)
+
+    existing = _existing_listings(wanted) if wanted else {}
+    changed = []
+    for key, (index, price, stock) in wanted.items():
+        result = results[index]
+        listing = existing.get(key)
+        if listing is None:
+            result['status'] = 'not_found'
+            continue
+        new_price = listing.price if price is None else price
+        new_stock = listing.stock if stock is None else stock
+        result.update(shop_product_id=listing.shop_product_id,
+                      price=float(new_price) if new_price is not None else None, stock=new_stock)
+        if new_price == listing.price and new_stock == listing.stock:
+            result['status'] = 'unchanged'
+            continue
+        result['status'] = 'updated'
+        changed.append((key, {'b_id': listing.shop_product_id, 'b_price': price, 'b_stock': stock}))
+
+    if changed:
+        try:
+            db.session.execute(_listing_update(), [params for _, params in changed])
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise
+        # Core writes skip the session hooks; drop the cached pages that show these prices and price ranges
+        response_cache.invalidate(*{f'product:{product_id}' for (_, product_id), _ in changed},
+                                  *{f'shop_products:{shop_id}' for (shop_id, _), _ in changed})
+
+    summary = {status: 0 for status in ('updated', 'unchanged', 'not_found', 'superseded', 'error')}
+    for result in results:
+        summary[result['status']] += 1
+    return summary, results
@@ -0,0 +1,135 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds, in milliseconds, of the checkout wait-time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class PoolStats:
+    """Counters for connection checkouts, shared by every pool the app creates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.soft_invalidations = 0
+            self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+
+    def record_wait(self, elapsed_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, elapsed_ms)] += 1
+            self.wait_total_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        """Counters plus the live state of ``pool``, as a JSON-friendly dict"""
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            result = {
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'soft_invalidations': self.soft_invalidations,
+                'checkout_wait_ms': {
+                    'buckets': [
+                        {'le': bound, 'count': count}
+                        for bound, count in zip(list(WAIT_BUCKETS_MS) + ['+Inf'], self.wait_buckets)
+                    ],
+                    'avg': round(self.wait_total_ms / waits, 3) if waits else 0.0,
+                    'max': round(self.wait_max_ms, 3)
+                }
+            }
+        if isinstance(pool, QueuePool):
+            result.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0)
+            })
+        return result
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        pool_stats.record_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.increment('connects')
+
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.increment('invalidations')
+
+
+@event.listens_for(InstrumentedQueuePool, 'soft_invalidate')
+def _on_soft_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.increment('soft_invalidations')
+
+
+def engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings.
+
+    Every file-backed database gets the instrumented queue pool, so pool
+    behaviour can be exercised against SQLite as well as SQL Server.
+    In-memory SQLite keeps its default single-connection pool.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    options.setdefault('pool_size', config.get('DB_POOL_SIZE', 10))
+    options.setdefault('max_overflow', config.get('DB_MAX_OVERFLOW', 20))
+    options.setdefault('pool_timeout', config.get('DB_POOL_TIMEOUT', 30))
+    options.setdefault('pool_recycle', config.get('DB_POOL_RECYCLE', 1800))
+    options.setdefault('pool_pre_ping', config.get('DB_POOL_PRE_PING', True))
+
+    if url.get_backend_name() == 'sqlite':
+        # Pooled connections are handed to whichever thread checks them out next
+        options.setdefault('connect_args', {}).setdefault('check_same_thread', False)
+
+    if url.get_backend_name() == 'mssql' and url.get_driver_name() == 'pyodbc':
+        # Send executemany() parameter sets to SQL Server in one round trip
+        options.setdefault('fast_executemany', config.get('DB_FAST_EXECUTEMANY', True))
+    return options
@@ -0,0 +1,48 @@
+from operator import attrgetter
+
+from flask import request
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def column_field(column, convert=None):
+    """A field that is one column's value, as ``([column], value)`` for a field spec"""
+    get = attrgetter(column.key)
+    if convert is None:
+        return [column], get
+    return [column], lambda row: convert(get(row))
+
+
+def requested_fields(spec, args=None):
+    """
+    Read the ``fields`` projection from the query string.
+
+    ``spec`` maps each field an endpoint can return to ``(columns, value)``:
+    the columns the field reads and a function building it from a result row,
+    or None when the view fills it in from a query of its own. ``fields`` is a
+    comma-separated list of names in ``spec``; without it every field is
+    returned. Returns the names in ``spec`` order; raises InvalidFields for
+    unknown names.
+    """
+    raw = (request.args if args is None else args).get('fields')
+    if raw is None:
+        return list(spec)
+    names = {name.strip() for name in raw.split(',')} - {''}
+    if not names or not names <= spec.keys():
+        raise InvalidFields(f'fields must be a comma-separated list of: {", ".join(spec)}')
+    return [name for name in spec if name in names]
+
+
+def field_columns(spec, fields, *always):
+    """The columns to SELECT for ``fields``, after ``always``, each once"""
+    columns = dict.fromkeys(always)
+    for name in fields:
+        columns.update(dict.fromkeys(spec[name][0]))
+    return list(columns)
+
+
+def project(row, spec, fields):
+    """The response dict of ``fields`` built from ``row``; fields without a value function are left to the caller"""
+    return {name: spec[name][1](row) for name in fields if spec[name][1] is not None}
@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+
+# Radius of the Earth in kilometers
+EARTH_RADIUS_KM = 6371.0
+
+# Length of one degree of latitude in kilometers
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points using Haversine formula"""
+    return float(haversine_batch(lat1, lon1, lat2, lon2))
+
+
+def round_distance(distance):
+    """Round a distance in kilometers the way every endpoint reports it"""
+    return round(float(distance), 2)
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Latitude/longitude box that encloses every point within ``radius_km``.
+
+    Returns ``(min_lat, max_lat, min_lon, max_lon)``. Near the poles, or when
+    the circle crosses the antimeridian, the box widens to all longitudes.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+
+    # Widen the longitude span by the latitude the circle reaches closest to a pole
+    pole_lat = max(abs(min_lat), abs(max_lat))
+    if pole_lat >= 89.9:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = dlat / math.cos(math.radians(pole_lat))
+    if lon - dlon < -180.0 or lon + dlon > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def haversine_batch(lat, lon, lats, lons):
+    """Distances in kilometers from one point to arrays of points, in a single vectorized pass"""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64)) - np.radians(lon)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def nearest_within(lat, lon, lats, lons, radius=None, k=None):
+    """
+    Rank points by distance from (lat, lon).
+
+    Returns ``(indices, distances)`` into the input arrays, closest first,
+    keeping only points within ``radius`` kilometers and at most ``k`` of them.
+    """
+    distances = haversine_batch(lat, lon, lats, lons)
+    indices = np.arange(distances.shape[0])
+
+    if radius is not None:
+        mask = distances <= radius
+        indices = indices[mask]
+        distances = distances[mask]
+
+    if k is not None and k < distances.shape[0]:
+        top = np.argpartition(distances, k - 1)[:k] if k > 0 else np.arange(0)
+        indices = indices[top]
+        distances = distances[top]
+
+    order = np.argsort(distances, kind='stable')
+    return indices[order], distances[order]
@@ -0,0 +1,128 @@
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from itertools import islice
+
+from flask import current_app, stream_with_context
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Encoded items are buffered up to this size before a streamed response sends them
+STREAM_CHUNK_BYTES = 64 * 1024
+STREAM_BATCH_ITEMS = 256
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """
+    Flask's encoder with one rule per type the models return.
+
+    ``Decimal`` (prices, coordinates) becomes a number, and ``datetime``,
+    ``date`` and ``time`` become ISO 8601 strings, never Flask's RFC 822 dates.
+    """
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return float(o)
+        if isinstance(o, (datetime, date, time)):
+            return o.isoformat()
+        return super().default(o)
+
+    def encode_bytes(self, o):
+        return self.encode(o).encode('utf-8')
+
+
+class OrjsonEncoder(JSONEncoder):
+    """
+    Hands whole documents to orjson, which formats datetime, date and time
+    the same way ``isoformat()`` does and calls ``default`` for the rest.
+    Output is UTF-8 whatever JSON_AS_ASCII says.
+    """
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def encode_bytes(self, o):
+        return orjson.dumps(o, default=self.default, option=self._options())
+
+    def encode(self, o):
+        return self.encode_bytes(o).decode('utf-8')
+
+    def iterencode(self, o, _one_shot=False):
+        return iter([self.encode(o)])
+
+
+def init_app(app):
+    """Install the encoder named by JSON_ENCODER: 'auto' (orjson when installed), 'orjson' or 'std'"""
+    name = app.config.get('JSON_ENCODER', 'auto')
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_ENCODER='orjson' requires the orjson package")
+    if name not in ('auto', 'orjson', 'std'):
+        raise ValueError(f'Unknown JSON_ENCODER: {name}')
+    app.json_encoder = OrjsonEncoder if name != 'std' and orjson is not None else JSONEncoder
+
+
+def dumps(value, app=None):
+    """Compact UTF-8 JSON for ``value`` with the app's encoder, as bytes"""
+    app = app or current_app
+    return _encoder(app).encode_bytes(value)
+
+
+def _encoder(app):
+    return app.json_encoder(ensure_ascii=app.config['JSON_AS_ASCII'], sort_keys=app.config['JSON_SORT_KEYS'],
+                            separators=(',', ':'))
+
+
+def stream_json_array(items, prefix=b'', suffix=b'', status=200, headers=None):
+    """
+    A response that writes ``items`` as a JSON array while iterating them.
+
+    ``items`` can be a generator, so rows are encoded and sent a batch at a
+    time and no second copy of the result is built as one document.
+    ``prefix`` and ``suffix`` wrap the array, e.g. to place it in an envelope.
+    The generator runs after the view returns, when the SQL profile and
+    request metrics are already recorded, so it should only format rows that
+    were fetched before returning. If it raises, the error is logged and the
+    array is still closed, since the 200 status has already been sent.
+    """
+    app = current_app._get_current_object()
+    encode = _encoder(app).encode_bytes
+    chunk_bytes = app.config.get('JSON_STREAM_CHUNK_BYTES', STREAM_CHUNK_BYTES)
+    rows = iter(items)
+    # The first batch is encoded now, so a failure there still reaches the view's error handling
+    head = encode(list(islice(rows, STREAM_BATCH_ITEMS)))[1:-1]
+
+    def generate():
+        buffer = bytearray(prefix + b'[' + head)
+        first = not head
+        try:
+            while True:
+                # Encoding a few hundred items per call costs far less than one call per item
+                batch = list(islice(rows, STREAM_BATCH_ITEMS))
+                if not batch:
+                    break
+                encoded = encode(batch)[1:-1]
+                if not first:
+                    buffer += b','
+                buffer += encoded
+                first = False
+                if len(buffer) >= chunk_bytes:
+                    yield bytes(buffer)
+                    buffer.clear()
+        except Exception:
+            logger.exception('Error while streaming a JSON array; closing it early')
+        buffer += b']' + suffix + b'\n'
+        yield bytes(buffer)
+
+    return app.response_class(stream_with_context(generate()), status=status, headers=headers,
+                              mimetype=app.config['JSONIFY_MIMETYPE'])
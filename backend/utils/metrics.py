@@ -0,0 +1,313 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'nearbuy_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status code', None),
+    'nearbuy_http_request_duration_seconds': ('histogram', 'Time spent serving each request', LATENCY_BUCKETS),
+    'nearbuy_http_requests_in_flight': ('gauge', 'Requests currently being served', None),
+    'nearbuy_http_request_size_bytes': ('histogram', 'Request body size', SIZE_BUCKETS),
+    'nearbuy_http_response_size_bytes': ('histogram', 'Response body size', SIZE_BUCKETS),
+    'nearbuy_db_time_seconds': ('histogram', 'Time spent executing SQL per request', LATENCY_BUCKETS),
+    'nearbuy_db_queries_total': ('counter', 'SQL statements executed, by endpoint', None),
+    'nearbuy_password_hash_queue_depth': ('gauge', 'Password jobs waiting for a hashing thread', None),
+    'nearbuy_password_hash_in_progress': ('gauge', 'Password jobs being hashed', None),
+    'nearbuy_password_hash_wait_seconds': ('histogram', 'Time password jobs waited for a hashing thread',
+                                           LATENCY_BUCKETS),
+    'nearbuy_password_hash_duration_seconds': ('histogram', 'Time spent hashing or checking one password',
+                                               LATENCY_BUCKETS),
+    'nearbuy_password_hash_rejected_total': ('counter', 'Password jobs turned away because the queue was full', None),
+    'nearbuy_password_rehash_total': ('counter', 'Stored password hashes upgraded to the configured method', None),
+}
+
+
+class MeteredBody:
+    """Wraps a streamed response body, counting the bytes sent and reporting them once it is closed."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+        self._size = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            if on_close is not None:
+                on_close(self._size)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe request metrics, exposed in the Prometheus text format.
+
+    Every process keeps its own counters. With METRICS_MULTIPROC_DIR set, each
+    process also writes a snapshot to ``<dir>/metrics-<pid>.json`` at most every
+    METRICS_FLUSH_SECONDS, and a scrape of any worker merges all snapshots, so
+    counters and histograms cover the whole pre-fork server. In-flight gauges
+    are only taken from processes that are still alive.
+
+    Statement counts and DB time per request come from two engine hooks of
+    their own that add the elapsed time to the request's running total; unlike
+    the SQL profiler they keep nothing per statement. Set METRICS_DB_TIME to
+    false to leave them out.
+
+    Streamed responses are counted as their body is sent: the size and
+    duration are recorded when the server closes the body.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.db_time = False
+        self.multiproc_dir = None
+        self.flush_seconds = 1.0
+        self._lock = threading.Lock()
+        self._values = {}
+        self._pid = os.getpid()
+        self._last_flush = 0.0
+        # [statements, seconds] of the request running in this context
+        self._db_usage = ContextVar('metrics_db_usage', default=None)
+        self._db_hooks = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.db_time = self.enabled and app.config.get('METRICS_DB_TIME', True)
+        self.multiproc_dir = app.config.get('METRICS_MULTIPROC_DIR') or None
+        self.flush_seconds = app.config.get('METRICS_FLUSH_SECONDS', self.flush_seconds)
+        if not self.enabled:
+            return
+
+        if self.multiproc_dir:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            atexit.register(self.flush)
+        if self.db_time and not self._db_hooks:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._db_hooks = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._end_request)
+        app.add_url_rule('/metrics', 'metrics', self.render_response, methods=['GET'])
+
+    # --- Recording ---
+    def _check_fork(self):
+        # A forked worker starts from a copy of the parent's numbers; count only its own requests
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._values = {}
+            self._last_flush = 0.0
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            series = self._values.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then sum and count
+                series = self._values[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # --- DB time ---
+    def start_db_usage(self):
+        """Start totalling the statements of the request running in this context; returns a token, or None when off"""
+        return self._db_usage.set([0, 0.0]) if self.db_time else None
+
+    def finish_db_usage(self, token, labels):
+        """Record the total started by ``start_db_usage`` under ``labels`` and stop totalling"""
+        if token is None:
+            return
+        count, seconds = self._db_usage.get()
+        self._db_usage.reset(token)
+        self.inc('nearbuy_db_queries_total', labels, count)
+        self.observe('nearbuy_db_time_seconds', labels, seconds)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._db_usage.get() is not None:
+            conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        usage = self._db_usage.get()
+        starts = conn.info.get('metrics_start')
+        if usage is not None and starts:
+            usage[0] += 1
+            usage[1] += time.perf_counter() - starts.pop()
+
+    def _handle_error(self, exception_context):
+        starts = exception_context.connection.info.get('metrics_start') if exception_context.connection else None
+        if starts and self._db_usage.get() is not None:
+            starts.pop()
+
+    # --- Request hooks ---
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or 'unmatched'
+        g.metrics_db = self.start_db_usage()
+        self.inc('nearbuy_http_requests_in_flight', (('endpoint', g.metrics_endpoint),))
+
+    def _finish_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = g.metrics_endpoint
+        by_endpoint = (('endpoint', endpoint),)
+        by_method = (('endpoint', endpoint), ('method', request.method))
+
+        self.inc('nearbuy_http_requests_total', by_method + (('status', str(response.status_code)),))
+        self.observe('nearbuy_http_request_size_bytes', by_endpoint, request.content_length or 0)
+
+        def record(size):
+            self.observe('nearbuy_http_request_duration_seconds', by_method, time.perf_counter() - start)
+            self.observe('nearbuy_http_response_size_bytes', by_endpoint, size)
+
+        if response.is_streamed:
+            response.response = MeteredBody(response.response, record)
+        else:
+            record(response.calculate_content_length() or 0)
+
+        self.finish_db_usage(g.pop('metrics_db', None), by_endpoint)
+
+        if self.multiproc_dir and time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+        return response
+
+    def _end_request(self, exception=None):
+        # after_request is skipped when an exception escapes the view; stop totalling for this thread anyway
+        db_usage = g.pop('metrics_db', None)
+        if db_usage is not None:
+            self._db_usage.reset(db_usage)
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            self.inc('nearbuy_http_requests_in_flight', (('endpoint', endpoint),), -1)
+
+    # --- Multi-process snapshots ---
+    def _snapshot_path(self, pid):
+        return os.path.join(self.multiproc_dir, f'metrics-{pid}.json')
+
+    def flush(self):
+        """Write this process's values to the shared directory"""
+        if not self.multiproc_dir:
+            return
+        with self._lock:
+            self._check_fork()
+            self._last_flush = time.monotonic()
+            data = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+        if not data:
+            # Nothing recorded yet (or a pre-fork parent that serves no requests)
+            return
+        path = self._snapshot_path(self._pid)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as snapshot:
+            json.dump(data, snapshot)
+        os.replace(temporary, path)
+
+    def collect(self):
+        """Current values, merged across worker processes when a snapshot directory is configured"""
+        with self._lock:
+            self._check_fork()
+            own = {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+        if not self.multiproc_dir:
+            return own
+
+        merged = own
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics-*.json')):
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+            if pid == self._pid:
+                continue
+            try:
+                with open(path) as snapshot:
+                    data = json.load(snapshot)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(pid)
+            for name, labels, value in data:
+                if name not in METRICS or (METRICS[name][0] == 'gauge' and not alive):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = value
+                elif isinstance(current, list):
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = current + value
+        return merged
+
+    # --- Exposition ---
+    def render(self):
+        values = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+                lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def render_response(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+metrics = MetricsRegistry()
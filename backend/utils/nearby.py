@@ -0,0 +1,92 @@
+import heapq
+
+from sqlalchemy import select
+
+from models import db, Product, ShopProduct
+
+# Shops are scanned nearest first in growing batches, so dense areas usually stop after the first one
+FIRST_SHOP_BATCH = 50
+MAX_SHOP_BATCH = 1000
+
+# Every scan reads these to rank listings, whatever other columns it is asked for
+RANK_COLUMNS = (ShopProduct.shop_product_id, ShopProduct.shop_id, ShopProduct.price)
+
+PRODUCT_COLUMNS = RANK_COLUMNS + (
+    ShopProduct.stock, ShopProduct.product_id,
+    Product.product_name, Product.description, Product.brand, Product.color, Product.category_id
+)
+
+
+class NearestListings:
+    """
+    Bounded top-k scan for the ``limit`` closest shop listings among ``shops``.
+
+    ``shops`` is a list of ``(distance, shop_id)`` sorted by distance. Listings
+    are ranked by shop distance, then price, and kept in a bounded max-heap of
+    size ``limit``. Because shops are read nearest first, scanning stops as
+    soon as the next shop is farther than the worst listing already kept.
+    Rows carry RANK_COLUMNS and ``columns``; Products is only joined when one
+    of its columns or ``category_id`` needs it.
+
+    The scan does no I/O itself: call ``next_query()`` for the next batch's
+    SELECT, execute it however the caller talks to the database, and pass the
+    rows to ``add()``, until ``next_query()`` returns None.
+    """
+
+    def __init__(self, shops, limit, category_id=None, max_price=None, in_stock=False, columns=PRODUCT_COLUMNS):
+        self.limit = limit
+        self.columns = list(dict.fromkeys(RANK_COLUMNS + tuple(columns)))
+        self._join_product = category_id is not None or any(column.class_ is Product for column in self.columns)
+        self.category_id = category_id
+        self.max_price = max_price
+        self.in_stock = in_stock
+        self._heap = []
+        self._remaining = list(shops) if limit > 0 else []
+        self._size = FIRST_SHOP_BATCH
+        self._distances = {}
+
+    def next_query(self):
+        heap, remaining = self._heap, self._remaining
+        if not remaining or (len(heap) == self.limit and remaining[0][0] > -heap[0][0][0]):
+            return None
+        batch, self._remaining = remaining[:self._size], remaining[self._size:]
+        self._size = min(self._size * 2, MAX_SHOP_BATCH)
+        self._distances = {shop_id: distance for distance, shop_id in batch}
+
+        query = select(*self.columns).where(ShopProduct.shop_id.in_(list(self._distances)))
+        if self._join_product:
+            query = query.join(Product, Product.product_id == ShopProduct.product_id)
+        if self.category_id is not None:
+            query = query.where(Product.category_id == self.category_id)
+        if self.max_price is not None:
+            query = query.where(ShopProduct.price <= self.max_price)
+        if self.in_stock:
+            query = query.where(ShopProduct.stock > 0)
+        return query
+
+    def add(self, rows):
+        heap = self._heap
+        for row in rows:
+            distance = self._distances[row.shop_id]
+            price = float(row.price) if row.price is not None else 0.0
+            # heapq is a min-heap, so negate the key to keep the worst listing on top
+            key = (-distance, -price, -row.shop_product_id)
+            if len(heap) < self.limit:
+                heapq.heappush(heap, (key, row))
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, row))
+
+    def result(self):
+        """``[(distance, row)]`` in rank order, where each row carries the scan's columns"""
+        return [(-key[0], row) for key, row in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+
+
+def nearest_shop_products(shops, limit, category_id=None, max_price=None, in_stock=False, columns=PRODUCT_COLUMNS):
+    """The ``limit`` closest shop listings among ``shops``; see NearestListings"""
+    scan = NearestListings(shops, limit, category_id=category_id, max_price=max_price, in_stock=in_stock,
+                           columns=columns)
+    query = scan.next_query()
+    while query is not None:
+        scan.add(db.session.execute(query))
+        query = scan.next_query()
+    return scan.result()
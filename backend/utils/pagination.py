@@ -0,0 +1,107 @@
+import base64
+import json
+
+from flask import current_app, jsonify, request
+from sqlalchemy import and_, or_
+
+from utils.json_encoding import dumps, stream_json_array
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Pack the sort key of the last row on a page into an opaque string"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Unpack a cursor produced by encode_cursor; raises InvalidCursor if it was tampered with"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list):
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def page_args(default_limit=None):
+    """
+    Read ``cursor`` and ``limit`` from the query string.
+
+    Returns ``(cursor_values, limit)``; ``cursor_values`` is None on the first page
+    and ``limit`` is clamped to PAGE_SIZE_MAX.
+    """
+    config = current_app.config
+    limit = request.args.get('limit', default_limit or config.get('PAGE_SIZE_DEFAULT', 20), type=int)
+    limit = max(1, min(limit, config.get('PAGE_SIZE_MAX', 100)))
+    cursor = request.args.get('cursor')
+    return (decode_cursor(cursor) if cursor else None), limit
+
+
+def _sort_columns(columns):
+    return [column if isinstance(column, tuple) else (column, False) for column in columns]
+
+
+def after_key(columns, values):
+    """
+    Filter for rows that sort after ``values`` on ``columns``.
+
+    Each entry of ``columns`` is a column or a ``(column, descending)`` pair. The
+    comparison is expanded into ANDs and ORs because SQL Server has no row-value
+    comparison.
+    """
+    columns = _sort_columns(columns)
+    if len(values) != len(columns):
+        raise InvalidCursor('Invalid cursor')
+    clauses = []
+    for position, (column, descending) in enumerate(columns):
+        equal = [columns[i][0] == values[i] for i in range(position)]
+        clauses.append(and_(*equal, column < values[position] if descending else column > values[position]))
+    return or_(*clauses)
+
+
+def paginate(query, columns, cursor_values, limit, key, offset=0):
+    """
+    Fetch one keyset page from ``query``.
+
+    ``columns`` gives the sort order and must end in a unique column; ``key``
+    returns the matching sort values for a fetched row. ``offset`` is only
+    honoured on the first page, for clients that predate cursors.
+    Returns ``(rows, next_cursor)``.
+    """
+    if cursor_values is not None:
+        query = query.filter(after_key(columns, cursor_values))
+    order_by = [column.desc() if descending else column for column, descending in _sort_columns(columns)]
+    query = query.order_by(*order_by)
+    if offset and cursor_values is None:
+        query = query.offset(offset)
+    rows = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def page_response(items, next_cursor, stream=False):
+    """
+    Build the JSON response for a page.
+
+    Clients that send ``cursor`` (empty on the first page) get
+    ``{'items': [...], 'next_cursor': ...}``; older clients keep receiving a
+    bare array with the next cursor in the X-Next-Cursor header. With
+    ``stream``, ``items`` may be a generator and is encoded as it is sent.
+    """
+    envelope = 'cursor' in request.args
+    if stream:
+        if envelope:
+            return stream_json_array(items, prefix=b'{"items":', suffix=b',"next_cursor":' + dumps(next_cursor) + b'}')
+        return stream_json_array(items, headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
+    if envelope:
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from utils.metrics import metrics
+
+
+class PasswordHashingBusy(RuntimeError):
+    pass
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords on a thread pool of its own.
+
+    Password hashing is slow on purpose, so at most ``workers`` hashes run at
+    once and at most ``max_queue`` more wait for a thread. Beyond that callers
+    get PasswordHashingBusy straight away rather than queueing behind a login
+    storm. hashlib releases the GIL while it hashes, and a request thread
+    waiting for its result uses no CPU, so catalog requests keep the remaining
+    cores. ``method`` is a Werkzeug method string whose last part is the cost,
+    e.g. 'pbkdf2:sha256:600000'; hashes made with another method are replaced
+    on the next successful check.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', workers=2, max_queue=64):
+        self.method = _full_method(method)
+        self.workers = workers
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+
+    def init_app(self, app):
+        self.method = _full_method(app.config.get('PASSWORD_HASH_METHOD', self.method))
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_queue = app.config.get('PASSWORD_HASH_MAX_QUEUE', self.max_queue)
+
+    def hash(self, password):
+        """A salted hash of ``password`` with the configured method"""
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify_and_update(self, stored, password):
+        """
+        Check ``password`` against the ``stored`` hash.
+
+        Returns ``(valid, new_hash)``; ``new_hash`` is a replacement made with
+        the configured method when the password is valid but ``stored`` used
+        another one, else None. Both happen in the same pool job.
+        """
+        valid, new_hash = self._run('verify', _verify_and_update, stored, password, self.method)
+        if new_hash is not None and metrics.enabled:
+            metrics.inc('nearbuy_password_rehash_total', ())
+        return valid, new_hash
+
+    def _run(self, operation, function, *args):
+        by_operation = (('operation', operation),)
+        with self._lock:
+            # Threads do not survive fork, so each worker process starts its own pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+                self._pid = os.getpid()
+                self._pending = 0
+            busy = self._pending >= self.workers + self.max_queue
+            if not busy:
+                self._pending += 1
+            executor = self._executor
+        if busy:
+            if metrics.enabled:
+                metrics.inc('nearbuy_password_hash_rejected_total', by_operation)
+            raise PasswordHashingBusy('Too many password checks in progress, try again shortly')
+
+        queued = time.perf_counter()
+        if metrics.enabled:
+            metrics.inc('nearbuy_password_hash_queue_depth', by_operation)
+
+        def job():
+            started = time.perf_counter()
+            if metrics.enabled:
+                metrics.inc('nearbuy_password_hash_queue_depth', by_operation, -1)
+                metrics.inc('nearbuy_password_hash_in_progress', by_operation)
+                metrics.observe('nearbuy_password_hash_wait_seconds', by_operation, started - queued)
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                if metrics.enabled:
+                    metrics.inc('nearbuy_password_hash_in_progress', by_operation, -1)
+                    metrics.observe('nearbuy_password_hash_duration_seconds', by_operation,
+                                    time.perf_counter() - started)
+
+        return executor.submit(job).result()
+
+
+def _full_method(method):
+    # Werkzeug stores 'pbkdf2:sha256' as 'pbkdf2:sha256:<default iterations>'; compare against that
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def _verify_and_update(stored, password, method):
+    if not stored or not check_password_hash(stored, password):
+        return False, None
+    if stored.split('$', 1)[0] == method:
+        return True, None
+    return True, generate_password_hash(password, method)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from models import db, Admin, User
+
+# Key used to stash changed principals on a session between flush and commit
+_PENDING_KEY = 'principal_cache_changes'
+
+
+class PrincipalCache:
+    """
+    TTL-bounded LRU of verified tokens and the user or admin they resolve to.
+
+    A hit skips both the JWT signature check and the Users/admin lookup. Only
+    the primary key is cached, never the password hash or profile columns:
+    the row is re-attached to the request's session from its key without a
+    SELECT, which is all authorization needs, and a view that reads any other
+    column loads them in one query on first access. Views can still modify
+    and commit the row. Entries never outlive the token's ``exp``.
+
+    A commit that touches the user or admin drops their entries at once, but
+    only in the process that made it. Other worker processes keep accepting
+    the token for up to ``ttl`` seconds, so a deleted account can still
+    authenticate there for that long; PRINCIPAL_CACHE_TTL bounds the window.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PRINCIPAL_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('PRINCIPAL_CACHE_MAX_ENTRIES', self.max_entries)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            tokens = self._owners.get(entry[2])
+            if tokens is not None:
+                tokens.discard(key)
+                if not tokens:
+                    del self._owners[entry[2]]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, claims, values, owner):
+        expires = time.time() + self.ttl
+        if claims.get('exp') is not None:
+            expires = min(expires, float(claims['exp']))
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (expires, claims, owner, values)
+            self._owners.setdefault(owner, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, kind, principal_id):
+        """Forget every cached token that resolves to this user or admin"""
+        with self._lock:
+            for key in list(self._owners.get((kind, principal_id), ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+
+    def _resolve(self, kind, model, token, lookup, id_claim):
+        key = (kind, token)
+        entry = self._get(key) if self.ttl else None
+        if entry is not None:
+            return entry[1], _attach(model, entry[3])
+
+        claims = jwt.decode(token, os.getenv('SECRET_KEY', 'dev_key_change_in_production'), algorithms=['HS256'])
+        principal = lookup(claims[id_claim])
+        if principal is not None and self.ttl:
+            values = {column.key: getattr(principal, column.key) for column in model.__mapper__.primary_key}
+            self._put(key, claims, values, (kind, claims[id_claim]))
+        return claims, principal
+
+    def load_user(self, token):
+        """Return ``(claims, user)`` for a bearer token; raises jwt errors for bad tokens"""
+        return self._resolve('user', User, token, User.query.get, 'user_id')
+
+    def load_admin(self, token):
+        """Return ``(claims, admin)`` for an admin bearer token; raises jwt errors for bad tokens"""
+        return self._resolve('admin', Admin, token, lambda user_id: Admin.query.filter_by(userId=user_id).first(),
+                             'userId')
+
+
+def _attach(model, values):
+    # Rebuild the row from its key without running __init__; the session loads any other column when it is read
+    instance = model.__mapper__.class_manager.new_instance()
+    for name, value in values.items():
+        setattr(instance, name, value)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+
+principal_cache = PrincipalCache()
+
+
+# --- Invalidate on committed writes ---
+@event.listens_for(Session, 'after_flush')
+def _collect_principal_changes(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault(_PENDING_KEY, set()).add(('user', obj.user_id))
+        elif isinstance(obj, Admin):
+            session.info.setdefault(_PENDING_KEY, set()).add(('admin', obj.userId))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_principals(session):
+    for kind, principal_id in session.info.pop(_PENDING_KEY, ()):
+        principal_cache.invalidate(kind, principal_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_principal_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import db, SearchHistory
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHistoryWriter:
+    """
+    Buffers search-history entries in memory and writes them in bulk.
+
+    ``record`` only appends to the buffer, so searches never wait on the
+    database. A background thread flushes the buffer with one multi-row
+    INSERT once it holds ``batch_size`` entries or ``flush_seconds`` have
+    passed, and whatever is left is flushed when the process exits. Repeats
+    of the same search by the same user inside one batch are coalesced into
+    the latest one. Rows that fail because the database cannot be reached
+    go back into the buffer for the next flush; only rows the database
+    rejects are dropped.
+    """
+
+    def __init__(self, batch_size=100, flush_seconds=2.0, max_buffer=10000):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.app = None
+        self._buffer = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('SEARCH_HISTORY_BATCH_SIZE', self.batch_size)
+        self.flush_seconds = app.config.get('SEARCH_HISTORY_FLUSH_SECONDS', self.flush_seconds)
+        self.max_buffer = app.config.get('SEARCH_HISTORY_MAX_BUFFER', self.max_buffer)
+        atexit.register(self.shutdown)
+
+    def record(self, user_id, search_item):
+        """Queue one search for writing; never touches the database"""
+        with self._lock:
+            key = (user_id, search_item)
+            if key not in self._buffer and len(self._buffer) >= self.max_buffer:
+                # Shed the oldest entry rather than grow without bound while the database is down
+                self._buffer.pop(next(iter(self._buffer)))
+                self._dropped += 1
+            self._buffer.pop(key, None)
+            self._buffer[key] = datetime.utcnow()
+            full = len(self._buffer) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='search-history-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, {}
+        return [
+            {'user_id': user_id, 'search_item': search_item, 'timestamp': timestamp}
+            for (user_id, search_item), timestamp in entries.items()
+        ]
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows inserted"""
+        rows = self._take()
+        if not rows or self.app is None:
+            return 0
+        insert = SearchHistory.__table__.insert()
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert, rows)
+                return len(rows)
+            except IntegrityError:
+                # One bad row (e.g. an unknown user_id) fails the batch; retry the rows individually
+                written = 0
+                for n, row in enumerate(rows):
+                    try:
+                        with db.engine.begin() as connection:
+                            connection.execute(insert, row)
+                        written += 1
+                    except IntegrityError:
+                        logger.warning('Dropping search history entry for user %s', row['user_id'])
+                    except SQLAlchemyError:
+                        logger.warning('Search history write failed; keeping %d entries for the next flush',
+                                       len(rows) - n, exc_info=True)
+                        self._requeue(rows[n:])
+                        break
+                return written
+            except SQLAlchemyError:
+                logger.warning('Search history write failed; keeping %d entries for the next flush', len(rows),
+                               exc_info=True)
+                self._requeue(rows)
+                return 0
+
+    def _requeue(self, rows):
+        """Put rows that could not be written back in front of the buffer, oldest first"""
+        with self._lock:
+            # Entries recorded since the rows were taken are newer and win
+            entries = {(row['user_id'], row['search_item']): row['timestamp'] for row in rows
+                       if (row['user_id'], row['search_item']) not in self._buffer}
+            entries.update(self._buffer)
+            while len(entries) > self.max_buffer:
+                entries.pop(next(iter(entries)))
+                self._dropped += 1
+            self._buffer = entries
+
+    def shutdown(self):
+        """Stop the background thread and flush what is left"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_seconds + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'buffered': len(self._buffer), 'dropped': self._dropped}
+
+
+search_history_writer = SearchHistoryWriter()
@@ -0,0 +1,362 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Product, ProductCategory, ProductReview
+from utils.catalog import chunked
+
+# Fields indexed for every product, with the weight each one carries in ranking
+FIELDS = ('product_name', 'brand', 'description', 'category_name')
+DEFAULT_BOOSTS = {'product_name': 3.0, 'brand': 2.0, 'description': 1.0, 'category_name': 1.5}
+
+# BM25 tuning constants
+K1 = 1.2
+B = 0.75
+
+# At most this many indexed terms are tried for a trailing prefix
+MAX_PREFIX_EXPANSIONS = 50
+
+# Result orders; each maps a hit to its cursor values, compared descending with product_id as tie-break
+SORTS = {
+    'relevance': lambda score, rating: (score,),
+    'rating': lambda score, rating: rating,
+    'reviews': lambda score, rating: (rating[1], rating[0]),
+}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Key used to stash changed products on a session between flush and commit
+_PENDING_KEY = 'search_index_changes'
+
+
+def tokenize(text):
+    """Lowercase a string and split it into alphanumeric terms"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+class ProductSearchIndex:
+    """
+    In-memory inverted index over product name, brand, description and category.
+
+    Queries match every term (AND), treat the last term as a prefix so results
+    update while the user types, and rank with BM25F using per-field boosts.
+    Products changed through the ORM, or whose reviews changed, are re-read
+    lazily on the next search. Each product's stored ``(avg_rating,
+    review_count)`` is kept alongside so results can be filtered and sorted
+    by rating without touching the database.
+
+    Reloads and re-reads query the database outside the index lock: a new
+    index is built aside and swapped in, so searches keep using the current
+    one meanwhile. Only the very first load makes searches wait.
+    """
+
+    def __init__(self, boosts=None, refresh_seconds=300):
+        self.boosts = dict(boosts or DEFAULT_BOOSTS)
+        self.refresh_seconds = refresh_seconds
+        self._postings = {}
+        self._lengths = {}
+        self._categories = {}
+        self._ratings = {}
+        self._field_totals = [0] * len(FIELDS)
+        self._terms = []
+        self._terms_dirty = False
+        self._stale = set()
+        self._loaded_at = None
+        self._loading = False
+        self._generation = 0
+        self._lock = threading.RLock()
+        # Held by the one thread reading products from the database, never while searching
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    # --- Building ---
+    def _add(self, product_id, category_id, values, rating=(0.0, 0)):
+        self._ratings[product_id] = (float(rating[0] or 0), int(rating[1] or 0))
+        counts = [Counter(tokenize(value)) for value in values]
+        lengths = tuple(sum(counter.values()) for counter in counts)
+        terms = set()
+        for counter in counts:
+            terms.update(counter)
+        self._lengths[product_id] = (lengths, category_id, tuple(terms))
+        for position, length in enumerate(lengths):
+            self._field_totals[position] += length
+        if category_id is not None:
+            self._categories.setdefault(category_id, set()).add(product_id)
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[product_id] = tuple(counter.get(term, 0) for counter in counts)
+
+    def _discard(self, product_id):
+        entry = self._lengths.pop(product_id, None)
+        if entry is None:
+            return
+        lengths, category_id, terms = entry
+        self._ratings.pop(product_id, None)
+        for position, length in enumerate(lengths):
+            self._field_totals[position] -= length
+        if category_id is not None:
+            members = self._categories.get(category_id)
+            if members is not None:
+                members.discard(product_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[product_id]
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+
+    def _rows(self, product_ids=None):
+        query = db.session.query(
+            Product.product_id,
+            Product.category_id,
+            Product.product_name,
+            Product.brand,
+            Product.description,
+            ProductCategory.category_name,
+            Product.avg_rating,
+            Product.review_count
+        ).outerjoin(ProductCategory, Product.category_id == ProductCategory.category_id)
+        if product_ids is not None:
+            query = query.filter(Product.product_id.in_(product_ids))
+        return query.yield_per(5000)
+
+    def load(self, rows):
+        """
+        Rebuild the index from (product_id, category_id, name, brand,
+        description, category_name, avg_rating, review_count) rows
+        """
+        self._swap_in(rows, self._generation)
+
+    def _swap_in(self, rows, generation):
+        # Build the new postings aside, then replace the current ones in one step
+        fresh = ProductSearchIndex(self.boosts)
+        for row in rows:
+            fresh._add(row[0], row[1], row[2:6], row[6:8])
+        fresh._terms = sorted(fresh._postings)
+        with self._lock:
+            self._postings = fresh._postings
+            self._lengths = fresh._lengths
+            self._categories = fresh._categories
+            self._ratings = fresh._ratings
+            self._field_totals = fresh._field_totals
+            self._terms = fresh._terms
+            self._terms_dirty = False
+            # Products marked stale while the rows were read stay marked; an invalidate() meanwhile wins
+            self._loaded_at = time.monotonic() if generation == self._generation else None
+
+    def _needs_load(self):
+        return self._loaded_at is None or (
+            self.refresh_seconds and time.monotonic() - self._loaded_at >= self.refresh_seconds)
+
+    def ensure_loaded(self):
+        """Load on first use or once stale, then re-read products changed since the last search"""
+        if self._needs_load():
+            self._reload()
+        if self._stale:
+            self._reread_stale()
+
+    def _reload(self):
+        # Without an index every caller waits; with one, a reload already underway is simply not repeated
+        if not self._build_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if not self._needs_load():
+                return
+            self.refresh_seconds = current_app.config.get('SEARCH_INDEX_REFRESH_SECONDS', self.refresh_seconds)
+            with self._lock:
+                self._loading = True
+                generation = self._generation
+            try:
+                self._swap_in(self._rows(), generation)
+            finally:
+                self._loading = False
+        finally:
+            self._build_lock.release()
+
+    def _reread_stale(self):
+        # Re-reads are serialised so an older read can never overwrite a newer one
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                product_ids = list(self._stale)
+                self._stale = set()
+            try:
+                rows = [row for batch in chunked(product_ids) for row in self._rows(batch)]
+            except Exception:
+                # Keep them queued so the next search tries again
+                with self._lock:
+                    self._stale.update(product_ids)
+                raise
+            with self._lock:
+                for product_id in product_ids:
+                    self._discard(product_id)
+                for row in rows:
+                    self._add(row[0], row[1], row[2:6], row[6:8])
+        finally:
+            self._build_lock.release()
+
+    def mark_stale(self, product_ids=(), category_ids=()):
+        """Queue products, or every product in the given categories, for re-indexing"""
+        with self._lock:
+            if self._loaded_at is None and not self._loading:
+                return
+            self._stale.update(product_ids)
+            for category_id in category_ids:
+                self._stale.update(self._categories.get(category_id, ()))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+
+    # --- Querying ---
+    def _expand_prefix(self, prefix):
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, prefix)
+        expansions = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def _score_term(self, postings, candidates, scores):
+        # BM25F: boost and length-normalise each field's frequency, then saturate once per term
+        idf = math.log(1 + (len(self._lengths) - len(postings) + 0.5) / (len(postings) + 0.5))
+        averages = [total / len(self._lengths) or 1.0 for total in self._field_totals]
+        boosts = [self.boosts.get(field, 1.0) for field in FIELDS]
+        if len(postings) <= len(candidates):
+            matches = [(product_id, frequencies) for product_id, frequencies in postings.items() if product_id in candidates]
+        else:
+            matches = [(product_id, postings[product_id]) for product_id in candidates if product_id in postings]
+        for product_id, frequencies in matches:
+            lengths = self._lengths[product_id][0]
+            weighted = 0.0
+            for tf, length, average, boost in zip(frequencies, lengths, averages, boosts):
+                if tf:
+                    weighted += boost * tf / (1 - B + B * length / average)
+            scores[product_id] = scores.get(product_id, 0.0) + idf * weighted / (K1 + weighted)
+
+    def search(self, text, limit=20, offset=0, after=None, sort='relevance', min_rating=None, min_reviews=None):
+        """
+        Return ``(total, hits)`` for products matching every term, best match first.
+
+        ``total`` counts all matches; ``hits`` holds ``(product_id, score)`` pairs
+        for the requested page. ``sort`` is a key of SORTS, and ``min_rating`` /
+        ``min_reviews`` drop products below those stored aggregates. ``after``
+        resumes from a previous page's last ``cursor_values`` instead of
+        skipping ``offset`` hits.
+        """
+        terms = tokenize(text)
+        if not terms:
+            return 0, []
+        self.ensure_loaded()
+        with self._lock:
+            if not self._lengths:
+                return 0, []
+
+            # Each query term becomes a group of indexed terms: itself, or its prefix expansions
+            groups = [[term] if term in self._postings else [] for term in terms[:-1]]
+            groups.append(self._expand_prefix(terms[-1]))
+            if not all(groups):
+                return 0, []
+
+            group_postings = [[self._postings[term] for term in group] for group in groups]
+            # Intersect starting from the rarest group to keep candidate sets small
+            order = sorted(range(len(groups)), key=lambda i: sum(len(p) for p in group_postings[i]))
+            candidates = None
+            for i in order:
+                matches = set()
+                for postings in group_postings[i]:
+                    matches.update(postings if candidates is None else candidates.intersection(postings))
+                candidates = matches
+                if not candidates:
+                    return 0, []
+
+            if min_rating is not None or min_reviews is not None:
+                candidates = {
+                    product_id for product_id in candidates
+                    if (min_rating is None or self._ratings[product_id][0] >= min_rating)
+                    and (min_reviews is None or self._ratings[product_id][1] >= min_reviews)
+                }
+                if not candidates:
+                    return 0, []
+
+            scores = {}
+            for postings_list in group_postings:
+                for postings in postings_list:
+                    self._score_term(postings, candidates, scores)
+            ratings = {product_id: self._ratings[product_id] for product_id in scores}
+
+        values = SORTS[sort]
+
+        def sort_key(item):
+            # Best first: every value descending, then product_id ascending
+            return tuple(-value for value in values(item[1], ratings[item[0]])) + (item[0],)
+
+        hits = scores.items()
+        if after is not None:
+            after_key = tuple(-value for value in after[:-1]) + (after[-1],)
+            hits = [hit for hit in hits if sort_key(hit) > after_key]
+        ranked = heapq.nsmallest(offset + limit, hits, key=sort_key)
+        return len(candidates), ranked[offset:]
+
+    def cursor_values(self, product_id, score, sort='relevance'):
+        """The values ``search(after=...)`` needs to resume after this hit"""
+        with self._lock:
+            rating = self._ratings.get(product_id, (0.0, 0))
+        return list(SORTS[sort](score, rating)) + [product_id]
+
+
+product_search_index = ProductSearchIndex()
+
+
+# --- Keep the index in sync with committed writes ---
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    pending = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        # A review write changes its product's stored rating aggregates
+        if isinstance(obj, ProductReview) and obj.product_id is not None:
+            if pending is None:
+                pending = session.info.setdefault(_PENDING_KEY, (set(), set()))
+            pending[0].add(obj.product_id)
+        elif isinstance(obj, Product) and obj.product_id is not None:
+            if pending is None:
+                pending = session.info.setdefault(_PENDING_KEY, (set(), set()))
+            pending[0].add(obj.product_id)
+        elif isinstance(obj, ProductCategory) and obj.category_id is not None:
+            if pending is None:
+                pending = session.info.setdefault(_PENDING_KEY, (set(), set()))
+            pending[1].add(obj.category_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_product_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        product_search_index.mark_stale(*pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,291 @@
+import math
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Shop, ShopAddress
+from utils.geo import bounding_box, haversine_batch, nearest_within, KM_PER_DEGREE
+
+# Key used to stash pending index changes on a session between flush and commit
+_PENDING_KEY = 'shop_index_changes'
+
+
+class ShopSpatialIndex:
+    """
+    In-memory grid index over shop coordinates.
+
+    Shops are bucketed into square cells of ``cell_degrees`` on a side, so a
+    radius query only measures the shops in the cells overlapping the search
+    circle and a nearest-shops query walks outwards ring by ring from the
+    caller's cell. Cells do not wrap around the antimeridian.
+
+    Reloads read Shop_Address outside the index lock and swap the new cells
+    in at once, so queries keep using the current index meanwhile; shops
+    written during the reload are applied again after the swap. Only the very
+    first load makes queries wait.
+    """
+
+    def __init__(self, cell_degrees=0.05, refresh_seconds=300):
+        self.cell_degrees = cell_degrees
+        self.refresh_seconds = refresh_seconds
+        self._cells = {}
+        self._cell_arrays = {}
+        self._points = {}
+        self._loaded_at = None
+        self._generation = 0
+        # Writes committed while a reload reads the table, replayed onto the new index; None when not reloading
+        self._changes = None
+        self._lock = threading.RLock()
+        # Held by the one thread reading Shop_Address, never while querying
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees)))
+
+    def _add(self, shop_id, lat, lon):
+        cell = self._cell(lat, lon)
+        self._points[shop_id] = (lat, lon, cell)
+        self._cells.setdefault(cell, set()).add(shop_id)
+        self._cell_arrays.pop(cell, None)
+
+    def _discard(self, shop_id):
+        point = self._points.pop(shop_id, None)
+        if point is None:
+            return
+        self._cell_arrays.pop(point[2], None)
+        bucket = self._cells.get(point[2])
+        if bucket is not None:
+            bucket.discard(shop_id)
+            if not bucket:
+                del self._cells[point[2]]
+
+    def load(self, rows):
+        """Rebuild the index from an iterable of (shop_id, latitude, longitude) rows"""
+        self._swap_in(rows, self._generation)
+
+    def _swap_in(self, rows, generation):
+        # Build the new cells aside, then replace the current ones in one step
+        fresh = ShopSpatialIndex(self.cell_degrees)
+        for shop_id, lat, lon in rows:
+            if lat is not None and lon is not None:
+                fresh._add(shop_id, float(lat), float(lon))
+        with self._lock:
+            self._cells = fresh._cells
+            self._cell_arrays = fresh._cell_arrays
+            self._points = fresh._points
+            for shop_id, lat, lon in self._changes or ():
+                self._apply(shop_id, lat, lon)
+            self._changes = None
+            # An invalidate() while the rows were read still forces the next load
+            self._loaded_at = time.monotonic() if generation == self._generation else None
+
+    def invalidate(self):
+        """Drop the index so the next query reloads it from the database"""
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+
+    def _needs_load(self):
+        return self._loaded_at is None or (
+            self.refresh_seconds and time.monotonic() - self._loaded_at >= self.refresh_seconds)
+
+    def ensure_loaded(self):
+        """Load the index from Shop_Address on first use or once it has gone stale"""
+        if not self._needs_load():
+            return
+        # Without an index every caller waits; with one, a reload already underway is simply not repeated
+        if not self._build_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if not self._needs_load():
+                return
+            self.cell_degrees = current_app.config.get('SPATIAL_INDEX_CELL_DEGREES', self.cell_degrees)
+            self.refresh_seconds = current_app.config.get('SPATIAL_INDEX_REFRESH_SECONDS', self.refresh_seconds)
+            with self._lock:
+                self._changes = []
+                generation = self._generation
+            try:
+                rows = db.session.query(
+                    ShopAddress.shop_id, ShopAddress.latitude, ShopAddress.longitude
+                ).filter(
+                    ShopAddress.shop_id.isnot(None),
+                    ShopAddress.latitude.isnot(None),
+                    ShopAddress.longitude.isnot(None)
+                ).all()
+                self._swap_in(rows, generation)
+            finally:
+                self._changes = None
+        finally:
+            self._build_lock.release()
+
+    def _apply(self, shop_id, lat, lon):
+        self._discard(shop_id)
+        if lat is not None and lon is not None:
+            self._add(shop_id, float(lat), float(lon))
+
+    def upsert(self, shop_id, lat, lon):
+        """Add a shop or move it to new coordinates"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((shop_id, lat, lon))
+            if self._loaded_at is not None:
+                self._apply(shop_id, lat, lon)
+
+    def remove(self, shop_id):
+        self.upsert(shop_id, None, None)
+
+    def _cell_range(self, lat, lon, radius_km):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        min_row, min_col = self._cell(min_lat, min_lon)
+        max_row, max_col = self._cell(max_lat, max_lon)
+        return min_row, max_row, min_col, max_col
+
+    def _arrays(self, cell):
+        # Coordinates of one cell as arrays, rebuilt lazily after the cell changes
+        arrays = self._cell_arrays.get(cell)
+        if arrays is None:
+            ids = np.fromiter(self._cells[cell], dtype=np.int64)
+            coords = np.array([self._points[shop_id][:2] for shop_id in ids], dtype=np.float64).reshape(-1, 2)
+            arrays = (ids, coords[:, 0], coords[:, 1])
+            self._cell_arrays[cell] = arrays
+        return arrays
+
+    def _gather(self, cells):
+        arrays = [self._arrays(cell) for cell in cells]
+        if not arrays:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty
+        if len(arrays) == 1:
+            return arrays[0]
+        return tuple(np.concatenate(parts) for parts in zip(*arrays))
+
+    def _candidate_cells(self, lat, lon, radius_km):
+        min_row, max_row, min_col, max_col = self._cell_range(lat, lon, radius_km)
+        box_cells = (max_row - min_row + 1) * (max_col - min_col + 1)
+        # Very large circles cover more cells than are occupied; walk the occupied ones instead
+        if box_cells > len(self._cells):
+            return [cell for cell in self._cells
+                    if min_row <= cell[0] <= max_row and min_col <= cell[1] <= max_col]
+        return [(row, col)
+                for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)
+                if (row, col) in self._cells]
+
+    def query_radius(self, lat, lon, radius_km, limit=None):
+        """Return (distance, shop_id) pairs within ``radius_km``, closest first"""
+        self.ensure_loaded()
+        with self._lock:
+            ids, lats, lons = self._gather(self._candidate_cells(lat, lon, radius_km))
+        order, distances = nearest_within(lat, lon, lats, lons, radius=radius_km, k=limit)
+        return list(zip(distances.tolist(), ids[order].tolist()))
+
+    def _ring(self, row, col, r):
+        if r == 0:
+            yield (row, col)
+            return
+        for c in range(col - r, col + r + 1):
+            yield (row - r, c)
+            yield (row + r, c)
+        for rw in range(row - r + 1, row + r):
+            yield (rw, col - r)
+            yield (rw, col + r)
+
+    def nearest(self, lat, lon, k, max_distance=None):
+        """Return up to ``k`` (distance, shop_id) pairs closest to the point, closest first"""
+        if k <= 0:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            found_ids = []
+            found_distances = []
+            found = 0
+            kth = math.inf
+
+            def consider(cells):
+                nonlocal found, kth
+                ids, lats, lons = self._gather(cells)
+                if not ids.shape[0]:
+                    return
+                found_ids.append(ids)
+                found_distances.append(haversine_batch(lat, lon, lats, lons))
+                found += ids.shape[0]
+                if found >= k:
+                    kth = np.partition(np.concatenate(found_distances), k - 1)[k - 1]
+
+            row, col = self._cell(lat, lon)
+            cell_km = self.cell_degrees * KM_PER_DEGREE
+            scanned = 0
+            r = 0
+            while True:
+                ring = [cell for cell in self._ring(row, col, r) if cell in self._cells]
+                scanned += 1 if r == 0 else 8 * r
+                consider(ring)
+                # Anything outside ring r is at least r cells away along one axis
+                bound = r * cell_km * math.cos(math.radians(min(abs(lat) + (r + 1) * self.cell_degrees, 89.9)))
+                if kth <= bound:
+                    break
+                if max_distance is not None and bound > max_distance:
+                    break
+                if scanned >= len(self._cells):
+                    # The rings now cost more than the occupied cells; finish with a direct scan
+                    consider([cell for cell in self._cells
+                              if not (row - r <= cell[0] <= row + r and col - r <= cell[1] <= col + r)])
+                    break
+                r += 1
+
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        distances = np.concatenate(found_distances)
+        keep = distances <= max_distance if max_distance is not None else slice(None)
+        ids, distances = ids[keep], distances[keep]
+        top = np.argsort(distances, kind='stable')[:k]
+        return list(zip(distances[top].tolist(), ids[top].tolist()))
+
+
+shop_index = ShopSpatialIndex()
+
+
+# --- Keep the index in sync with committed writes ---
+@event.listens_for(Session, 'after_flush')
+def _collect_shop_changes(session, flush_context):
+    pending = None
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, ShopAddress):
+            continue
+        if pending is None:
+            pending = session.info.setdefault(_PENDING_KEY, {})
+        for old_shop_id in inspect(obj).attrs.shop_id.history.deleted:
+            if old_shop_id is not None:
+                pending[old_shop_id] = None
+        if obj.shop_id is not None:
+            pending[obj.shop_id] = (obj.latitude, obj.longitude)
+    for obj in session.deleted:
+        if isinstance(obj, (Shop, ShopAddress)) and obj.shop_id is not None:
+            if pending is None:
+                pending = session.info.setdefault(_PENDING_KEY, {})
+            pending[obj.shop_id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_shop_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for shop_id, coords in pending.items():
+        if coords is None:
+            shop_index.remove(shop_id)
+        else:
+            shop_index.upsert(shop_id, *coords)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_shop_changes(session):
+    session.info.pop(_PENDING_KEY, None)
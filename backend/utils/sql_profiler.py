@@ -0,0 +1,190 @@
+import json
+import logging
+import re
+import time
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Collapse expanded IN lists and literals so statements that differ only by values share a shape
+_IN_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalise a SQL statement so repeated executions of the same query compare equal"""
+    shape = _LITERAL.sub('?', statement)
+    shape = _IN_LIST.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def describe_parameters(parameters, executemany=False):
+    """Summarise bound parameters by count and type, without their values"""
+    if executemany:
+        return f'{len(parameters)} parameter sets'
+    values = parameters.values() if isinstance(parameters, dict) else parameters or ()
+    return f'{len(values)} params ({", ".join(type(value).__name__ for value in values)})'
+
+
+class RequestProfile:
+    """Statements executed while serving one request"""
+
+    __slots__ = ('count', 'total_ms', 'shapes')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.shapes = {}
+
+    def record(self, statement, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        entry = self.shapes.get(statement)
+        if entry is None:
+            self.shapes[statement] = [1, elapsed_ms]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed_ms
+
+    def repeated(self, threshold):
+        """``[(shape, count, total_ms)]`` for statements run at least ``threshold`` times"""
+        found = {}
+        for statement, (count, elapsed_ms) in self.shapes.items():
+            if count < threshold:
+                continue
+            shape = statement_shape(statement)
+            previous = found.get(shape, (0, 0.0))
+            found[shape] = (previous[0] + count, previous[1] + elapsed_ms)
+        # Shapes can also merge after normalisation, so check the threshold again
+        return sorted(((shape, count, elapsed_ms) for shape, (count, elapsed_ms) in found.items()
+                       if count >= threshold), key=lambda item: -item[1])
+
+
+class QueryProfiler:
+    """
+    Opt-in per-request SQL accounting built on engine cursor events.
+
+    When SQL_PROFILING_ENABLED is set, each request reports its statement
+    count and DB time in X-DB-Queries / X-DB-Time-Ms headers and one JSON log
+    line, statements that repeat within a request (the N+1 lazy-load pattern)
+    are logged as warnings, and any statement slower than SQL_SLOW_QUERY_MS is
+    logged on its own. When disabled, and no other instrumentation calls
+    ``track``, no listeners are installed at all.
+
+    The current profile lives in a context variable, so it follows a request
+    onto whatever runs it: a WSGI thread, an asyncio task serving a native
+    ASGI route, and the tasks and executor calls that task starts with the
+    context copied (see utils.async_db).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_ms = 200.0
+        self.n_plus_one_threshold = 5
+        self._profile = ContextVar('query_profile', default=None)
+        self._installed = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SQL_PROFILING_ENABLED', False)
+        self.slow_query_ms = app.config.get('SQL_SLOW_QUERY_MS', self.slow_query_ms)
+        self.n_plus_one_threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', self.n_plus_one_threshold)
+        if not self.enabled:
+            return
+
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        if not logging.getLogger().handlers and not logger.handlers:
+            logger.addHandler(logging.StreamHandler())
+
+        self.track(app)
+        app.after_request(self._finish_request)
+
+    def track(self, app):
+        """Install the engine hooks and start a profile for each request of ``app``"""
+        if not self._installed:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._installed = True
+        if 'query_profiler' not in app.extensions:
+            app.extensions['query_profiler'] = self
+            app.before_request(self._start_request)
+            app.teardown_request(self._discard_request)
+
+    @property
+    def current(self):
+        """Profile of the request running in this context, or None"""
+        return self._profile.get()
+
+    def start(self):
+        """
+        Begin a profile for the request running in this context.
+
+        Returns ``(profile, token)`` for ``stop``; the profile is None when no
+        engine hooks are installed, as nothing would be recorded into it.
+        """
+        profile = RequestProfile() if self._installed else None
+        return profile, self._profile.set(profile)
+
+    def stop(self, token):
+        self._profile.reset(token)
+
+    def report(self, profile, method, path, endpoint, status):
+        """Log ``profile`` when profiling is enabled and return its response headers, else no headers"""
+        if profile is None or not self.enabled:
+            return {}
+        repeated = profile.repeated(self.n_plus_one_threshold)
+        for shape, count, elapsed_ms in repeated:
+            logger.warning('Probable N+1 in %s %s: %d x %s (%.1f ms)', method, path, count, shape[:300], elapsed_ms)
+        logger.info(json.dumps({
+            'event': 'request_sql',
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'queries': profile.count,
+            'db_time_ms': round(profile.total_ms, 2),
+            'distinct_statements': len(profile.shapes),
+            'n_plus_one': [{'statement': shape[:300], 'count': count} for shape, count, _ in repeated]
+        }))
+        return {'X-DB-Queries': str(profile.count), 'X-DB-Time-Ms': f'{profile.total_ms:.2f}'}
+
+    # --- Engine events ---
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['profiler_start'].pop()) * 1000
+        profile = self.current
+        if profile is not None:
+            profile.record(statement, elapsed_ms)
+        if self.enabled and elapsed_ms >= self.slow_query_ms:
+            # Only the shape and parameter types: values may be passwords, tokens or personal data
+            logger.warning('Slow query %.1f ms: %s | %s', elapsed_ms, statement_shape(statement),
+                           describe_parameters(parameters, executemany))
+
+    def _handle_error(self, exception_context):
+        starts = exception_context.connection.info.get('profiler_start') if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    # --- Request hooks ---
+    def _start_request(self):
+        self._profile.set(RequestProfile())
+
+    def _finish_request(self, response):
+        response.headers.update(self.report(self.current, request.method, request.path, request.endpoint,
+                                            response.status_code))
+        return response
+
+    def _discard_request(self, exception=None):
+        # Request threads are reused, so drop the profile rather than leave it to the next request
+        self._profile.set(None)
+
+
+query_profiler = QueryProfiler()